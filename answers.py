@@ -0,0 +1,197 @@
+"""
+Checking typed meanings for the kanji2meaning drill. Answers and
+meanings are normalized (case, punctuation, articles, plurals) and a
+meaning may be one of several glosses separated by semicolons, with
+parenthesized notes optional. A small typo in a long enough gloss
+still passes, unless the answer is another card's meaning.
+
+A deck may have a synonyms file next to it (kanji.csv.synonyms), each
+line a list of meanings separated by semicolons that count as the same
+answer.
+"""
+import re
+
+# The longest gloss that must be typed exactly, and the longest that
+# may have one typo; longer ones may have two.
+EXACT_LENGTH = 4
+ONE_TYPO_LENGTH = 8
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+NOTE_RE = re.compile(r'\([^)]*\)')
+
+# Dropped from the front of an answer: "a bridge", "to run".
+LEADING_WORDS = frozenset(('a', 'an', 'the', 'to'))
+
+
+def synonyms_name(filename):
+    return filename + '.synonyms'
+
+
+def stem(word):
+    # Just enough to make plurals match their singular.
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if (len(word) > 4 and word.endswith(('ches', 'shes', 'sses', 'xes', 'zes'))
+            or len(word) > 5 and word.endswith('oes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def normalize(text):
+    words = WORD_RE.findall(text.lower())
+    if len(words) > 1 and words[0] in LEADING_WORDS:
+        del words[0]
+    return ' '.join(stem(word) for word in words)
+
+
+def glosses(meaning):
+    """Return the normalized glosses of a meaning, with and without any notes."""
+    result = []
+    for gloss in meaning.split(';'):
+        texts = (gloss, NOTE_RE.sub(' ', gloss)) if '(' in gloss else (gloss,)
+        for text in texts:
+            text = normalize(text)
+            if text and text not in result:
+                result.append(text)
+    return result
+
+
+def typo_limit(gloss):
+    if len(gloss) <= EXACT_LENGTH:
+        return 0
+    return 1 if len(gloss) <= ONE_TYPO_LENGTH else 2
+
+
+def distance(a, b, limit):
+    """
+    The edit distance between two strings, counting a swap of two
+    neighbouring letters as one edit, or limit + 1 if it is more than
+    limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                d = min(d, before[j - 2] + 1)
+            cur.append(d)
+        # A swap reaches back two rows, so stop only when both are over.
+        if min(cur) > limit and min(prev) > limit:
+            return limit + 1
+        before, prev = prev, cur
+    return min(prev[-1], limit + 1)
+
+
+def load_synonyms(filename):
+    """Return the synonym groups for a deck, if it has a synonyms file."""
+    try:
+        f = open(synonyms_name(filename))
+    except FileNotFoundError:
+        return []
+    with f:
+        groups = []
+        for line in f:
+            line = line.split('#', 1)[0]
+            group = [text for text in map(normalize, line.split(';')) if text]
+            if len(group) > 1:
+                groups.append(group)
+        return groups
+
+
+class MeaningIndex(object):
+    """
+    Every normalized gloss in a catalog, with the pks of the cards that
+    have it, plus the synonyms.
+
+    Looking for other cards' meanings near an answer tries every string
+    one edit away from it, a few hundred dict lookups, which is well
+    under a millisecond however big the catalog is.
+    """
+
+    def __init__(self, cards, synonyms=()):
+        self.cards = cards
+        self.pks = {}
+        letters = set()
+        for pk, card in cards.items():
+            for gloss in glosses(card.meaning):
+                self.pks.setdefault(gloss, []).append(pk)
+                letters.update(gloss)
+        self.letters = ''.join(sorted(letters))
+        self.synonyms = {}
+        for group in synonyms:
+            for text in group:
+                self.synonyms.setdefault(text, set()).update(group)
+
+    def accepts(self, card):
+        """Return the normalized glosses a card accepts, with their synonyms."""
+        accepted = glosses(card.meaning)
+        for gloss in list(accepted):
+            accepted.extend(self.synonyms.get(gloss, ()))
+        return accepted
+
+    def meaning_of(self, text):
+        """Return the pks of the cards one of whose glosses is the normalized text."""
+        return self.pks.get(text, [])
+
+    def near(self, text):
+        """Return the pks of the cards with a gloss at most one edit from the normalized text."""
+        pks = self.pks
+        found = list(pks.get(text, ()))
+        seen = {text}
+        for candidate in edits(text, self.letters):
+            if candidate not in seen:
+                seen.add(candidate)
+                found.extend(pks.get(candidate, ()))
+        return found
+
+
+def edits(text, letters):
+    # Every string one deletion, swap, change or insertion away.
+    for i in range(len(text)):
+        yield text[:i] + text[i + 1:]
+    for i in range(len(text) - 1):
+        yield text[:i] + text[i + 1] + text[i] + text[i + 2:]
+    for i in range(len(text)):
+        head, tail = text[:i], text[i + 1:]
+        for c in letters:
+            yield head + c + tail
+    for i in range(len(text) + 1):
+        head, tail = text[:i], text[i:]
+        for c in letters:
+            yield head + c + tail
+
+
+def check_meaning(card, answer, index=None):
+    """
+    Return whether answer is right for a card's meaning. Without an index
+    of the catalog there are no synonyms, and a typo can't be told from
+    another card's meaning, so typos are allowed anyway.
+    """
+    text = normalize(answer or '')
+    if not text:
+        return False
+    accepted = index.accepts(card) if index is not None else glosses(card.meaning)
+    if text in accepted:
+        return True
+    if index is not None and any(pk != card.pk for pk in index.meaning_of(text)):
+        return False
+    return any(distance(text, gloss, typo_limit(gloss)) <= typo_limit(gloss) for gloss in accepted)
+
+
+def other_meanings(card, answer, index):
+    """
+    Return the cards of other kanji whose meaning a wrong answer is, or
+    is one typo from.
+    """
+    text = normalize(answer or '')
+    if not text:
+        return []
+    pks = index.meaning_of(text) or index.near(text)
+    others = (index.cards[pk] for pk in dict.fromkeys(pks))
+    return [other for other in others if other.kanji != card.kanji]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Time load_db.py's KANJIDIC2 and JMdict import on generated files the
+size of the real ones. The kanji and words of kanji.csv come first,
+then made-up kanji and two-kanji words read with their kanji's on
+readings, so every card finds a phrase. Reports the time, the peak
+memory of this process and the rows changed.
+"""
+
+import argparse
+import csv
+import os
+import random
+import resource
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+from bench_micro import HERE
+from kana import decode, decode_phrase, roma2hira, roma2kata, to_hiragana
+from load_db import decode_jmdict, decode_kanjidic, iter_xml_file, load_dictionaries
+
+KANJIDIC_HEAD = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE kanjidic2 [
+<!ELEMENT kanjidic2 (header,character*)>
+<!-- each <character> is one kanji -->
+]>
+<kanjidic2>
+<header><file_version>4</file_version></header>
+'''
+
+JMDICT_HEAD = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE JMdict [
+<!ELEMENT JMdict (entry*)>
+<!-- each <entry> is one word -->
+<!ENTITY n "noun (common) (futsuumeishi)">
+<!ENTITY vs "noun or participle which takes the aux. verb suru">
+]>
+<JMdict>
+'''
+
+ON_READINGS = ('カ', 'キ', 'ショウ', 'コウ', 'セイ', 'トウ', 'ハク', 'リョク', 'ガン', 'ジュ')
+
+
+def character(literal, strokes, grade, rk1, meaning, ons):
+    lines = [f'<character>\n<literal>{literal}</literal>\n<misc>\n']
+    if grade:
+        lines.append(f'<grade>{grade}</grade>\n')
+    lines.append(f'<stroke_count>{strokes}</stroke_count>\n</misc>\n')
+    if rk1:
+        lines.append(f'<dic_number>\n<dic_ref dr_type="heisig">{rk1}</dic_ref>\n'
+                     f'<dic_ref dr_type="heisig6">{rk1}</dic_ref>\n</dic_number>\n')
+    lines.append('<reading_meaning>\n<rmgroup>\n')
+    lines.extend(f'<reading r_type="ja_on">{on}</reading>\n' for on in ons)
+    lines.append(f'<meaning>{escape(meaning)}</meaning>\n<meaning m_lang="fr">?</meaning>\n')
+    lines.append('</rmgroup>\n</reading_meaning>\n</character>\n')
+    return ''.join(lines)
+
+
+def entry(seq, keb, reb, glosses, rank):
+    pri = f'<ke_pri>nf{rank:02}</ke_pri>' if rank <= 48 else ''
+    return (f'<entry>\n<ent_seq>{seq}</ent_seq>\n<k_ele>\n<keb>{keb}</keb>{pri}\n</k_ele>\n'
+            f'<r_ele>\n<reb>{reb}</reb>\n</r_ele>\n<sense>\n<pos>&n;</pos>\n'
+            + ''.join(f'<gloss>{escape(g)}</gloss>\n' for g in glosses)
+            + '</sense>\n</entry>\n')
+
+
+def generate(kanjidic, jmdict, n_kanji, n_entries, source, seed=0):
+    rng = random.Random(seed)
+    with open(source) as f:
+        r = csv.reader(f)
+        next(r)
+        rows = [row for row in r if row]
+    kanji = {}
+    for _, _, unic, mean, strok, on, rk1, *_ in rows:
+        ons = kanji.setdefault(decode(unic), (mean, strok, rk1, []))[3]
+        if on and roma2kata(on) not in ons:
+            ons.append(roma2kata(on))
+    code = 0x4e00
+    while len(kanji) < n_kanji:
+        c = chr(code)
+        code += 1
+        if c not in kanji:
+            kanji[c] = (f'kanji {code}', str(rng.randint(2, 20)), '', rng.sample(ON_READINGS, 2))
+    with open(kanjidic, 'w') as f:
+        f.write(KANJIDIC_HEAD)
+        for c, (mean, strok, rk1, ons) in kanji.items():
+            f.write(character(c, strok, rng.choice((1, 2, 3, 4, 5, 6, 8, 9, None)), rk1, mean, ons))
+        f.write('</kanjidic2>\n')
+    pool = list(kanji.items())
+    with open(jmdict, 'w') as f:
+        f.write(JMDICT_HEAD)
+        seq = 1000000
+        for row in rows:
+            if row[7]:
+                seq += 10
+                f.write(entry(seq, decode_phrase(row[7]), roma2hira(row[8]), row[9].split(';'),
+                              rng.randint(1, 60)))
+        while seq < 1000000 + 10 * n_entries:
+            seq += 10
+            (a, (_, _, _, ons_a)), (b, (_, _, _, ons_b)) = rng.sample(pool, 2)
+            reb = to_hiragana((rng.choice(ons_a) if ons_a else 'カ') + (rng.choice(ons_b) if ons_b else 'カ'))
+            f.write(entry(seq, a + b, reb, [f'word {seq}', f'meaning {seq}'], rng.randint(1, 60)))
+        f.write('</JMdict>\n')
+
+
+if __name__ == "__main__":
+
+    pars = argparse.ArgumentParser(description="Benchmark the KANJIDIC2 and JMdict import")
+    pars.add_argument('-k', '--kanji', type=int, default=13000, help="Kanji in the KANJIDIC2 file")
+    pars.add_argument('-e', '--entries', type=int, default=200000, help="Entries in the JMdict file")
+    pars.add_argument('-j', '--jobs', type=int, default=None, help="Decoding processes (default: one per CPU)")
+    pars.add_argument('-w', '--workdir', help="Directory for the files (default: a temporary one)")
+
+    args = pars.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        kanjidic = os.path.join(workdir, 'kanjidic2.xml')
+        jmdict = os.path.join(workdir, 'JMdict_e')
+        dbname = os.path.join(workdir, 'kanji.db')
+        if not (os.path.exists(kanjidic) and os.path.exists(jmdict)):
+            generate(kanjidic, jmdict, args.kanji, args.entries, os.path.join(HERE, 'kanji.csv'))
+        print(f'kanjidic2 {os.path.getsize(kanjidic) / 2**20:.1f} MB, '
+              f'JMdict {os.path.getsize(jmdict) / 2**20:.1f} MB')
+        for run in ('first', 'again'):
+            start = time.perf_counter()
+            changes = load_dictionaries(
+                dbname,
+                iter_xml_file(kanjidic, 'character', decode_kanjidic, args.jobs),
+                iter_xml_file(jmdict, 'entry', decode_jmdict, args.jobs))
+            elapsed = time.perf_counter() - start
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f'{run:<6} {elapsed:7.2f}s  peak {peak:6.0f} MB  '
+                  + ' '.join(f'{table}={count}' for table, count in changes.items()), flush=True)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Measure the memory the card catalog takes with tracemalloc, on a deck
+generated at dictionary scale. The Cards load_cards returns are compared
+with the nested dicts it used to return, which are built here the way
+it built them. Each catalog is measured after a parse of the CSV and
+after a load from the cache.
+"""
+
+import argparse
+import csv
+import gc
+import os
+import pickle
+import tempfile
+import time
+import tracemalloc
+
+from bench_micro import HERE, generate_deck
+from cards import load_cards
+from kana import ROMA2HIRA, ROMA2KATA, convert_many, decode, decode_phrase
+
+
+def dict_cards(filename):
+    """The catalog as a dict of card dicts keyed by pk strings."""
+    with open(filename) as f:
+        r = csv.reader(f)
+        next(r)
+        lines = list(r)
+    ons = convert_many((line[5] for line in lines), ROMA2KATA)
+    phr_kanas = convert_many((line[8] for line in lines), ROMA2HIRA)
+    data = {}
+    for line, on, phr_kana in zip(lines, ons, phr_kanas):
+        pk, rk2, unic, mean, strok, _, rk1, phr, _, phr_eng = line
+        data[pk] = {
+            "rk2": rk2,
+            "unicode": decode(unic),
+            "meaning": mean,
+            "strokes": strok,
+            "on": on or None,
+            "rk1": rk1,
+            "phrase": {
+                "kanji": decode_phrase(phr) if phr else None,
+                "kana": phr_kana,
+                "meaning": phr_eng
+            }
+        }
+    return data
+
+
+def dict_cards_cached(filename):
+    # The old cache was a pickle of the card dicts.
+    cachename = filename + '.dicts'
+    if not os.path.exists(cachename):
+        with open(cachename, 'wb') as f:
+            pickle.dump(dict_cards(filename), f, pickle.HIGHEST_PROTOCOL)
+    with open(cachename, 'rb') as f:
+        return pickle.load(f)
+
+
+def measure(load):
+    """Return the bytes still held by what load returns, its peak and the time taken."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    cards = load()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cards
+    return size, peak, elapsed
+
+
+def unique_meanings(filename):
+    # Rewrite a deck so no two cards share a meaning, as in a dictionary.
+    with open(filename) as f:
+        rows = list(csv.reader(f))
+    for row in rows[1:]:
+        row[3] = f'{row[3]} {row[0]}'
+    with open(filename, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+
+if __name__ == "__main__":
+
+    pars = argparse.ArgumentParser(description="Measure the memory taken by the card catalog")
+    pars.add_argument('-n', '--cards', type=int, default=200000, help="Cards in the generated deck")
+    pars.add_argument('--unique-meanings', action='store_true',
+                      help="Give every card a meaning of its own rather than repeating the deck's")
+    pars.add_argument('kanji', nargs='?', default=os.path.join(HERE, 'kanji.csv'),
+                      help="CSV whose rows the deck repeats")
+
+    args = pars.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        deck = os.path.join(workdir, 'kanji.csv')
+        generate_deck(deck, args.cards, args.kanji)
+        if args.unique_meanings:
+            unique_meanings(deck)
+        load_cards(deck)
+        dict_cards_cached(deck)
+        runs = [
+            ('dicts/parse', lambda: dict_cards(deck)),
+            ('dicts/cached', lambda: dict_cards_cached(deck)),
+            ('cards/parse', lambda: load_cards(deck, use_cache=False)),
+            ('cards/cached', lambda: load_cards(deck)),
+        ]
+        print(f'{"catalog":<14} {"held MB":>9} {"peak MB":>9} {"bytes/card":>11} {"seconds":>8}')
+        for label, load in runs:
+            size, peak, elapsed = measure(load)
+            print(f'{label:<14} {size / 2**20:9.1f} {peak / 2**20:9.1f} '
+                  f'{size / args.cards:11.0f} {elapsed:8.2f}', flush=True)
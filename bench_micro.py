@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks for the hot paths of the daily workflow: romaji
+conversion, loading the deck and the database, reading and writing the
+session, picking due cards and stats. Decks are generated from the rows
+of kanji.csv, so the suite runs offline and gives the same inputs every
+time.
+
+Results are written as JSON. Given an earlier result file as a
+baseline, benchmarks that got slower by more than the threshold are
+flagged and the exit status is 1.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+
+from bench_sim import synthetic_session
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Short and long inputs for the conversion benchmarks.
+SHORT_HIRA = 'kyoukasho'
+LONG_HIRA = 'gakkounokyoukashowoyondekaranihonnorekishinitsuitebenkyoushimashita' * 4
+SHORT_KATA = 'kyou'
+LONG_KATA = 'shoukyouryakudaijoukyou' * 8
+SHORT_PHRASE = '4e8c,4e16'
+LONG_PHRASE = ','.join(['6f22', '5b57', '3092', '52c9', '5f37', '3059', '308b'] * 20)
+
+
+def generate_deck(filename, n, source):
+    """
+    Write a deck of n rows with the columns of kanji.csv, repeating the
+    rows of source with fresh pks and frame numbers.
+    """
+    with open(source) as f:
+        r = csv.reader(f)
+        header = next(r)
+        rows = [row for row in r if row]
+    with open(filename, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        for i in range(n):
+            row = list(rows[i % len(rows)])
+            row[0] = row[1] = str(i + 1)
+            w.writerow(row)
+
+
+def generate_session(n, today):
+    session = synthetic_session(n, today, random.Random(n))
+    session.pks = array('q', range(1, n + 1))
+    return session
+
+
+def measure(func, setup=None, repeat=5, min_time=0.2):
+    """
+    Time func and return the median and minimum seconds per call over
+    repeat runs, and the loop count. Fast functions are called in a
+    loop, sized like timeit's autorange, so each run takes at least
+    min_time. If setup is given it is called before every run and func
+    is called once per run.
+    """
+    loops = 1
+    if setup is None:
+        while True:
+            t0 = time.perf_counter()
+            for _ in range(loops):
+                func()
+            if time.perf_counter() - t0 >= min_time or loops >= 1 << 20:
+                break
+            loops *= 10
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            func()
+        times.append((time.perf_counter() - t0) / loops)
+    return statistics.median(times), min(times), loops
+
+
+def conversion_benchmarks():
+    from kana import ROMA2HIRA, ROMA2KATA, convert_roma, decode_phrase
+    yield 'convert_roma/hira/short', None, lambda: convert_roma(SHORT_HIRA, ROMA2HIRA)
+    yield 'convert_roma/hira/long', None, lambda: convert_roma(LONG_HIRA, ROMA2HIRA)
+    yield 'convert_roma/kata/short', None, lambda: convert_roma(SHORT_KATA, ROMA2KATA)
+    yield 'convert_roma/kata/long', None, lambda: convert_roma(LONG_KATA, ROMA2KATA)
+    yield 'decode_phrase/short', None, lambda: decode_phrase(SHORT_PHRASE)
+    yield 'decode_phrase/long', None, lambda: decode_phrase(LONG_PHRASE)
+
+
+def deck_benchmarks(workdir, n, source):
+    """Yield (name, setup, func) for the benchmarks on a deck of n rows."""
+    from argparse import Namespace
+
+    import load_db
+    from answers import MeaningIndex, check_meaning, other_meanings
+    from cards import Card, card_cache_name, load_cards
+    from drills import DRILL_CLASSES
+    from session import current_day, load_session, save_session
+
+    import kanji
+
+    deck = os.path.join(workdir, f'deck-{n}.csv')
+    if not os.path.exists(deck):
+        generate_deck(deck, n, source)
+    record = os.path.join(workdir, f'review-{n}.dat')
+    record_json = os.path.join(workdir, f'review-{n}.json')
+    dbname = os.path.join(workdir, f'deck-{n}.db')
+    today = current_day()
+    session = generate_session(n, today)
+    save_session(session, record)
+    save_session(session, record_json)
+    cards = load_cards(deck)
+
+    def fresh_db():
+        for name in (dbname, dbname + '-wal', dbname + '-shm'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(name)
+
+    def build_indexes():
+        for cls in DRILL_CLASSES.values():
+            cls().build_index(session, cards)
+
+    drills = [cls() for cls in DRILL_CLASSES.values()]
+    for drill in drills:
+        drill.build_index(session, cards)
+
+    def get_due():
+        for drill in drills:
+            drill.filter_due(session, drill.get_due(session, today), cards)
+
+    def stats():
+        args = Namespace(kanji=deck, record=record, db=None, no_cache=False,
+                         forecast=None, pass_rate=None, new=0, watch=False,
+                         scheduler='streak', retention=0.9)
+        with open(os.devnull, 'w') as out, contextlib.redirect_stdout(out):
+            kanji.stats(args)
+
+    # Every meaning made distinct, as in a dictionary, for the meaning
+    # lookups. The answers have a swapped letter.
+    distinct = {pk: Card(*card.astuple()) for pk, card in cards.items()}
+    for pk, card in distinct.items():
+        card.meaning = f'{card.meaning} {pk}'
+    meanings = MeaningIndex(distinct)
+    card, other = distinct[n // 2], distinct[n // 3]
+    typo = card.meaning[1] + card.meaning[0] + card.meaning[2:]
+    wrong = other.meaning[1] + other.meaning[0] + other.meaning[2:]
+
+    def dump(fmt):
+        args = Namespace(kanji=deck, db=None, format=fmt, fields=None, where=None)
+        with open(os.devnull, 'w') as out, contextlib.redirect_stdout(out):
+            kanji.dump(args)
+
+    yield f'load_cards/parse/{n}', None, lambda: load_cards(deck, use_cache=False)
+    yield f'load_cards/cached/{n}', None, lambda: load_cards(deck)
+    yield (f'load_cards/rebuild_cache/{n}', lambda: os.remove(card_cache_name(deck)),
+           lambda: load_cards(deck))
+    yield f'parse_csv_file/{n}', None, lambda: load_db.parse_csv_file(deck)
+    yield (f'load_database/{n}', fresh_db,
+           lambda: load_db.load_database(dbname, load_db.iter_csv_file(deck, jobs=1)))
+    yield f'load_session/binary/{n}', None, lambda: load_session(record)
+    yield f'load_session/json/{n}', None, lambda: load_session(record_json)
+    yield f'save_session/binary/{n}', None, lambda: save_session(session, record)
+    yield f'save_session/json/{n}', None, lambda: save_session(session, record_json)
+    yield f'build_index/{n}', None, build_indexes
+    yield f'get_due/{n}', None, get_due
+    yield f'stats/{n}', None, stats
+    yield f'dump/text/{n}', None, lambda: dump('text')
+    yield f'dump/jsonl/{n}', None, lambda: dump('jsonl')
+    yield f'meaning_index/{n}', None, lambda: MeaningIndex(distinct)
+    yield f'check_meaning/{n}', None, lambda: check_meaning(card, typo, meanings)
+    yield f'other_meanings/{n}', None, lambda: other_meanings(card, wrong, meanings)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                             capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def compare(results, baseline, threshold):
+    """
+    Print each result against the baseline and return the names of the
+    benchmarks that got slower by more than threshold (a fraction). The
+    fastest runs are compared, being the least disturbed by noise.
+    """
+    old = {r["name"]: r for r in baseline["results"]}
+    slower = []
+    for r in results:
+        b = old.get(r["name"])
+        if b is None:
+            continue
+        ratio = r["min"] / b["min"]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = ' SLOWER'
+            slower.append(r["name"])
+        elif ratio < 1 - threshold:
+            flag = ' faster'
+        print(f'{r["name"]:36} {b["min"] * 1000:12.4f} -> {r["min"] * 1000:12.4f} ms '
+              f'{ratio:6.2f}x{flag}')
+    return slower
+
+
+if __name__ == "__main__":
+
+    pars = argparse.ArgumentParser(description="Run the microbenchmarks")
+    pars.add_argument('-k', '--kanji', default=os.path.join(HERE, 'kanji.csv'),
+                      help="Kanji CSV file the synthetic decks are made from")
+    pars.add_argument('-n', '--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                      help="Deck sizes in rows (1000000 works, but takes a while)")
+    pars.add_argument('-r', '--repeat', type=int, default=5, help="Timed runs per benchmark")
+    pars.add_argument('-f', '--filter', help="Only run benchmarks whose name contains this")
+    pars.add_argument('-o', '--output', help="Write the results to this JSON file")
+    pars.add_argument('-b', '--baseline', help="Compare against this earlier JSON result file")
+    pars.add_argument('-t', '--threshold', type=float, default=0.10,
+                      help="Slowdown against the baseline counted as a regression (default 0.10)")
+    pars.add_argument('-w', '--workdir',
+                      help="Keep generated decks here between runs (default: a temporary directory)")
+
+    args = pars.parse_args()
+    # Load the baseline first, so a bad path fails before the long part.
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = []
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(workdir, exist_ok=True)
+        suites = [conversion_benchmarks()]
+        suites += [deck_benchmarks(workdir, n, args.kanji) for n in args.sizes]
+        for suite in suites:
+            for name, setup, func in suite:
+                if args.filter and args.filter not in name:
+                    continue
+                median, best, loops = measure(func, setup, args.repeat)
+                results.append({"name": name, "median": median, "min": best,
+                                "repeat": args.repeat, "loops": loops})
+                print(f'{name:36} {median * 1000:12.4f} ms  (min {best * 1000:.4f}, '
+                      f'{loops} loops)', flush=True)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if baseline:
+        print()
+        slower = compare(results, baseline, args.threshold)
+        if slower:
+            print(f'{len(slower)} benchmarks slower than the baseline by over '
+                  f'{args.threshold:.0%}', file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Compare the schedulers on a simulated learner whose memory follows the
+memory model, with parameters that differ from the defaults and a
+difficulty of its own for each card. New cards join every day; each
+run reports the reviews per day once the deck has settled and the share
+of them passed, which is the retention. A streak run comes first, and
+the memory model is also fitted to its history and run with the
+fitted parameters.
+"""
+
+import argparse
+import random
+import time
+
+from drills import Meaning2KanjiDrill
+from fit import fit
+from scheduler import DEFAULT_PARAMS, MemoryScheduler, StreakScheduler, recall, update
+from session import Session
+
+# The simulated learner's memory.
+TRUE_PARAMS = dict(DEFAULT_PARAMS, first_pass=3.0, growth=1.2, decay=0.25, lapse=0.2)
+# The chance of knowing a card the first time it is asked.
+FIRST_RECALL = 0.8
+
+
+def simulate(scheduler, cards, days, new_per_day, seed):
+    """
+    Run the learner for days days and return the reviews per day over
+    the second half, the pass rate over it and the whole history.
+    """
+    rng = random.Random(seed)
+    session = Session()
+    drill = Meaning2KanjiDrill(scheduler)
+    drill.build_index(session)
+    memory = []  # per row: the learner's true (stability, difficulty, last seen)
+    history = []
+    reviews = passes = 0
+    for today in range(days):
+        for _ in range(min(new_per_day, cards - len(session))):
+            row = session.add(len(session), today)
+            drill.due_index.add(row, scheduler.due(session, drill.name, row))
+            memory.append((0.0, rng.uniform(2, 9), today))
+        for row in drill.get_due(session, today):
+            stability, difficulty, last = memory[row]
+            if stability:
+                ok = rng.random() < recall(stability, today - last)
+            else:
+                ok = rng.random() < FIRST_RECALL
+            memory[row] = update(TRUE_PARAMS, stability, difficulty, today - last, ok) + (today,)
+            streak = drill.grade(session, row, ok, today)
+            history.append((session.key(row), drill.name, streak, today))
+            if today >= days // 2:
+                reviews += 1
+                passes += ok
+    return reviews / (days - days // 2), passes / reviews if reviews else 0.0, history
+
+
+if __name__ == "__main__":
+
+    pars = argparse.ArgumentParser(description="Compare the schedulers on a simulated learner")
+    pars.add_argument('-n', '--cards', type=int, default=2000, help="Cards in the deck")
+    pars.add_argument('-d', '--days', type=int, default=365, help="Days to simulate")
+    pars.add_argument('--new', type=int, default=20, help="New cards a day until the deck is used up")
+    pars.add_argument('--retention', type=float, default=0.9, help="Target retention of the memory scheduler")
+    pars.add_argument('--seed', type=int, default=0)
+
+    args = pars.parse_args()
+
+    def report(label, scheduler):
+        per_day, retention, history = simulate(scheduler, args.cards, args.days, args.new, args.seed)
+        print(f'{label:<16} {per_day:12.1f} {retention:10.1%}', flush=True)
+        return history
+
+    print(f'{"scheduler":<16} {"reviews/day":>12} {"retention":>10}')
+    history = report('streak', StreakScheduler())
+    report('memory', MemoryScheduler(retention=args.retention))
+    t0 = time.perf_counter()
+    params, before, after, count = fit(history)
+    elapsed = time.perf_counter() - t0
+    report('memory (fitted)', MemoryScheduler(params, args.retention))
+    print(f'fit on {count} reviews in {elapsed:.2f}s: log loss {before:.4f} -> {after:.4f}')
+    print('fitted: ' + ' '.join(f'{name}={value:g}' for name, value in params.items()))
+    print('true:   ' + ' '.join(f'{name}={value:g}' for name, value in TRUE_PARAMS.items()))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Load test for the review service: run it in this process on a Unix
+socket, with a fresh records directory, and have many learners at once
+each fetch their due cards and grade them over their own connection.
+Reports requests per second and response time percentiles.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from cards import load_cards
+from server import ReviewService, serve
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class Client(object):
+    """A keep-alive HTTP connection to the service."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, path):
+        return cls(*await asyncio.open_unix_connection(path))
+
+    async def request(self, method, target, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.writer.write(f'{method} {target} HTTP/1.1\r\nHost: localhost\r\n'
+                          f'Content-Length: {len(data)}\r\n\r\n'.encode() + data)
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        result = json.loads(await self.reader.readexactly(length))
+        if status != 200:
+            raise RuntimeError(f'{method} {target}: {status} {result}')
+        return result
+
+    def close(self):
+        self.writer.close()
+
+
+async def learner(path, name, rounds, batch, pass_rate, rng, latencies):
+    client = await Client.connect(path)
+    try:
+        for _ in range(rounds):
+            drill = rng.choice(('m2k', 'k2m', 'p2o'))
+            t0 = time.perf_counter()
+            due = await client.request('GET', f'/learners/{name}/due?drill={drill}&limit={batch}')
+            latencies.append(time.perf_counter() - t0)
+            for card in due["cards"]:
+                t0 = time.perf_counter()
+                await client.request('POST', f'/learners/{name}/grade',
+                                     {"drill": drill, "pk": card["pk"],
+                                      "ok": rng.random() < pass_rate})
+                latencies.append(time.perf_counter() - t0)
+    finally:
+        client.close()
+
+
+async def run(cards, records, learners, rounds, batch, pass_rate, max_learners, seed):
+    path = os.path.join(records, 'service.sock')
+    service = ReviewService(cards, records, max_learners)
+    ready = asyncio.get_running_loop().create_future()
+    server = asyncio.ensure_future(serve(service, unix=path, ready=ready))
+    await ready
+    latencies = []
+    rng = random.Random(seed)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(learner(path, f'learner{i}', rounds, batch, pass_rate,
+                                   random.Random(rng.random()), latencies)
+                           for i in range(learners)))
+    elapsed = time.perf_counter() - t0
+    server.cancel()
+    try:
+        await server
+    except asyncio.CancelledError:
+        pass
+    return elapsed, latencies
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+if __name__ == "__main__":
+
+    pars = argparse.ArgumentParser(description="Load test the review service")
+    pars.add_argument('-k', '--kanji', default=os.path.join(HERE, 'kanji.csv'), help="Kanji CSV file")
+    pars.add_argument('-c', '--learners', type=int, default=200, help="Concurrent learners")
+    pars.add_argument('-r', '--rounds', type=int, default=5, help="Due/grade rounds per learner")
+    pars.add_argument('-b', '--batch', type=int, default=10, help="Cards fetched per round")
+    pars.add_argument('-p', '--pass-rate', type=float, default=0.85, help="Chance of answering correctly")
+    pars.add_argument('-m', '--max-learners', type=int, default=1000,
+                      help="Sessions the service keeps in memory (lower it to test eviction)")
+    pars.add_argument('--seed', type=int, default=0)
+
+    args = pars.parse_args()
+    cards = load_cards(args.kanji)
+    with tempfile.TemporaryDirectory() as records:
+        elapsed, latencies = asyncio.run(run(cards, records, args.learners, args.rounds, args.batch,
+                                             args.pass_rate, args.max_learners, args.seed))
+    latencies.sort()
+    print(f'{len(latencies)} requests from {args.learners} learners in {elapsed:.2f}s: '
+          f'{len(latencies) / elapsed:.0f} requests/s')
+    print(f'latency ms: median {statistics.median(latencies) * 1000:.2f}  '
+          f'p90 {percentile(latencies, 90) * 1000:.2f}  '
+          f'p99 {percentile(latencies, 99) * 1000:.2f}  max {latencies[-1] * 1000:.2f}')
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Simulate months or years of daily reviews on synthetic decks, with a
+fake clock and scripted answers, and report how fast the scheduling
+and storage paths are: picking the due cards, grading and saving the
+session. With the default limit a deck's backlog of due cards grows,
+so big decks show the cost of get_due over a large backlog.
+"""
+
+import argparse
+import math
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from array import array
+from collections.abc import Mapping
+
+from cards import load_cards
+from drills import DRILL_CLASSES, Deck, ScriptedReviewer
+from session import AGE_FACTOR, DRILL_NAMES, Session, current_day, save_session
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class SyntheticCards(Mapping):
+    """
+    A deck of n cards keyed 0..n-1, each a copy of one of the real
+    cards. Cards are shared, so a million of them cost next to nothing.
+    """
+
+    def __init__(self, n, templates):
+        self.n = n
+        self.templates = templates
+
+    def __getitem__(self, k):
+        i = int(k)
+        if not 0 <= i < self.n:
+            raise KeyError(k)
+        return self.templates[i % len(self.templates)]
+
+    def __iter__(self):
+        return iter(range(self.n))
+
+    def __len__(self):
+        return self.n
+
+
+def synthetic_session(n, today, rng, max_streak=8):
+    """
+    Return a session of n cards with a random history in every drill,
+    spread so that reviews come due evenly over the following days.
+    """
+    session = Session()
+    session.pks = array('q', range(n))
+    for name in DRILL_NAMES:
+        streaks = array('i', (rng.randint(0, max_streak) for _ in range(n)))
+        lasts = array('i', (today - rng.randint(0, math.ceil(AGE_FACTOR * s)) for s in streaks))
+        session.columns[name] = (streaks, lasts)
+    return session
+
+
+def simulate(n, days, limit, pass_rate, save_every, templates, seed, tmpdir):
+    rng = random.Random(seed)
+    random.seed(seed)
+    start = current_day()
+    cards = SyntheticCards(n, templates)
+
+    tracemalloc.start()
+    session = synthetic_session(n, start, rng)
+    drills = [cls() for cls in DRILL_CLASSES.values()]
+    for drill in drills:
+        drill.build_index(session, cards)
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    reviewer = ScriptedReviewer(
+        lambda drill, card: drill.correct_answer(card) if rng.random() < pass_rate else '')
+    filename = os.path.join(tmpdir, f'sim-{n}.dat')
+    due_time = grade_time = save_time = 0.0
+    due_calls = grades = saves = 0
+    for today in range(start, start + days):
+        for drill in drills:
+            t0 = time.perf_counter()
+            # Picking the day's reviews, as Drill.run does.
+            deck = Deck(drill, cards, session)
+            deck.count_due(today)
+            due = [row for _, _, _, row in deck.iter_due(today, 0, limit or None)]
+            t1 = time.perf_counter()
+            for i, row in enumerate(due):
+                card = cards[session.key(row)]
+                ok = drill.check(card, reviewer.ask(drill, card, i, len(due)))
+                drill.grade(session, row, ok, today)
+            t2 = time.perf_counter()
+            due_time += t1 - t0
+            grade_time += t2 - t1
+            due_calls += 1
+            grades += len(due)
+        if (today - start + 1) % save_every == 0:
+            t0 = time.perf_counter()
+            save_session(session, filename)
+            save_time += time.perf_counter() - t0
+            saves += 1
+    return {
+        "cards": n,
+        "days": days,
+        "due_ms": 1000 * due_time / due_calls,
+        "grades_per_s": grades / grade_time if grade_time else 0.0,
+        "save_ms": 1000 * save_time / saves if saves else 0.0,
+        "build_mb": memory / 2**20,
+        # The peak for the whole run so far; ru_maxrss is in kilobytes on
+        # Linux.
+        "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+if __name__ == "__main__":
+
+    pars = argparse.ArgumentParser(description="Simulate daily reviews on synthetic decks")
+    pars.add_argument('-k', '--kanji', default=os.path.join(HERE, 'kanji.csv'),
+                      help="Kanji CSV file the synthetic cards are copied from")
+    pars.add_argument('-n', '--cards', type=int, nargs='+', default=[1000, 10000, 100000],
+                      help="Deck sizes to simulate")
+    pars.add_argument('-d', '--days', type=int, default=90, help="Days to simulate")
+    pars.add_argument('-l', '--limit', type=int, default=200, help="Reviews per drill per day (0 for all due)")
+    pars.add_argument('-p', '--pass-rate', type=float, default=0.85, help="Chance of answering correctly")
+    pars.add_argument('--save-every', type=int, default=30, help="Save the session every this many days")
+    pars.add_argument('--seed', type=int, default=0)
+
+    args = pars.parse_args()
+    templates = list(load_cards(args.kanji).values())
+    print(f'{"cards":>8} {"days":>5} {"get_due ms":>10} {"grades/s":>9} {"save ms":>8} '
+          f'{"build MB":>9} {"maxrss MB":>9}')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n in args.cards:
+            r = simulate(n, args.days, args.limit, args.pass_rate, args.save_every,
+                         templates, args.seed, tmpdir)
+            print(f'{r["cards"]:8} {r["days"]:5} {r["due_ms"]:10.3f} {r["grades_per_s"]:9.0f} '
+                  f'{r["save_ms"]:8.2f} {r["build_mb"]:9.1f} {r["maxrss_mb"]:9.1f}', flush=True)
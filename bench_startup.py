@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Time how long kanji.py subcommands take to start and finish. Each
+command is run in a fresh interpreter, since interpreter start-up and
+imports are most of what a one-shot command costs.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+COMMANDS = {
+    'python': [],
+    'uni': ['kanji.py', 'uni', '漢'],
+    'roma': ['kanji.py', 'roma', 'kyoukasho'],
+    'dump': ['kanji.py', 'dump'],
+    'stats': ['kanji.py', 'stats'],
+}
+
+
+def time_command(argv, repeat):
+    """Return the median wall time of running argv, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + argv, cwd=HERE, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+
+    pars = argparse.ArgumentParser(description="Benchmark kanji.py start-up time")
+    pars.add_argument('commands', nargs='*', metavar='command',
+                      help="Commands to time: %s (default: all)" % ', '.join(COMMANDS))
+    pars.add_argument('-n', '--repeat', type=int, default=20, help="Runs per command")
+    pars.add_argument('--max-ms', type=float, default=None,
+                      help="Exit with status 1 if a command's overhead over bare python exceeds this")
+
+    args = pars.parse_args()
+    names = args.commands or list(COMMANDS)
+    for name in names:
+        if name not in COMMANDS:
+            pars.error(f'unknown command {name!r}')
+    base = time_command(['-c', 'pass'], args.repeat)
+    failed = False
+    for name in names:
+        if name == 'python':
+            ms = base
+        else:
+            ms = time_command(COMMANDS[name], args.repeat)
+        over = ms - base
+        flag = ''
+        if args.max_ms is not None and name != 'python' and over > args.max_ms:
+            flag = ' SLOW'
+            failed = True
+        print(f'{name:8} {ms:7.1f} ms  (+{over:.1f} ms){flag}')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,265 @@
+"""
+The card type, and loading the card catalog from the kanji CSV, through
+its cache.
+"""
+import csv
+import hashlib
+import io
+import itertools
+import os
+import pickle
+from collections.abc import Mapping
+
+import metrics
+from kana import ROMA2HIRA, ROMA2KATA, convert_many, decode, decode_phrase
+
+
+# Bump this whenever the layout of the cards changes so that stale
+# catalog caches are rebuilt.
+CARD_CACHE_VERSION = 3
+CARD_CACHE_MAGIC = b'KANJI-CARDS\n'
+
+# Rows parsed at a time by iter_cards.
+PARSE_BATCH = 4096
+
+
+def number(value):
+    # How a number field of a card was written in the CSV.
+    return '' if value is None else str(value)
+
+
+def to_int(s):
+    return int(s) if s else None
+
+
+class Card(Mapping):
+    """
+    One card: an RK2 frame with its kanji, RK1 frame and phrase. Cards
+    have slots rather than a dict each, numbers as ints, and share their
+    repeated strings, which keeps a dictionary-sized catalog small.
+
+    A card is also a read-only mapping with the keys of the card dicts
+    load_cards used to return, with the numbers as strings, so
+    card["meaning"] and card["phrase"]["kana"] still work while callers
+    move over to the attributes.
+    """
+
+    __slots__ = ('pk', 'rk2', 'kanji', 'meaning', 'strokes', 'on', 'rk1',
+                 'phrase', 'phrase_kana', 'phrase_meaning')
+
+    def __init__(self, pk, rk2, kanji, meaning, strokes, on, rk1, phrase, phrase_kana,
+                 phrase_meaning):
+        self.pk = pk
+        self.rk2 = rk2
+        self.kanji = kanji
+        self.meaning = meaning
+        self.strokes = strokes
+        self.on = on
+        self.rk1 = rk1
+        self.phrase = phrase
+        self.phrase_kana = phrase_kana
+        self.phrase_meaning = phrase_meaning
+
+    def astuple(self):
+        return (self.pk, self.rk2, self.kanji, self.meaning, self.strokes, self.on, self.rk1,
+                self.phrase, self.phrase_kana, self.phrase_meaning)
+
+    def __reduce__(self):
+        return Card, self.astuple()
+
+    def __repr__(self):
+        return f'Card{self.astuple()!r}'
+
+    def __eq__(self, other):
+        if isinstance(other, Card):
+            return self.astuple() == other.astuple()
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __getitem__(self, key):
+        try:
+            get = CARD_ITEMS[key]
+        except KeyError:
+            raise KeyError(key) from None
+        return get(self)
+
+    def __iter__(self):
+        return iter(CARD_ITEMS)
+
+    def __len__(self):
+        return len(CARD_ITEMS)
+
+    def to_dict(self):
+        """Return the card as a plain dict of the mapping's keys, for JSON."""
+        return dict(self, phrase=dict(self["phrase"]))
+
+
+class PhraseView(Mapping):
+    """The card["phrase"] mapping of a card."""
+
+    __slots__ = ('card',)
+
+    def __init__(self, card):
+        self.card = card
+
+    def __getitem__(self, key):
+        if key == 'kanji':
+            return self.card.phrase
+        if key == 'kana':
+            return self.card.phrase_kana
+        if key == 'meaning':
+            return self.card.phrase_meaning
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(('kanji', 'kana', 'meaning'))
+
+    def __len__(self):
+        return 3
+
+
+CARD_ITEMS = {
+    'rk2': lambda card: number(card.rk2),
+    'unicode': lambda card: card.kanji,
+    'meaning': lambda card: card.meaning,
+    'strokes': lambda card: number(card.strokes),
+    'on': lambda card: card.on,
+    'rk1': lambda card: number(card.rk1),
+    'phrase': PhraseView,
+}
+
+
+def card_cache_name(filename):
+    return filename + '.cache'
+
+
+def load_cards(filename, use_cache=True):
+    """
+    Load the cards of a CSV file, as a dict of Cards by integer pk. Parsing is slow on big decks and
+    gives the same answer every time, so the result is kept in a binary
+    snapshot next to the CSV, keyed by the CSV's path, size, mtime and
+    content hash. The snapshot is rebuilt whenever the CSV changes.
+    """
+    if not use_cache:
+        with open(filename) as f:
+            return parse_cards(f)
+
+    st = os.stat(filename)
+    path = os.path.abspath(filename)
+    cachename = card_cache_name(filename)
+    header = None
+    try:
+        with open(cachename, 'rb') as f:
+            blob = f.read()
+        if blob.startswith(CARD_CACHE_MAGIC):
+            stream = io.BytesIO(blob)
+            stream.seek(len(CARD_CACHE_MAGIC))
+            header = pickle.load(stream)
+            if header["version"] != CARD_CACHE_VERSION:
+                header = None
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        header = None
+
+    if (header and header["path"] == path and header["size"] == st.st_size
+        and header["mtime"] == st.st_mtime_ns):
+        metrics.count('card_cache_hits')
+        return cards_from_rows(pickle.load(stream))
+
+    # The cheap checks failed, so look at the content. If only the mtime
+    # moved (a touch, a fresh checkout) the snapshot is still good.
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+    if header and header["digest"] == digest:
+        metrics.count('card_cache_content_hits')
+        data = cards_from_rows(pickle.load(stream))
+    else:
+        metrics.count('card_cache_misses')
+        data = parse_cards(io.TextIOWrapper(io.BytesIO(raw)))
+    header = {
+        "version": CARD_CACHE_VERSION,
+        "path": path,
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+        "digest": digest
+    }
+    save_card_cache(cachename, header, data)
+    return data
+
+
+def cards_from_rows(rows):
+    # The cache holds each card as a plain tuple, which unpickles far
+    # faster than objects; pickle keeps the strings shared.
+    return {row[0]: Card(*row) for row in rows}
+
+
+def save_card_cache(cachename, header, data):
+    # Write to a temporary file and rename it into place so a reader
+    # never sees a half-written snapshot. A deck in a read-only directory
+    # just goes without a cache.
+    tmpname = f'{cachename}.{os.getpid()}.tmp'
+    try:
+        with open(tmpname, 'wb') as f:
+            f.write(CARD_CACHE_MAGIC)
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump([card.astuple() for card in data.values()], f, pickle.HIGHEST_PROTOCOL)
+            metrics.count('bytes_written', f.tell())
+        os.replace(tmpname, cachename)
+    except OSError:
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+
+
+def iter_cards(filename, batch=PARSE_BATCH):
+    """
+    Yield (pk, card) for each row of a CSV file without building the
+    catalog, parsing a batch of rows at a time so readings are still
+    converted in bulk.
+    """
+    with open(filename) as f:
+        r = csv.reader(f)
+        next(r)  # the header
+        while True:
+            lines = list(itertools.islice(r, batch))
+            if not lines:
+                break
+            yield from parse_rows(lines).items()
+
+
+def parse_cards(f):
+    r = csv.reader(f)
+    header = next(r)
+    return parse_rows(list(r))
+
+
+def parse_rows(lines):
+    """Return the cards of a list of CSV rows, without the header, by pk."""
+    metrics.count('rows_parsed', len(lines))
+    # Convert the readings in two batches rather than twice per row.
+    ons = convert_many((line[5] for line in lines), ROMA2KATA)
+    phr_kanas = convert_many((line[8] for line in lines), ROMA2HIRA)
+    # Kanji, readings and phrases repeat a lot over a deck, and so do
+    # meanings in a dictionary; every card shares one copy of each. The
+    # codes are decoded through caches of their own, since some text may
+    # be spelled just like a code.
+    kanji = {}
+    phrases = {'': None}
+    strings = {}
+    share = strings.setdefault
+    data = {}
+    for line, on, phr_kana in zip(lines, ons, phr_kanas):
+        pk, rk2, unic, mean, strok, _, rk1, phr, _, phr_eng = line
+        pk = int(pk)
+        if unic not in kanji:
+            kanji[unic] = decode(unic)
+        unic = kanji[unic]
+        if phr not in phrases:
+            phrases[phr] = decode_phrase(phr)
+        phr = phrases[phr]
+        data[pk] = Card(pk, to_int(rk2), unic, share(mean, mean), to_int(strok),
+                        share(on, on) or None, to_int(rk1), phr, share(phr_kana, phr_kana),
+                        share(phr_eng, phr_eng))
+    return data
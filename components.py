@@ -0,0 +1,144 @@
+"""
+Kanji components (radicals and other parts) from a KRADFILE, and a
+bitset index for the components command: which kanji contain all of
+these parts.
+"""
+import bisect
+import itertools
+
+# The original KRADFILE is EUC-JP; kradfile-u and kradfile2 exports are
+# often UTF-8.
+KRADFILE_ENCODINGS = ('utf-8', 'euc_jp')
+
+# Kanji of unknown stroke count sort after all the others.
+UNKNOWN_STROKES = 1 << 16
+
+
+def read_kradfile(filename):
+    """
+    Return the (kanji, components) pairs of a KRADFILE, whose lines look
+    like '亜 : ｜ 一 口', with comments starting with #.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    for encoding in KRADFILE_ENCODINGS:
+        try:
+            text = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise ValueError(f'{filename} is neither UTF-8 nor EUC-JP')
+    entries = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        if not line.strip() or line.startswith('#'):
+            continue
+        kanji, sep, parts = line.partition(':')
+        kanji = kanji.strip()
+        if not sep or len(kanji) != 1:
+            raise ValueError(f'{filename}:{lineno}: not a KRADFILE line: {line!r}')
+        entries.append((kanji, parts.split()))
+    return entries
+
+
+def read_db_components(con):
+    """
+    Return the (kanji, components) pairs in a database, and a dict of
+    the stroke counts known for them.
+    """
+    cur = con.execute(
+        "SELECT k.unicode, k.strokes, c.unicode FROM kanji_component kc "
+        "JOIN kanji k ON k.id = kc.kanji_id JOIN component c ON c.id = kc.component_id "
+        "ORDER BY kc.kanji_id")
+    entries = []
+    strokes = {}
+    for (kanji, count), rows in itertools.groupby(cur, key=lambda row: row[:2]):
+        entries.append((kanji, [component for _, _, component in rows]))
+        if count:
+            strokes[kanji] = count
+    return entries, strokes
+
+
+def parse_strokes(spec):
+    """Return the (low, high) stroke counts of '7', '5-8', '10-' or '-4'."""
+    low, sep, high = spec.partition('-')
+    try:
+        low = int(low) if low else 0
+        high = int(high) if high else (UNKNOWN_STROKES - 1 if sep else low)
+    except ValueError:
+        raise ValueError(f'strokes wants a number or a range like 5-8, not {spec}')
+    return low, high
+
+
+def bitmap(bits, size):
+    """Return an int with the given bits set, built a byte at a time."""
+    data = bytearray((size + 7) // 8)
+    for bit in bits:
+        data[bit >> 3] |= 1 << (bit & 7)
+    return int.from_bytes(data, 'little')
+
+
+def set_bits(n):
+    """Return the positions of the bits set in n, lowest first."""
+    data = n.to_bytes((n.bit_length() + 7) // 8, 'little')
+    bits = []
+    for i, byte in enumerate(data):
+        if byte:
+            bits.extend(8 * i + j for j in range(8) if byte >> j & 1)
+    return bits
+
+
+class ComponentIndex(object):
+    """
+    One bitmap per component, with a bit set for each kanji containing
+    it. The bitmaps are ints, so intersecting them is a loop in C over a
+    couple of kilobytes, even for the full set of some 13,000 kanji.
+
+    Kanji are numbered in order of stroke count, so a stroke range is a
+    run of bits, one mask, and the matches come out ordered by strokes.
+    """
+
+    def __init__(self, entries, strokes=None):
+        strokes = strokes or {}
+        self.components = dict(entries)
+        self.kanji = sorted(self.components,
+                            key=lambda k: (strokes.get(k) or UNKNOWN_STROKES, k))
+        self.strokes = [strokes.get(k) for k in self.kanji]
+        self.sorted_strokes = [s or UNKNOWN_STROKES for s in self.strokes]
+        bit = {k: i for i, k in enumerate(self.kanji)}
+        members = {}
+        for kanji, parts in entries:
+            for part in parts:
+                members.setdefault(part, []).append(bit[kanji])
+        size = len(self.kanji)
+        self.bitmaps = {part: bitmap(bits, size) for part, bits in members.items()}
+        self.all = (1 << size) - 1
+
+    def __len__(self):
+        return len(self.kanji)
+
+    def stroke_mask(self, low, high):
+        # The run of kanji with low to high strokes.
+        start = bisect.bisect_left(self.sorted_strokes, low)
+        end = bisect.bisect_right(self.sorted_strokes, high)
+        return ((1 << end) - 1) ^ ((1 << start) - 1)
+
+    def match(self, parts, strokes=None):
+        """
+        Return the kanji containing every one of parts, in stroke order,
+        optionally only those with a (low, high) number of strokes. A
+        part may also be a kanji, standing for all its components.
+        """
+        hits = self.all
+        for part in parts:
+            bitmap = self.bitmaps.get(part)
+            if bitmap is not None:
+                hits &= bitmap
+            elif part in self.components:
+                for component in self.components[part]:
+                    hits &= self.bitmaps[component]
+            else:
+                raise ValueError(f'{part} is not a component or a kanji with components')
+        if strokes is not None:
+            hits &= self.stroke_mask(*strokes)
+        return [self.kanji[i] for i in set_bits(hits)]
@@ -0,0 +1,234 @@
+"""
+SQLite backend for cards and drill history.
+"""
+import itertools
+import operator
+import os
+import sqlite3
+from array import array
+from collections.abc import Mapping
+
+from cards import Card
+from session import DRILL_NAMES, current_day, due_day
+
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+# Columns added to tables after they were first created, which
+# CREATE TABLE IF NOT EXISTS leaves out of older databases.
+ADDED_COLUMNS = (
+    ('phrase', 'unicode', 'TEXT'),
+)
+
+
+def open_db(dbname):
+    # The schema is idempotent, so applying it also upgrades databases
+    # created before the review_state table and indexes existed.
+    con = sqlite3.connect(dbname)
+    with open(SCHEMA_FILE) as f:
+        con.executescript(f.read())
+    for table, column, decl in ADDED_COLUMNS:
+        if column not in [row[1] for row in con.execute(f"PRAGMA table_info({table})")]:
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return con
+
+
+# A card is an RK2 frame, joined to its kanji, RK1 frame and phrase.
+CARD_QUERY = """
+SELECT f2.id, f2.frame_number, k.unicode, f1.meaning, k.strokes, f2.kana,
+       f1.frame_number, p.unicode, p.hiragana, p.meaning
+FROM frame_v2_4 f2
+JOIN kanji k ON k.id = f2.kanji_id
+LEFT JOIN frame_v1_6 f1 ON f1.kanji_id = f2.kanji_id
+LEFT JOIN phrase p ON p.id = f2.phrase_id
+"""
+
+
+def db_card(row):
+    # Build the same Card load_cards makes from a CSV row.
+    pk, rk2, unic, mean, strok, on, rk1, phr, phr_kana, phr_eng = row
+    return Card(pk, rk2, unic, mean or '', strok, on or None, rk1, phr or None,
+                phr_kana or '', phr_eng or '')
+
+
+class DbCards(Mapping):
+    """
+    The cards in a database, keyed like load_cards. Cards are fetched by
+    primary key when first looked up, so a command only reads the rows
+    it actually uses.
+    """
+
+    def __init__(self, con):
+        self.con = con
+        self.cache = {}
+
+    def __getitem__(self, k):
+        try:
+            return self.cache[k]
+        except KeyError:
+            pass
+        try:
+            k = int(k)
+        except (TypeError, ValueError):
+            raise KeyError(k) from None
+        row = self.con.execute(CARD_QUERY + "WHERE f2.id = ?", (k,)).fetchone()
+        if row is None:
+            raise KeyError(k)
+        card = self.cache[k] = db_card(row)
+        return card
+
+    def __iter__(self):
+        for (pk,) in self.con.execute("SELECT id FROM frame_v2_4 ORDER BY id"):
+            yield pk
+
+    def __len__(self):
+        return self.con.execute("SELECT count(*) FROM frame_v2_4").fetchone()[0]
+
+    def values(self):
+        # Stream every card in one query rather than one query per key.
+        for row in self.con.execute(CARD_QUERY + "ORDER BY f2.id"):
+            yield db_card(row)
+
+    def items(self):
+        for row in self.con.execute(CARD_QUERY + "ORDER BY f2.id"):
+            yield row[0], db_card(row)
+
+
+class SqlDueIndex(object):
+    """
+    The DueIndex interface answered by range scans over the (drill, due)
+    index of review_state.
+    """
+
+    # The join leaves out the cards the drill doesn't want.
+    filtered = True
+
+    def __init__(self, con, name, needs_on=False):
+        self.con = con
+        self.name = name
+        if needs_on:
+            self.join = "JOIN frame_v2_4 f ON f.id = r.card_id AND f.kana <> '' "
+        else:
+            self.join = ""
+
+    def due(self, today):
+        cur = self.con.execute(
+            f"SELECT r.card_id FROM review_state r {self.join}"
+            "WHERE r.drill = ? AND r.due <= ?", (self.name, today))
+        return [row for (row,) in cur]
+
+    def bands(self, today):
+        cur = self.con.execute(
+            f"SELECT r.due, r.card_id FROM review_state r {self.join}"
+            "WHERE r.drill = ? AND r.due <= ? ORDER BY r.due", (self.name, today))
+        for day, rows in itertools.groupby(cur, key=operator.itemgetter(0)):
+            yield day, [row for _, row in rows]
+
+    def count(self, today):
+        cur = self.con.execute(
+            f"SELECT count(*) FROM review_state r {self.join}"
+            "WHERE r.drill = ? AND r.due <= ?", (self.name, today))
+        return cur.fetchone()[0]
+
+    def move(self, row, old, new):
+        # DbSession.set has already updated the due column.
+        pass
+
+    def schedule(self, today, n):
+        sched = [0] * n
+        cur = self.con.execute(
+            f"SELECT max(r.due - ?, 0), count(*) FROM review_state r {self.join}"
+            "WHERE r.drill = ? AND r.due < ? GROUP BY 1",
+            (today, self.name, today + n))
+        for days, count in cur:
+            sched[days] += count
+        return sched
+
+
+class DbSession(object):
+    """
+    Drill history kept in the review_state table, with the same interface
+    as Session. Rows are card ids. There is no journal: grades are
+    written as they are made and committed together by save(), so a
+    review pays for one sync rather than one per answer.
+    """
+
+    def __init__(self, con):
+        self.con = con
+
+    def __len__(self):
+        cur = self.con.execute("SELECT count(*) FROM review_state WHERE drill = ?",
+                               (DRILL_NAMES[0],))
+        return cur.fetchone()[0]
+
+    def __contains__(self, k):
+        cur = self.con.execute("SELECT 1 FROM review_state WHERE card_id = ?", (int(k),))
+        return cur.fetchone() is not None
+
+    def key(self, row):
+        return row
+
+    def get(self, name, row):
+        cur = self.con.execute(
+            "SELECT streak, last FROM review_state WHERE card_id = ? AND drill = ?",
+            (row, name))
+        return cur.fetchone() or (0, current_day())
+
+    def set(self, name, row, streak, last):
+        self.con.execute(
+            "INSERT OR REPLACE INTO review_state (card_id, drill, streak, last, due) "
+            "VALUES (?, ?, ?, ?, ?)", (row, name, streak, last, due_day(streak, last)))
+
+    def add(self, k, today=None):
+        if today is None:
+            today = current_day()
+        self.con.executemany(
+            "INSERT OR IGNORE INTO review_state (card_id, drill, streak, last, due) "
+            "VALUES (?, ?, 0, ?, ?)", [(int(k), name, today, today) for name in DRILL_NAMES])
+        self.con.commit()
+        return int(k)
+
+    def update(self, cards):
+        # load_db makes the review_state rows of the frames it writes, so
+        # this only starts tracking frames added some other way past the
+        # last one tracked: two range scans on the primary keys rather
+        # than a pass over the deck.
+        (last,) = self.con.execute("SELECT max(card_id) FROM review_state").fetchone()
+        today = current_day()
+        self.con.executemany(
+            "INSERT OR IGNORE INTO review_state (card_id, drill, streak, last, due) "
+            "SELECT id, ?, 0, ?, ? FROM frame_v2_4 WHERE id > ?",
+            [(name, today, today, last or 0) for name in DRILL_NAMES])
+        self.con.commit()
+
+    def column(self, name):
+        streaks = array('i')
+        lasts = array('i')
+        for streak, last in self.con.execute(
+                "SELECT streak, last FROM review_state WHERE drill = ?", (name,)):
+            streaks.append(streak)
+            lasts.append(last)
+        return streaks, lasts
+
+    def drill_columns(self, drill, cards):
+        if not drill.needs_on:
+            return self.column(drill.name)
+        streaks = array('i')
+        lasts = array('i')
+        for streak, last in self.con.execute(
+                "SELECT r.streak, r.last FROM review_state r "
+                "JOIN frame_v2_4 f ON f.id = r.card_id AND f.kana <> '' "
+                "WHERE r.drill = ?", (drill.name,)):
+            streaks.append(streak)
+            lasts.append(last)
+        return streaks, lasts
+
+    def build_index(self, drill, cards=None):
+        return SqlDueIndex(self.con, drill.name, drill.needs_on)
+
+    def build_indexes(self, drills, cards=None):
+        return [self.build_index(drill, cards) for drill in drills]
+
+    def save(self, filename=None):
+        self.con.commit()
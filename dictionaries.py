@@ -0,0 +1,178 @@
+"""
+Streaming readers for the KANJIDIC2 and JMdict XML files, for
+load_db.py. The files are cut into batches of whole records as raw
+bytes, without parsing them, and each batch is parsed on its own (in a
+worker process, for big files) with the file's prologue in front, so
+its DTD entities still resolve. Only one batch is ever held as a tree.
+"""
+import xml.etree.ElementTree as ElementTree
+from xml.parsers import expat
+
+from kana import to_hiragana
+
+
+# Records are parsed in batches of this many.
+RECORD_BATCH = 2000
+
+READ_SIZE = 1 << 20
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+# How common a JMdict writing or reading is, from its ke_pri or re_pri
+# codes: nf01 to nf48 rank the most common 24,000 words by frequency
+# band, and a word on one of the other lists without one comes after.
+UNRANKED = 100
+LIST_RANKS = {'1': 49, '2': 60}
+
+
+def is_kanji(c):
+    # The CJK ideograph blocks: unified, extension A, compatibility and
+    # the supplementary planes.
+    return ('\u3400' <= c <= '\u9fff' or '\uf900' <= c <= '\ufaff'
+            or '\U00020000' <= c <= '\U0003134f')
+
+
+def read_head(f, tag):
+    """
+    Read a file up to its first <tag> record. Return the prologue up to
+    there, with the DOCTYPE and the root start tag, the matching root end
+    tag, and the bytes read past it.
+    """
+    parser = expat.ParserCreate()
+    found = {}
+
+    def start(name, attrs):
+        found.setdefault('root', name)
+        if name == tag:
+            found.setdefault('offset', parser.CurrentByteIndex)
+
+    parser.StartElementHandler = start
+    data = b''
+    while 'offset' not in found:
+        block = f.read(READ_SIZE)
+        if not block:
+            raise ValueError(f'{f.name} has no <{tag}> records')
+        data += block
+        try:
+            parser.Parse(block, False)
+        except expat.ExpatError as e:
+            raise ValueError(f'{f.name}: {e}')
+    offset = found['offset']
+    return data[:offset], f'</{found["root"]}>'.encode(), data[offset:]
+
+
+def iter_batches(filename, tag, size=RECORD_BATCH):
+    """
+    Yield (head, tail, data) for each batch of up to size <tag> records in
+    a file, where head + data + tail is a document of its own.
+    """
+    end = f'</{tag}>'.encode()
+    with open(filename, 'rb') as f:
+        head, tail, buf = read_head(f, tag)
+        pos = count = 0
+        while True:
+            i = buf.find(end, pos)
+            if i >= 0:
+                pos = i + len(end)
+                count += 1
+                if count == size:
+                    yield head, tail, buf[:pos]
+                    buf = buf[pos:]
+                    pos = count = 0
+                continue
+            block = f.read(READ_SIZE)
+            if not block:
+                # What is left after the last record is the root end tag.
+                if count:
+                    yield head, tail, buf[:pos]
+                return
+            buf += block
+
+
+def parse_batch(head, tail, data):
+    try:
+        return ElementTree.fromstring(head + data + tail)
+    except ElementTree.ParseError as e:
+        raise ValueError(f'bad record: {e}')
+
+
+def decode_kanjidic(batch, grade=None):
+    """
+    Decode a batch of KANJIDIC2 <character> records into kanji rows of
+    (kanji, strokes, RK1 frame, meaning) and reading rows of (kanji,
+    position, on reading, in hiragana). The RK1 frame is the heisig6
+    reference and the meaning the first English one. With a grade, only
+    kanji taught up to that school grade are kept (8 is the rest of the
+    jouyou kanji, 9 and 10 the jinmeiyou).
+    """
+    kanji = []
+    readings = []
+    for char in parse_batch(*batch).iter('character'):
+        literal = char.findtext('literal')
+        if grade is not None and int(char.findtext('misc/grade') or 99) > grade:
+            continue
+        strokes = char.findtext('misc/stroke_count')
+        rk1 = char.findtext("dic_number/dic_ref[@dr_type='heisig6']")
+        meaning = next((m.text for m in char.iterfind('reading_meaning/rmgroup/meaning')
+                        if 'm_lang' not in m.attrib), None)
+        kanji.append((literal, int(strokes) if strokes else None, int(rk1) if rk1 else None, meaning))
+        ons = char.iterfind("reading_meaning/rmgroup/reading[@r_type='ja_on']")
+        for position, on in enumerate(dict.fromkeys(on.text.strip('-') for on in ons)):
+            readings.append((literal, position, on, to_hiragana(on)))
+    return kanji, readings
+
+
+def rank(element, tag):
+    best = UNRANKED
+    for pri in element.iterfind(tag):
+        code = pri.text
+        if code.startswith('nf'):
+            best = min(best, int(code[2:]))
+        else:
+            best = min(best, LIST_RANKS.get(code[-1], UNRANKED))
+    return best
+
+
+def reads(r_ele, keb):
+    # Whether a reading goes with a writing: it does unless it is only
+    # for the kana spelling or restricted to other writings.
+    if r_ele.find('re_nokanji') is not None:
+        return False
+    restrictions = [restr.text for restr in r_ele.iterfind('re_restr')]
+    return not restrictions or keb in restrictions
+
+
+def decode_jmdict(batch):
+    """
+    Decode a batch of JMdict <entry> records into phrase rows of (entry
+    number, writing, reading in hiragana, meaning, rank) and the (entry
+    number, position, kanji) rows of their kanji. An entry becomes its
+    most common writing with kanji, read its most common way, meaning
+    the English glosses of its first sense. Entries written in kana only
+    are left out. The lower the rank, the more common the word.
+    """
+    phrases = []
+    phrase_kanji = []
+    for entry in parse_batch(*batch).iter('entry'):
+        writings = entry.findall('k_ele')
+        if not writings:
+            continue
+        seq = int(entry.findtext('ent_seq'))
+        # min keeps the first of equals, which JMdict lists first.
+        writing = min(writings, key=lambda k: rank(k, 'ke_pri'))
+        keb = writing.findtext('keb')
+        readings = [r for r in entry.iterfind('r_ele') if reads(r, keb)]
+        if not readings:
+            continue
+        reading = min(readings, key=lambda r: rank(r, 're_pri'))
+        sense = entry.find('sense')
+        glosses = [] if sense is None else [
+            g.text for g in sense.iterfind('gloss') if g.get(XML_LANG, 'eng') == 'eng' and g.text]
+        phrases.append((seq, keb, to_hiragana(reading.findtext('reb')), ';'.join(glosses),
+                        min(rank(writing, 'ke_pri'), rank(reading, 're_pri'))))
+        seen = set()
+        for position, c in enumerate(keb):
+            if is_kanji(c) and c not in seen:
+                seen.add(c)
+                phrase_kanji.append((seq, position, c))
+    return phrases, phrase_kanji
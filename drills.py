@@ -0,0 +1,357 @@
+"""
+The drills and their scheduling. A drill grades answers but never talks
+to the learner itself; a reviewer asks the questions and shows the
+results. The terminal reviewer is imported only when a drill runs
+without another one, so commands that only need the drill definitions
+(like stats) don't pay for it.
+"""
+import heapq
+import itertools
+import random
+import time
+
+import metrics
+from answers import check_meaning, other_meanings
+from kana import ROMA2KATA, NotKanaError, get_converter, roma2kata
+from scheduler import StreakScheduler
+from session import current_day
+
+
+class Drill(object):
+    """
+    A drill decides which cards it asks and checks the answers; its
+    scheduler decides when they are due. The streak scheduler is the
+    default.
+    """
+
+    due_index = None
+    needs_on = False
+
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler or StreakScheduler()
+
+    def wants(self, card):
+        return not self.needs_on or card.on is not None
+
+    def build_index(self, session, cards=None):
+        build_indexes([self], session, cards)
+        return self.due_index
+
+    def get_due(self, session, today=None):
+        """Return the rows of the cards due for review."""
+        if self.due_index is None:
+            self.build_index(session)
+        if today is None:
+            today = current_day()
+        return self.due_index.due(today)
+
+    def filter_due(self, session, due, cards):
+        return [row for row in due if self.wants(cards[session.key(row)])]
+    
+    def run(self, cards, session, limit=None, journal=None, reviewer=None, today=None):
+        """
+        Review the cards due today and return how many were graded. The
+        answers come from reviewer, the terminal by default.
+        """
+        if today is None:
+            today = current_day()
+        with metrics.phase('get_due'):
+            if self.due_index is None:
+                self.build_index(session, cards)
+            deck = Deck(self, cards, session, journal)
+            available = deck.count_due(today)
+            # The most overdue cards first, shuffled within each day.
+            due = [(deck, row) for _, _, _, row in deck.iter_due(today, 0, limit or None)]
+        return review(self, due, available, reviewer, today)
+
+    def grade(self, session, row, ok, today, journal=None):
+        """Record a pass or fail for a card and return its new streak."""
+        old_due = self.scheduler.due(session, self.name, row)
+        streak = self.scheduler.grade(session, self.name, row, ok, today)
+        self.due_index.move(row, old_due, self.scheduler.due(session, self.name, row))
+        if journal:
+            journal.append(session.key(row), self.name, streak, today,
+                           session.get_memory(self.name, row))
+        return streak
+
+
+def build_indexes(drills, session, cards=None):
+    """Index several drills over the same session in one pass."""
+    for drill in drills:
+        drill.scheduler.prepare(session)
+    for drill, index in zip(drills, session.build_indexes(drills, cards)):
+        drill.due_index = index
+
+
+def pick_band(rows, k, keep=None, rng=random):
+    """
+    Return k of the rows keep accepts (all of them if k is None or there
+    are fewer), in random order. This is a Fisher-Yates shuffle stopped
+    once k rows are picked, so taking a few from a big band costs little
+    more than copying it.
+    """
+    rows = list(rows)
+    picked = []
+    for i in range(len(rows)):
+        if len(picked) == k:
+            break
+        j = rng.randrange(i, len(rows))
+        rows[i], rows[j] = rows[j], rows[i]
+        if keep is None or keep(rows[i]):
+            picked.append(rows[i])
+    return picked
+
+
+class Deck(object):
+    """
+    One deck in a review: its cards and session, the journal its grades
+    go to, and the drill indexing it. A drill's due index belongs to one
+    session, so a review over several decks has a drill for each.
+    """
+
+    def __init__(self, drill, cards, session, journal=None):
+        self.drill = drill
+        self.cards = cards
+        self.session = session
+        self.journal = journal
+        self.graded = 0
+
+    def keep(self):
+        # Rows of cards the drill doesn't want are only in an index that
+        # was built without the cards.
+        if not self.drill.needs_on or self.drill.due_index.filtered:
+            return None
+        return lambda row: self.drill.wants(self.cards[self.session.key(row)])
+
+    def count_due(self, today):
+        keep = self.keep()
+        if keep is None:
+            return self.drill.due_index.count(today)
+        return len(self.drill.filter_due(self.session, self.drill.due_index.due(today), self.cards))
+
+    def iter_due(self, today, n, limit=None, rng=random):
+        """
+        Yield (due day, tiebreak, n, row) for up to limit of the cards due
+        by today, the most overdue first. Each day is a band of equal
+        priority: the cards in it come out in random order, and merged
+        with other decks they are shuffled together. Days are only read
+        as they are reached, and of the last one only the cards needed
+        are picked, so the work depends on the limit and not on the size
+        of the backlog.
+        """
+        keep = self.keep()
+        for day, rows in self.drill.due_index.bands(today):
+            rows = pick_band(rows, limit, keep, rng)
+            keys = sorted(rng.random() for _ in rows)
+            for key, row in zip(keys, rows):
+                yield day, key, n, row
+            if limit is not None:
+                limit -= len(rows)
+                if not limit:
+                    return
+
+
+class MixedDrills(object):
+    """What the reviewer is told is being drilled in a mixed review."""
+
+    name = 'mixed'
+
+    def __init__(self, drills):
+        self.drills = drills
+        self.instructions = 'Mixed drills: ' + '; '.join(drill.instructions for drill in drills)
+
+
+def run_decks(decks, limit=None, reviewer=None, today=None):
+    """
+    Review the cards due today across several decks, the most overdue
+    first, and return how many were graded. The due lists of the decks
+    are merged lazily, so only the cards that will be reviewed are
+    picked out and ordered.
+
+    The decks may be different drills over the same cards and session,
+    for a mixed review: their indexes are built in one pass over the
+    session, and their cards are interleaved.
+    """
+    if today is None:
+        today = current_day()
+    limit = limit or None
+    with metrics.phase('get_due'):
+        unindexed = {}
+        for deck in decks:
+            if deck.drill.due_index is None:
+                unindexed.setdefault(id(deck.session), (deck, []))[1].append(deck.drill)
+        for deck, drills in unindexed.values():
+            build_indexes(drills, deck.session, deck.cards)
+        available = sum(deck.count_due(today) for deck in decks)
+        merged = heapq.merge(*(deck.iter_due(today, n, limit) for n, deck in enumerate(decks)))
+        # Taken up front: grading moves cards between due days.
+        due = [(decks[n], row) for _, _, n, row in itertools.islice(merged, limit)]
+    drills = list({deck.drill.name: deck.drill for deck in decks}.values())
+    drill = drills[0] if len(drills) == 1 else MixedDrills(drills)
+    return review(drill, due, available, reviewer, today)
+
+
+def review(drill, due, available, reviewer=None, today=None):
+    """
+    Ask the (deck, row) reviews in due in order, grade them and then
+    repeat the failures until they pass. Returns how many were graded.
+    drill is what the reviewer is told is being drilled; each review is
+    asked and graded by its deck's drill.
+    """
+    if reviewer is None:
+        from terminal import TerminalReviewer
+        reviewer = TerminalReviewer()
+    if today is None:
+        today = current_day()
+
+    if not due:
+        reviewer.nothing_due(drill)
+        return 0
+
+    # Remember the fails for review below.
+    total = len(due)
+    reviewer.begin(drill, total, available)
+    fails = []
+    asked = skipped = 0
+
+    for deck, row in due:
+        card = deck.cards.get(deck.session.key(row))
+        if card is None:
+            # Deleted from the deck since the review began; it no longer
+            # counts towards the total.
+            skipped += 1
+            continue
+        t0 = time.perf_counter()
+        answer = reviewer.ask(deck.drill, card, asked, total - skipped)
+        asked += 1
+        metrics.observe('answer_seconds', time.perf_counter() - t0)
+        ok = deck.drill.check(card, answer)
+        with metrics.phase('grading'):
+            streak = deck.drill.grade(deck.session, row, ok, today, deck.journal)
+        deck.graded += 1
+        reviewer.checked(deck.drill, card, answer, ok, streak)
+        if not ok:
+            fails.append((deck.drill, card))
+    total = asked
+    metrics.count('cards_reviewed', total)
+    metrics.count('cards_failed', len(fails))
+
+    # Every card may have been deleted while the review ran.
+    if total:
+        reviewer.passed(drill, total - len(fails), total)
+
+    # Review failures until they pass. These don't change the grades.
+    while fails:
+        failed = len(fails)
+        reviewer.begin_failures(drill, failed)
+        refails = []
+        metrics.count('retries', failed)
+        for i, (card_drill, card) in enumerate(fails):
+            answer = reviewer.ask(card_drill, card, i, failed)
+            ok = card_drill.check(card, answer)
+            reviewer.checked(card_drill, card, answer, ok)
+            if not ok:
+                refails.append((card_drill, card))
+        fails = refails
+    return total
+
+
+class Meaning2KanjiDrill(Drill):
+
+    name = 'meaning2kanji'
+    instructions = 'Given the meaning, write the kanji'
+
+    # The kanji is written on paper, so the answer is the learner's own
+    # verdict.
+    def check(self, card, answer):
+        return answer == 'y'
+
+    def correct_answer(self, card):
+        return 'y'
+
+
+class Kanji2MeaningDrill(Drill):
+
+    name = 'kanji2meaning'
+    instructions = 'Given the kanji, write the meaning'
+
+    # The MeaningIndex of the catalog, set by whoever has the cards.
+    # Without one there are no synonyms and no telling a typo from
+    # another card's meaning.
+    meanings = None
+
+    def check(self, card, answer):
+        return check_meaning(card, answer, self.meanings)
+
+    def other_cards(self, card, answer):
+        """Return the other cards whose meaning a wrong answer is."""
+        if self.meanings is None:
+            return []
+        return other_meanings(card, answer, self.meanings)
+
+    def correct_answer(self, card):
+        return card.meaning
+
+
+class Phrase2OnDrill(Drill):
+
+    name = 'phrase2on'
+    instructions = 'Given the kanji and exemplary phrase, type the romaji for the on reading'
+
+    # Skip any cards that have no 'on' reading.
+    needs_on = True
+
+    @staticmethod
+    def reading(answer):
+        """The katakana for a romaji answer, or a placeholder."""
+        if not answer:
+            return '?'
+        try:
+            return roma2kata(answer)
+        except (KeyError, NotKanaError):
+            return '<invalid>'
+
+    def check(self, card, answer):
+        return self.reading(answer) == card.on
+
+    def correct_answer(self, card):
+        return get_converter(ROMA2KATA).to_roma(card.on)
+
+
+class ScriptedReviewer(object):
+    """
+    Answers reviews without a terminal, for simulations and scripts.
+    answer(drill, card) gives the answer to each review; by default it is
+    the correct one. Counts the reviews and passes, retries included.
+    """
+
+    def __init__(self, answer=None):
+        self.answer = answer or (lambda drill, card: drill.correct_answer(card))
+        self.reviews = 0
+        self.passes = 0
+
+    def nothing_due(self, drill):
+        pass
+
+    def begin(self, drill, total, available):
+        pass
+
+    def ask(self, drill, card, i, total):
+        return self.answer(drill, card)
+
+    def checked(self, drill, card, answer, ok, streak=None):
+        self.reviews += 1
+        self.passes += ok
+
+    def passed(self, drill, num_correct, total):
+        pass
+
+    def begin_failures(self, drill, failed):
+        pass
+
+
+DRILL_CLASSES = {
+    'p2o': Phrase2OnDrill,
+    'm2k': Meaning2KanjiDrill,
+    'k2m': Kanji2MeaningDrill
+}
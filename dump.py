@@ -0,0 +1,192 @@
+"""
+Streaming output for the dump command. Cards come in one at a time,
+are flattened to rows of named fields, filtered, and turned into lines
+of text, TSV, CSV or JSON Lines, which the caller writes out in large
+batches. Nothing is kept per card, so memory stays flat however big the
+deck is.
+"""
+import csv
+import itertools
+import json
+import operator
+import re
+from json.encoder import encode_basestring
+
+from cards import number
+
+
+# Every field a row has, in output order. The names match the search
+# fields where there is one.
+FIELDS = ('pk', 'rk2', 'kanji', 'meaning', 'strokes', 'on', 'rk1',
+          'phrase', 'phrase-kana', 'phrase-meaning')
+
+# The fields and minimum widths of the text format, as dump has always
+# printed them. Empty values are shown as '-'.
+TEXT_FIELDS = ('rk2', 'kanji', 'meaning', 'on', 'phrase', 'phrase-kana', 'phrase-meaning')
+TEXT_WIDTHS = {'rk2': 4, 'kanji': 1, 'meaning': 12, 'on': 6, 'phrase': 6, 'phrase-kana': 6}
+
+# Text column widths are worked out from this many rows at the start.
+WIDTH_SAMPLE = 4096
+
+FORMATS = ('text', 'tsv', 'csv', 'jsonl')
+
+WHERE_RE = re.compile(r'^([a-z0-9-]+)\s*(!=|<=|>=|=|<|>|~)\s*(.*)$')
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def card_row(pk, card):
+    """Flatten a card to a tuple of its values in FIELDS order, all strings."""
+    return (str(pk), number(card.rk2), card.kanji or '', card.meaning, number(card.strokes),
+            card.on or '', number(card.rk1), card.phrase or '', card.phrase_kana or '',
+            card.phrase_meaning or '')
+
+
+def parse_fields(spec):
+    """Return the field names in a comma-separated list, checking them."""
+    names = [name.strip() for name in spec.split(',') if name.strip()]
+    for name in names:
+        if name not in FIELDS:
+            raise ValueError(f'unknown field {name}; fields are {", ".join(FIELDS)}')
+    if not names:
+        raise ValueError('no fields given')
+    return names
+
+
+def parse_where(spec):
+    """
+    Return a predicate on rows for a condition like 'strokes>=10',
+    'rk2=12' or 'meaning~water' (~ is a substring match, ignoring case).
+    Comparisons are numeric when the value is a number.
+    """
+    m = WHERE_RE.match(spec.strip())
+    if not m or m.group(1) not in FIELDS:
+        raise ValueError(f'bad condition {spec!r}; use FIELD OP VALUE with one of '
+                         f'{" ".join(["~"] + list(OPERATORS))}')
+    field, op, value = m.groups()
+    i = FIELDS.index(field)
+    if op == '~':
+        value = value.lower()
+        return lambda row: value in row[i].lower()
+    compare = OPERATORS[op]
+    try:
+        number = int(value)
+    except ValueError:
+        return lambda row: compare(row[i], value)
+
+    def numeric(row):
+        try:
+            return compare(int(row[i]), number)
+        except ValueError:
+            # Empty or not a number; only != holds.
+            return op == '!='
+    return numeric
+
+
+def select(cards, fields=None, where=()):
+    """
+    Yield the rows of (pk, card) pairs that meet every condition, cut
+    down to the given field indexes.
+    """
+    rows = itertools.starmap(card_row, cards)
+    for condition in where:
+        rows = filter(condition, rows)
+    if fields is not None:
+        getter = operator.itemgetter(*fields)
+        if len(fields) == 1:
+            rows = ((getter(row),) for row in rows)
+        else:
+            rows = map(getter, rows)
+    return rows
+
+
+def text_lines(rows, names):
+    # The widths come from the first rows, so the output can start
+    # before the deck has been read. A longer value further on just
+    # pushes its line out, as dump always did.
+    sample = list(itertools.islice(rows, WIDTH_SAMPLE))
+    widths = [TEXT_WIDTHS.get(name, 0) for name in names]
+    for row in sample:
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], len(value or '-'))
+    # One format string for the whole run; the last column is not padded.
+    fmt = ' '.join(f'{{:<{w}}}' for w in widths[:-1]) + ' {}\n' if len(names) > 1 else '{}\n'
+    fmt = fmt.format
+    for row in itertools.chain(sample, rows):
+        yield fmt(*[value or '-' for value in row])
+
+
+def tsv_lines(rows, names):
+    yield '\t'.join(names) + '\n'
+    clean = str.maketrans('\t\n\r', '   ')
+    tabs = len(names) - 1
+    for row in rows:
+        line = '\t'.join(row)
+        # Values with tabs or line breaks in them are rare; only then is
+        # each one cleaned.
+        if line.count('\t') != tabs or '\n' in line or '\r' in line:
+            line = '\t'.join([value.translate(clean) for value in row])
+        yield line + '\n'
+
+
+class _Lines(list):
+    # The file-like object csv.writer needs, collecting lines in a list.
+    write = list.append
+
+
+def csv_lines(rows, names):
+    lines = _Lines()
+    w = csv.writer(lines, lineterminator='\n')
+    w.writerow(names)
+    yield from lines
+    # csv.writer is fastest given many rows at once.
+    while True:
+        lines.clear()
+        w.writerows(itertools.islice(rows, WIDTH_SAMPLE))
+        if not lines:
+            break
+        yield from lines
+
+
+def jsonl_lines(rows, names):
+    # Every value is a string, so each line is the same object template
+    # filled with encoded strings, which is much quicker than encoding a
+    # dict per row.
+    fmt = '{{' + ', '.join(f'{json.dumps(name)}: {{}}' for name in names) + '}}\n'
+    fmt = fmt.format
+    for row in rows:
+        yield fmt(*map(encode_basestring, row))
+
+
+FORMATTERS = {
+    'text': text_lines,
+    'tsv': tsv_lines,
+    'csv': csv_lines,
+    'jsonl': jsonl_lines,
+}
+
+
+def dump_lines(cards, fmt='text', fields=None, where=()):
+    """
+    Return an iterator over the output lines for an iterable of (pk,
+    card) pairs. fields is a list of field names, or None for the
+    default ones of the format.
+    """
+    if fields is None:
+        fields = TEXT_FIELDS if fmt == 'text' else FIELDS
+    indexes = [FIELDS.index(name) for name in fields]
+    return FORMATTERS[fmt](select(cards, indexes, where), fields)
+
+
+def kana_table_lines(title, start, end, columns=8):
+    """The lines of a table of the characters from start to end, with their codes."""
+    yield title + '\n'
+    for row in range(start, end + 1, columns):
+        yield ' | '.join(f'{chr(i)} {i:04X}' for i in range(row, min(row + columns, end + 1))) + '\n'
@@ -0,0 +1,167 @@
+"""
+Fitting the memory model's parameters to a review history, for kanji.py
+fit. Needs numpy.
+"""
+import math
+
+from scheduler import DEFAULT_PARAMS, MIN_STABILITY, PARAM_NAMES, REVERSION
+from session import AGE_FACTOR, DEFAULT_DIFFICULTY
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The history is cut into one sequence of reviews per card and
+# drill, and the log loss of the model's recall predictions is worked
+# out for all of them at once, step by step along the sequences, with
+# numpy. Gradients are central differences, and every perturbed
+# parameter set is evaluated in the same pass by broadcasting over a
+# leading axis, so an iteration is a few dozen array operations however
+# many reviews there are.
+
+# Longer sequences are cut short; the early reviews say the most.
+MAX_SEQUENCE = 64
+FIT_BATCH = 4096
+FIT_STEPS = 200
+FIT_RATE = 0.05
+FIT_DELTA = 1e-3
+# Parameters fitted as logarithms, to keep them positive. growth may
+# be any number.
+LOG_PARAMS = frozenset(PARAM_NAMES) - {'growth'}
+
+
+def review_sequences(history):
+    """
+    Group (key, drill, streak, day) grades into one list of (day, streak)
+    per card and drill, dropping repeats, and return the lists with more
+    than one review, the longest first.
+    """
+    seqs = {}
+    for k, drill, streak, day in history:
+        seq = seqs.setdefault((k, drill), [])
+        if not seq or seq[-1] != (day, streak):
+            seq.append((day, streak))
+    seqs = [seq[:MAX_SEQUENCE] for seq in seqs.values() if len(seq) > 1]
+    seqs.sort(key=len, reverse=True)
+    return seqs
+
+
+class Reviews(object):
+    """
+    Sequences of reviews padded into [step, sequence] arrays. They are
+    sorted longest first, so the sequences still going at each step are
+    a prefix of the columns: active[t] of them.
+    """
+
+    def __init__(self, seqs):
+        steps, n = len(seqs[0]), len(seqs)
+        days = numpy.zeros((steps, n), dtype=numpy.int64)
+        streaks = numpy.zeros((steps, n), dtype=numpy.int64)
+        for i, seq in enumerate(seqs):
+            days[:len(seq), i], streaks[:len(seq), i] = zip(*seq)
+        self.elapsed = numpy.diff(days, axis=0, prepend=days[:1]).astype(numpy.float64)
+        self.ok = streaks > 0
+        # A sequence that starts part way through a streak, because the
+        # history began after the card was learned, starts from the
+        # stability the streak rule gave it, as initial_memory does.
+        self.carried = numpy.where(streaks[0] > 1, AGE_FACTOR * streaks[0], 0.0)
+        lengths = numpy.array([len(seq) for seq in seqs])
+        self.active = [int((lengths > t).sum()) for t in range(steps)]
+        self.count = int(lengths.sum()) - n
+
+    def log_loss(self, params):
+        """
+        Return the mean log loss of predicting each review after the
+        first, for each row of a [sets, len(PARAM_NAMES)] array of
+        parameters.
+        """
+        (first_pass, first_fail, growth, decay, spacing, lapse,
+         step) = (params[:, [i]] for i in range(len(PARAM_NAMES)))
+        ok0 = self.ok[0]
+        carried = self.carried > 0
+        stability = numpy.where(carried, self.carried, numpy.where(ok0, first_pass, first_fail))
+        difficulty = numpy.where(carried | ok0, DEFAULT_DIFFICULTY,
+                                 numpy.minimum(10.0, DEFAULT_DIFFICULTY + step))
+        difficulty = numpy.broadcast_to(difficulty, stability.shape).copy()
+        loss = numpy.zeros(len(params))
+        for t in range(1, len(self.active)):
+            m = self.active[t]
+            if not m:
+                break
+            s, d, ok = stability[:, :m], difficulty[:, :m], self.ok[t, :m]
+            r = numpy.clip(0.9 ** (self.elapsed[t, :m] / s), 1e-4, 1 - 1e-4)
+            loss -= numpy.where(ok, numpy.log(r), numpy.log1p(-r)).sum(axis=1)
+            grown = s * (1 + numpy.exp(growth) * (11 - d) * s ** -decay
+                         * numpy.expm1(spacing * (1 - r)))
+            stability[:, :m] = numpy.where(ok, grown, numpy.maximum(MIN_STABILITY, lapse * s))
+            d = d + numpy.where(ok, 0.0, step)
+            difficulty[:, :m] = numpy.clip(d + REVERSION * (DEFAULT_DIFFICULTY - d), 1.0, 10.0)
+        return loss / self.count
+
+    def sample(self, n, rng):
+        """Return a random n of the sequences, still longest first."""
+        if n >= len(self.carried):
+            return self
+        keep = numpy.sort(rng.choice(len(self.carried), n, replace=False))
+        part = object.__new__(Reviews)
+        part.elapsed = self.elapsed[:, keep]
+        part.ok = self.ok[:, keep]
+        part.carried = self.carried[keep]
+        part.active = [int((keep < m).sum()) for m in self.active]
+        part.count = sum(part.active[1:])
+        return part
+
+
+def to_vector(params):
+    return numpy.array([math.log(params[name]) if name in LOG_PARAMS else params[name]
+                        for name in PARAM_NAMES])
+
+
+def from_vector(u):
+    # Works on one vector or a [sets, params] array of them.
+    u = numpy.array(u, dtype=numpy.float64)
+    for i, name in enumerate(PARAM_NAMES):
+        if name in LOG_PARAMS:
+            u[..., i] = numpy.exp(u[..., i])
+    # Failing a card should never make it more stable.
+    u[..., PARAM_NAMES.index('lapse')] = numpy.minimum(u[..., PARAM_NAMES.index('lapse')], 1.0)
+    return u
+
+
+def fit(history, params=None, steps=FIT_STEPS, batch=FIT_BATCH, seed=0):
+    """
+    Fit the memory model to a history of (key, drill, streak, day)
+    grades, starting from params (the defaults if None). Returns the
+    fitted parameters, the log loss before and after, and the number of
+    reviews fitted. Gradient descent (Adam) runs on random batches of
+    sequences.
+    """
+    if numpy is None:
+        raise RuntimeError('fitting the memory model needs numpy')
+    seqs = review_sequences(history)
+    if not seqs:
+        raise ValueError('no card has been reviewed twice yet')
+    reviews = Reviews(seqs)
+    rng = numpy.random.default_rng(seed)
+    u = to_vector(dict(DEFAULT_PARAMS, **(params or {})))
+    before = float(reviews.log_loss(from_vector(u[None]))[0])
+    # The point itself, then each parameter nudged up and down.
+    nudges = numpy.concatenate([numpy.eye(len(u)), -numpy.eye(len(u))]) * FIT_DELTA
+    m = numpy.zeros_like(u)
+    v = numpy.zeros_like(u)
+    for i in range(1, steps + 1):
+        losses = reviews.sample(batch, rng).log_loss(from_vector(u + nudges))
+        grad = (losses[:len(u)] - losses[len(u):]) / (2 * FIT_DELTA)
+        m = 0.9 * m + 0.1 * grad
+        v = 0.999 * v + 0.001 * grad ** 2
+        u -= FIT_RATE * (m / (1 - 0.9 ** i)) / (numpy.sqrt(v / (1 - 0.999 ** i)) + 1e-8)
+    fitted = from_vector(u)
+    after = float(reviews.log_loss(fitted[None])[0])
+    if after > before:
+        # Not better than where it started; keep that.
+        fitted, after = from_vector(to_vector(dict(DEFAULT_PARAMS, **(params or {})))), before
+    return ({name: round(float(x), 4) for name, x in zip(PARAM_NAMES, fitted)},
+            before, after, reviews.count)
+
@@ -0,0 +1,85 @@
+"""
+Projected review workload, for planning how fast to add new cards.
+"""
+import math
+from array import array
+
+from session import AGE_FACTOR, due_day
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def forecast(streaks, lasts, today, horizon, pass_rate, new_per_day=0):
+    """
+    Project the expected number of reviews on each of the next horizon
+    days, assuming every review passes with probability pass_rate and
+    new_per_day fresh cards join the deck each day. A failed card comes
+    back the next day.
+
+    Cards due on the same day with the same streak behave alike, so the
+    deck is folded into a table of card counts by (day, streak) and the
+    simulation costs O(horizon * streak) after one pass over the deck.
+    """
+    if numpy is not None:
+        return forecast_numpy(streaks, lasts, today, horizon, pass_rate, new_per_day)
+    return forecast_array(streaks, lasts, today, horizon, pass_rate, new_per_day)
+
+
+def forecast_numpy(streaks, lasts, today, horizon, pass_rate, new_per_day):
+    streak = numpy.asarray(streaks, dtype=numpy.int64)
+    due = numpy.ceil(AGE_FACTOR * streak).astype(numpy.int64)
+    due += numpy.asarray(lasts, dtype=numpy.int64) - today
+    numpy.maximum(due, 0, out=due)
+    keep = due < horizon
+    # A streak grows by at most one a day, so this is wide enough.
+    width = int(streak.max(initial=0)) + horizon + 2
+    table = numpy.bincount(due[keep] * width + streak[keep],
+                           minlength=horizon * width)
+    table = table.reshape(horizon, width).astype(numpy.float64)
+    table[:, 0] += new_per_day
+    nextstreak = numpy.arange(1, width)
+    wait = numpy.maximum(1, numpy.ceil(AGE_FACTOR * nextstreak)).astype(numpy.int64)
+    counts = []
+    for day in range(horizon):
+        row = table[day]
+        total = float(row.sum())
+        counts.append(total)
+        nextday = day + wait
+        ok = nextday < horizon
+        table[nextday[ok], nextstreak[ok]] += row[:-1][ok] * pass_rate
+        if day + 1 < horizon:
+            table[day + 1, 0] += total * (1 - pass_rate)
+    return counts
+
+
+def forecast_array(streaks, lasts, today, horizon, pass_rate, new_per_day):
+    maxstreak = 0
+    due = []
+    for streak, last in zip(streaks, lasts):
+        day = max(0, due_day(streak, last) - today)
+        if day < horizon:
+            due.append((day, streak))
+            maxstreak = max(maxstreak, streak)
+    width = maxstreak + horizon + 2
+    table = [array('d', [0.0]) * width for day in range(horizon)]
+    for day, streak in due:
+        table[day][streak] += 1
+    for row in table:
+        row[0] += new_per_day
+    wait = [max(1, math.ceil(AGE_FACTOR * streak)) for streak in range(width)]
+    counts = []
+    for day in range(horizon):
+        row = table[day]
+        total = sum(row)
+        counts.append(total)
+        for streak in range(width - 1):
+            if row[streak]:
+                nextday = day + wait[streak + 1]
+                if nextday < horizon:
+                    table[nextday][streak + 1] += row[streak] * pass_rate
+        if day + 1 < horizon:
+            table[day + 1][0] += total * (1 - pass_rate)
+    return counts
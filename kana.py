@@ -0,0 +1,285 @@
+"""
+Romaji to kana conversion.
+"""
+import metrics
+
+
+ROMA2KATA = {
+    '_a': '30A1','a': '30A2','_i': '30A3','i': '30A4','_u': '30A5','u': '30A6','_e': '30A7','e': '30A8',
+    '_o': '30A9','o': '30AA','ka': '30AB','ga': '30AC','ki': '30AD','gi': '30AE','ku': '30AF','gu': '30B0',
+    'ke': '30B1','ge': '30B2','ko': '30B3','go': '30B4','sa': '30B5','za': '30B6','shi': '30B7','ji': '30B8',
+    'su': '30B9','zu': '30BA','se': '30BB','ze': '30BC','so': '30BD','zo': '30BE','ta': '30BF','da': '30C0',
+    'chi': '30C1','chji': '30C2','_tsu': '30C3', 'tsu': '30C4', 'tzu': '30C5','te': '30C6','de': '30C7','to': '30C8',
+    'do': '30C9','na': '30CA','ni': '30CB','nu': '30CC','ne': '30CD','no': '30CE','ha': '30CF','ba': '30D0',
+    'pa': '30D1','hi': '30D2','bi': '30D3','pi': '30D4','fu': '30D5','bu': '30D6','pu': '30D7','he': '30D8',
+    'be': '30D9','pe': '30DA','ho': '30DB','bo': '30DC','po': '30DD','ma': '30DE','mi': '30DF','mu': '30E0',
+    'me': '30E1','mo': '30E2',
+    '_ya': '30E3','ya': '30E4','_yu': '30E5','yu': '30E6','_yo': '30E7','yo': '30E8',
+    'ra': '30E9','ri': '30EA','ru': '30EB','re': '30EC','ro': '30ED','_wa': '30EE','wa': '30EF', 
+    'wo': '30F2', 'n': '30F3',
+    'kyu': ('ki', '_yu'),
+    'kyo': ('ki', '_yo'),
+    'sha': ('shi', '_ya'),
+    'shu': ('shi', '_yu'),
+    'sho': ('shi', '_yo'),
+    'ju': ('ji', '_yu'),
+    'jo': ('ji', '_yo'),
+    'cha': ('chi', '_ya'),
+    'chu': ('chi', '_yu'),
+    'cho': ('chi', '_yo'),
+    'rya': ('ri', '_ya'),
+    'ryo': ('ri', '_yo'),
+    'ryu': ('ri', '_yu'),
+    'byo': ('bi', '_yo'),
+    'bya': ('bi', '_ya'),    
+    'mya': ('mi', '_ya'),    
+    'kki': ('_tsu', 'ki'),
+    'hyo': ('hi', '_yo'),
+    'kya': ('ki', '_ya'),
+    'tto': ('_tsu', 'to'),
+    'ssho': ('_tsu', 'shi', '_yo'),
+    'gyo': ('gi', '_yo'),
+    'gyu': ('gi', '_yu'),
+    'nya': ('n', '_ya'),
+    'hya': ('hi', '_ya'),
+    'nyo': ('n', '_yo'),
+    'tta': ('_tsu', 'ta'),
+}
+
+ROMA2HIRA = {
+    'a':  '3042', 'i': '3044', 'u': '3046', 'e': '3048', 'o': '304A',
+    'ka': '304B', 'ga': '304C', 'ki': '304D', 'gi': '304E', 'ku': '304F', 'gu': '3050',
+    'ke': '3051', 'ge': '3052', 'ko': '3053', 'go': '3054', 'sa': '3055', 'za': '3056', 'shi': '3057', 'ji': '3058',
+    'su': '3059', 'zu': '305A', 'se': '305B', 'ze': '305C', 'so': '305D', 'zo': '305E',
+    'ta': '305F', 'da': '3060', 'chi': '3061', '_tsu': '3063', 'tsu': '3064', 'dzu': '3065', 'te': '3066', 'de': '3067', 'to': '3068',
+    'do': '3069',
+    'na': '306A', 'ni': '306B', 'nu': '306C', 'ne': '306D', 'no': '306E', 'ha': '306F', 'ba': '3070',
+    'pa': '3071', 'hi': '3072', 'bi': '3073', 'pi': '3074', 'fu': '3075', 'bu': '3076', 'pu': '3077', 'he': '3078',
+    'be': '3079', 'pe': '307A', 'ho': '307B', 'bo': '307C', 'po': '307D', 'ma': '307E', 'mi': '307F', 'mu': '3080',
+    'me': '3081', 'mo': '3082',
+    '_ya': '3083', 'ya': '3084', '_yu': '3085', 'yu': '3086', '_yo': '3087', 'yo': '3088',
+    'ra': '3089', 'ri': '308A', 'ru': '308B', 're': '308C', 'ro': '308D', 'wa': '308F', 
+    'wo': '3092', 'n': '3093',
+    'kyu': ('ki', '_yu'),
+    'kyo': ('ki', '_yo'),
+    'sha': ('shi', '_ya'),
+    'shu': ('shi', '_yu'),
+    'sho': ('shi', '_yo'),
+    'ju': ('ji', '_yu'),
+    'jo': ('ji', '_yo'),
+    'byo': ('bi', '_yo'),
+    'nyu': ('ni', '_yu'),
+    'bya': ('bi', '_ya'),    
+    'mya': ('mi', '_ya'),    
+    'cha': ('chi', '_ya'),
+    'chu': ('chi', '_yu'), 'kyu': ('ki', '_yu'),
+    'cho': ('chi', '_yo'),
+    'kka': ('_tsu', 'ka'),
+    'kkyo': ('_tsu', 'ki', '_yo'),
+    'ppa': ('_tsu', 'pa'), 'ppo': ('_tsu', 'po'),
+    'sshi': ('_tsu', 'shi'),
+    'sshu': ('_tsu', 'shi', '_yu'),
+    'tta': ('_tsu', 'ta'),
+    'tte': ('_tsu', 'te'),
+    'rya': ('ri', '_ya'),
+    'ryo': ('ri', '_yo'),
+    'hyo': ('hi', '_yo'),
+    'sso': ('_tsu', 'so'),
+    'ssa': ('_tsu', 'sa'),
+    'ppe': ('_tsu', 'pe'),
+    'byo': ('bi', '_yo'),
+    'kki': ('_tsu', 'ki'),
+    'kke': ('_tsu', 'ke'),
+    'kko': ('_tsu', 'ko'),
+    'tto': ('_tsu', 'to'),
+    'ja': ('ji', '_ya'),
+    'kya': ('ki', '_ya'),
+    'ryu': ('ri', '_yu'),
+    'ssho': ('_tsu', 'shi', '_yo'),
+    'gyo': ('gi', '_yo'),
+    'gyu': ('gi', '_yu'),
+    'sse': ('_tsu', 'se'),
+    'nya': ('n', '_ya'),
+    'hya': ('hi', '_ya'),
+    'nyo': ('n', '_yo'),
+}
+
+class NotKanaError(Exception):
+
+    pass
+
+
+def decode(uni):
+    if uni:
+        return chr(int(uni, 16))
+    else:
+        return None
+
+
+def decode_phrase(phr):
+    return "".join(decode(c) for c in phr.split(","))
+
+
+class RomaConverter(object):
+    """
+    Longest-match romaji converter compiled once from a code table. The
+    table is turned into a trie whose leaves already hold the final kana
+    string and code list, so digraphs like 'kyu' are expanded and the
+    hex codes are decoded at build time instead of on every call.
+    """
+
+    def __init__(self, code_table):
+        self.root = {}
+        for roma in code_table:
+            codes = tuple(self.expand(code_table, roma))
+            kana = "".join(decode(c) for c in codes)
+            node = self.root
+            for c in roma:
+                node = node.setdefault(c, {})
+            # The empty string can never be an input character, so use it
+            # to mark a leaf.
+            node[''] = (kana, codes)
+        self.n_leaf = self.root['n']['']
+        # The reverse index maps each kana string in the table back to
+        # the shortest romaji that spells it, the first defined on a tie.
+        self.reverse = {}
+        for roma in code_table:
+            kana = self.root_leaf(roma)[0]
+            if len(roma) < len(self.reverse.get(kana, roma + '_')):
+                self.reverse[kana] = roma
+        self.longest_kana = max(map(len, self.reverse))
+
+    def root_leaf(self, roma):
+        node = self.root
+        for c in roma:
+            node = node[c]
+        return node['']
+
+    @staticmethod
+    def expand(code_table, roma):
+        code = code_table[roma]
+        if isinstance(code, tuple):
+            return [code_table[h] for h in code]
+        return [code]
+
+    def convert(self, phr, return_codes=False):
+        res = []
+        codes = []
+        root = self.root
+        n_leaf = self.n_leaf
+        i = 0
+        end = len(phr)
+        while i < end:
+            # Walk the trie as far as the input allows, remembering the
+            # longest syllable seen along the way.
+            node = root
+            leaf = None
+            j = i
+            while j < end:
+                node = node.get(phr[j])
+                if node is None:
+                    break
+                j += 1
+                hit = node.get('')
+                if hit is not None:
+                    leaf = hit
+                    stop = j
+            if leaf is None:
+                raise NotKanaError(f'{phr[i:]} is not kana')
+            if leaf is n_leaf and stop < end:
+                # 'n' is only terminal if no vowel (or 'y', for words like
+                # "nyaku") follows. If one does, the longer syllable should
+                # have matched, so the input is bad. A ':' after 'n' is my
+                # own way to forcibly disambiguate and is swallowed.
+                c = phr[stop]
+                if c in 'aeiouy':
+                    raise NotKanaError(f'{phr[i:]} is not kana')
+                if c == ':':
+                    stop += 1
+            res.append(leaf[0])
+            codes.extend(leaf[1])
+            i = stop
+        kana = "".join(res)
+        if return_codes:
+            return kana, codes
+        else:
+            return kana
+
+    def to_roma(self, kana):
+        """
+        Spell kana in romaji using the reverse index, longest match
+        first, so that convert() gives the same kana back.
+        """
+        res = []
+        reverse = self.reverse
+        i = 0
+        end = len(kana)
+        while i < end:
+            for j in range(min(end, i + self.longest_kana), i, -1):
+                roma = reverse.get(kana[i:j])
+                if roma is not None:
+                    break
+            else:
+                raise NotKanaError(f'{kana[i:]} is not in the table')
+            if res and res[-1] == 'n' and roma[0] in 'aeiouy':
+                res.append(':')
+            res.append(roma)
+            i = j
+        return "".join(res)
+
+    def convert_many(self, phrases, return_codes=False):
+        """
+        Convert an iterable of romaji strings, returning a list. Decks
+        repeat the same readings a lot, so each distinct string is only
+        converted once.
+        """
+        seen = {}
+        res = []
+        for phr in phrases:
+            try:
+                out = seen[phr]
+            except KeyError:
+                out = seen[phr] = self.convert(phr, return_codes=True)
+            if return_codes:
+                res.append((out[0], list(out[1])))
+            else:
+                res.append(out[0])
+        metrics.count('conversions', len(seen))
+        metrics.count('conversion_memo_hits', len(res) - len(seen))
+        return res
+
+
+# Compiled converters, keyed by the id of their code table. The table is
+# kept alongside so its id can't be recycled.
+_converters = {}
+
+
+def get_converter(code_table):
+    try:
+        return _converters[id(code_table)][1]
+    except KeyError:
+        conv = RomaConverter(code_table)
+        _converters[id(code_table)] = (code_table, conv)
+        return conv
+
+
+def convert_roma(phr, code_table, return_codes=False):
+    return get_converter(code_table).convert(phr, return_codes=return_codes)
+
+
+def convert_many(phrases, code_table, return_codes=False):
+    return get_converter(code_table).convert_many(phrases, return_codes=return_codes)
+
+
+def roma2kata(s):
+    return get_converter(ROMA2KATA).convert(s)
+
+
+def roma2hira(phr, **kwargs):
+    return get_converter(ROMA2HIRA).convert(phr, **kwargs)
+
+
+def to_hiragana(text):
+    """Katakana to hiragana; anything else, like the long vowel mark, is kept."""
+    # Hiragana and katakana are the same distance apart throughout.
+    return "".join(chr(ord(c) - 0x60) if '\u30a1' <= c <= '\u30f6' else c for c in text)
@@ -1,607 +1,624 @@
 #!/usr/bin/env python
+"""
+Kanji Tools. Each subcommand imports only the modules it uses, since
+these commands are often run many times from shell scripts and import
+time is most of their runtime.
+"""
 import argparse
-import csv
-import json
-import math
-import random
-import sys, tty, termios
-from datetime import datetime, timedelta
-from termcolor import colored, cprint
-
-AGE_FACTOR = 1.6
-
-ROMA2KATA = {
-    '_a': '30A1','a': '30A2','_i': '30A3','i': '30A4','_u': '30A5','u': '30A6','_e': '30A7','e': '30A8',
-    '_o': '30A9','o': '30AA','ka': '30AB','ga': '30AC','ki': '30AD','gi': '30AE','ku': '30AF','gu': '30B0',
-    'ke': '30B1','ge': '30B2','ko': '30B3','go': '30B4','sa': '30B5','za': '30B6','shi': '30B7','ji': '30B8',
-    'su': '30B9','zu': '30BA','se': '30BB','ze': '30BC','so': '30BD','zo': '30BE','ta': '30BF','da': '30C0',
-    'chi': '30C1','chji': '30C2','_tsu': '30C3', 'tsu': '30C4', 'tzu': '30C5','te': '30C6','de': '30C7','to': '30C8',
-    'do': '30C9','na': '30CA','ni': '30CB','nu': '30CC','ne': '30CD','no': '30CE','ha': '30CF','ba': '30D0',
-    'pa': '30D1','hi': '30D2','bi': '30D3','pi': '30D4','fu': '30D5','bu': '30D6','pu': '30D7','he': '30D8',
-    'be': '30D9','pe': '30DA','ho': '30DB','bo': '30DC','po': '30DD','ma': '30DE','mi': '30DF','mu': '30E0',
-    'me': '30E1','mo': '30E2',
-    '_ya': '30E3','ya': '30E4','_yu': '30E5','yu': '30E6','_yo': '30E7','yo': '30E8',
-    'ra': '30E9','ri': '30EA','ru': '30EB','re': '30EC','ro': '30ED','_wa': '30EE','wa': '30EF', 
-    'wo': '30F2', 'n': '30F3',
-    'kyu': ('ki', '_yu'),
-    'kyo': ('ki', '_yo'),
-    'sha': ('shi', '_ya'),
-    'shu': ('shi', '_yu'),
-    'sho': ('shi', '_yo'),
-    'ju': ('ji', '_yu'),
-    'jo': ('ji', '_yo'),
-    'cha': ('chi', '_ya'),
-    'chu': ('chi', '_yu'),
-    'cho': ('chi', '_yo'),
-    'rya': ('ri', '_ya'),
-    'ryo': ('ri', '_yo'),
-    'ryu': ('ri', '_yu'),
-    'byo': ('bi', '_yo'),
-    'bya': ('bi', '_ya'),    
-    'mya': ('mi', '_ya'),    
-    'kki': ('_tsu', 'ki'),
-    'hyo': ('hi', '_yo'),
-    'kya': ('ki', '_ya'),
-    'tto': ('_tsu', 'to'),
-    'ssho': ('_tsu', 'shi', '_yo'),
-    'gyo': ('gi', '_yo'),
-    'gyu': ('gi', '_yu'),
-    'nya': ('n', '_ya'),
-    'hya': ('hi', '_ya'),
-    'nyo': ('n', '_yo'),
-    'tta': ('_tsu', 'ta'),
-}
-
-ROMA2HIRA = {
-    'a':  '3042', 'i': '3044', 'u': '3046', 'e': '3048', 'o': '304A',
-    'ka': '304B', 'ga': '304C', 'ki': '304D', 'gi': '304E', 'ku': '304F', 'gu': '3050',
-    'ke': '3051', 'ge': '3052', 'ko': '3053', 'go': '3054', 'sa': '3055', 'za': '3056', 'shi': '3057', 'ji': '3058',
-    'su': '3059', 'zu': '305A', 'se': '305B', 'ze': '305C', 'so': '305D', 'zo': '305E',
-    'ta': '305F', 'da': '3060', 'chi': '3061', '_tsu': '3063', 'tsu': '3064', 'dzu': '3065', 'te': '3066', 'de': '3067', 'to': '3068',
-    'do': '3069',
-    'na': '306A', 'ni': '306B', 'nu': '306C', 'ne': '306D', 'no': '306E', 'ha': '306F', 'ba': '3070',
-    'pa': '3071', 'hi': '3072', 'bi': '3073', 'pi': '3074', 'fu': '3075', 'bu': '3076', 'pu': '3077', 'he': '3078',
-    'be': '3079', 'pe': '307A', 'ho': '307B', 'bo': '307C', 'po': '307D', 'ma': '307E', 'mi': '307F', 'mu': '3080',
-    'me': '3081', 'mo': '3082',
-    '_ya': '3083', 'ya': '3084', '_yu': '3085', 'yu': '3086', '_yo': '3087', 'yo': '3088',
-    'ra': '3089', 'ri': '308A', 'ru': '308B', 're': '308C', 'ro': '308D', 'wa': '308F', 
-    'wo': '3092', 'n': '3093',
-    'kyu': ('ki', '_yu'),
-    'kyo': ('ki', '_yo'),
-    'sha': ('shi', '_ya'),
-    'shu': ('shi', '_yu'),
-    'sho': ('shi', '_yo'),
-    'ju': ('ji', '_yu'),
-    'jo': ('ji', '_yo'),
-    'byo': ('bi', '_yo'),
-    'nyu': ('ni', '_yu'),
-    'bya': ('bi', '_ya'),    
-    'mya': ('mi', '_ya'),    
-    'cha': ('chi', '_ya'),
-    'chu': ('chi', '_yu'), 'kyu': ('ki', '_yu'),
-    'cho': ('chi', '_yo'),
-    'kka': ('_tsu', 'ka'),
-    'kkyo': ('_tsu', 'ki', '_yo'),
-    'ppa': ('_tsu', 'pa'), 'ppo': ('_tsu', 'po'),
-    'sshi': ('_tsu', 'shi'),
-    'sshu': ('_tsu', 'shi', '_yu'),
-    'tta': ('_tsu', 'ta'),
-    'tte': ('_tsu', 'te'),
-    'rya': ('ri', '_ya'),
-    'ryo': ('ri', '_yo'),
-    'hyo': ('hi', '_yo'),
-    'sso': ('_tsu', 'so'),
-    'ssa': ('_tsu', 'sa'),
-    'ppe': ('_tsu', 'pe'),
-    'byo': ('bi', '_yo'),
-    'kki': ('_tsu', 'ki'),
-    'kke': ('_tsu', 'ke'),
-    'kko': ('_tsu', 'ko'),
-    'tto': ('_tsu', 'to'),
-    'ja': ('ji', '_ya'),
-    'kya': ('ki', '_ya'),
-    'ryu': ('ri', '_yu'),
-    'ssho': ('_tsu', 'shi', '_yo'),
-    'gyo': ('gi', '_yo'),
-    'gyu': ('gi', '_yu'),
-    'sse': ('_tsu', 'se'),
-    'nya': ('n', '_ya'),
-    'hya': ('hi', '_ya'),
-    'nyo': ('n', '_yo'),
-}
-
-# Set up some JSON-serializable data structures to track drill results.
-TODAY = datetime.today()
-FMT = '%Y-%m-%d'
-TODAYSTR = TODAY.strftime(FMT)
-
-class NotKanaError(Exception):
-
-    pass
-
-
-class DrillRecord(object):
-
-    def __init__(self, streak=0, last=TODAYSTR):
-        self.streak = streak
-        self.last = last
-
-    def save(self):
-        return (self.streak, self.last)
-
-    @classmethod
-    def load(klass, v):
-        return DrillRecord(*v)
-
-
-class CardRecord(object):
-
-    def __init__(self, m2k=None, p2o=None, k2m=None):
-        self.meaning2kanji=m2k or DrillRecord()
-        self.phrase2on = p2o or DrillRecord()
-        self.kanji2meaning = k2m or DrillRecord()
-
-    def save(self):
-        return [
-            self.meaning2kanji.save(),
-            self.phrase2on.save(),
-            self.kanji2meaning.save()
-        ]
-
-    @classmethod
-    def load(klass, v):
-        m2k = DrillRecord.load(v[0])
-        p2o = DrillRecord.load(v[1])
-        if len(v) == 3:
-            k2m = DrillRecord.load(v[2])
-        else:
-            k2m = None
-        return klass(m2k, p2o, k2m)
-
-
-class Drill(object):
 
-    def get_due(self, session):
-        due = []
-        for k, r in session.items():
-            dr = getattr(r, self.name)
-            age = TODAY - datetime.strptime(dr.last, FMT)
-            if age.days >= (AGE_FACTOR * dr.streak):
-                due.append((k, dr))
-        return due
 
-    def filter_due(self, due, cards):
-        return due
-    
-    def run(self, cards, session, limit=None):
-        
-        # Count cards due for review. If a card has passed N times, it is
-        # due N days from the last day it passed.
-        due = self.get_due(session)
-        due = self.filter_due(due, cards)
-
-        if not due:
-            cprint(f'{colored("Nothing due", "green")}')
-            return 0
-
-        # Review the cards in random order, remembering the fails for
-        # review below.
-        random.shuffle(due)
-        available = len(due)
-        if limit:
-            due = due[:limit]
-        total = len(due)
-        cprint(f'Reviewing ({total}/{available} cards)', "yellow")
-        cprint(self.instructions, "yellow")
-        fails = []
-
-        for i, (k, dr) in enumerate(due):
-            card = cards[k]
-            if self.review(card, i, total):
-                dr.streak += 1
-                cprint(f"ok {dr.streak}x", "green", attrs=["bold"])
-            else:
-                dr.streak = 0
-                cprint(f"fail (R-{card['rk2']})", "red", attrs=["bold"])
-                fails.append(card)
-            dr.last = TODAYSTR
-
-        num_correct = total - len(fails)
-        percent = round(num_correct * 100 / total)
-        cprint(f'You passed {num_correct}/{total} cards ({percent}%)', "green")
-            
-        # Review failures.
-        while fails:
-            failed = len(fails)
-            cprint(f"Reviewing failures ({failed} cards)", "yellow")
-            refails = []
-            for i, card in enumerate(fails):
-                if not self.review(card, i, failed):
-                    refails.append(card)
-                print()
-            fails = refails
-        return total
-
-
-class Meaning2KanjiDrill(Drill):
-
-    name = 'meaning2kanji'
-    instructions = 'Given the meaning, write the kanji'
-
-    def review(self, card, i, total):
-        instr1 = '<Press any key to check>'
-        instr2 = 'correct? <y/n>'
-        prompt(f'({i+1}/{total}) {colored(card["meaning"], attrs=["bold"]):16} {colored(instr1, "yellow")}')
-        backspace(instr1)
-        ok = prompt(f' {colored(card["unicode"], "cyan", attrs=["bold"])} ({card["strokes"]}) {colored(instr2, "yellow")}')
-        backspace(instr2)
-        return ok == 'y'
-
-
-class Kanji2MeaningDrill(Drill):
-
-    name = 'kanji2meaning'
-    instructions = 'Given the kanji, write the meaning'
-
-    def review(self, card, i, total):
-        promptstr = f'({i+1}/{total}) {colored(card["unicode"], "cyan", attrs=["bold"])}? '
-        r = input(promptstr)
-        
-        backup = f'\033[1A'
-        sys.stdout.write(backup)
-        print(f'{promptstr}{r} ', end='')
-
-        ok = r == card["meaning"]
-        if not ok:
-            print(f'should be {colored(card["meaning"], "red", attrs=["underline"])} ', end='')
-        return ok
-
-
-class Phrase2OnDrill(Drill):
-
-    name = 'phrase2on'
-    instructions = 'Given the kanji and exemplary phrase, type the romaji for the on reading'
-
-    def filter_due(self, due, cards):
-        """Remove any cards that have no 'on' reading."""
-        filtered = []
-        for (k, r) in due:
-            card = cards[k]
-            if card['on'] is not None:
-                filtered.append((k, r))
-        return filtered 
-    
-    def review(self, card, i, total):
-        promptstr = f'({i+1}/{total}) {colored(card["unicode"], "cyan", attrs=["bold"])} in {colored(card["phrase"]["kanji"], "cyan")}? '
-        r = input(promptstr)
-        backup = f'\033[1A'
-        sys.stdout.write(backup)
-        print(f'{promptstr}\b\b ', end='')
-        if r:
+def run_command(args):
+    """Run the chosen command, profiled and measured if asked to."""
+    if args.metrics_json:
+        import metrics
+        metrics.start()
+    try:
+        if args.profile:
+            import cProfile
+            profiler = cProfile.Profile()
             try:
-                on = roma2kata(r)
-            except (KeyError, NotKanaError):
-                on = '<invalid>'
-        else:
-            on = '?'
-        ok = on == card["on"]
-        if ok:
-            cprint(f'{on} ', "green", end='')
+                profiler.runcall(args.func, args)
+            finally:
+                profiler.dump_stats(args.profile)
         else:
-            print(f'{colored(on, "red")} should be {card["on"]} ', end='')
-        print(f'in {colored(card["phrase"]["kana"], "light_grey")} ({card["phrase"]["meaning"]}) ', end='')            
-        return ok
-    
+            args.func(args)
+    finally:
+        if args.metrics_json:
+            write_metrics(args)
 
-DRILL_CLASSES = {
-    'p2o': Phrase2OnDrill,
-    'm2k': Meaning2KanjiDrill,
-    'k2m': Kanji2MeaningDrill
-}
-
-
-def print_range(title, start, end):
-    columns = 8
-    index = start
-    print(title)
-    while index <= end:
-        entries = []
-        for column in range(columns):
-            entries.append(f'{chr(index)} {index:04X}')
-            index += 1
-            if index > end:
-                break
-        print(" | ".join(entries))
-
-
-def decode(uni):
-    if uni:
-        return chr(int(uni, 16))
-    else:
-        return None
-
-
-def decode_phrase(phr):
-    return "".join(decode(c) for c in phr.split(","))
-
-
-def convert_roma(phr, code_table, return_codes=False):
-    s = ""
-    res = []
-    codes = []
-    saw_n = False  # 'n' requires special handling
-    for c in phr:
-        if saw_n:
-            # Note: at one point I had y in this list, but then minyo
-            # failed to parse so I took it out. Note sure why I thought
-            # I needed y originally. Update: words like "nyaku" is why.
-            #import pdb; pdb.set_trace()
-            if c not in 'aeiouy':
-                # Must have been terminal 'n'
-                code = code_table[s]
-                res.append(decode(code))
-                codes.append(code)
-                s = ""
-                saw_n = False
-                # My own way to forcibly disambiguate some syllables
-                # that end in 'n'
-                if c == ':':
-                    continue
-        s += c
-        if s in code_table:
-            # Try to handle 'ni' vs 'n'
-            if s == 'n':
-                saw_n = True
-                continue
-            saw_n = False
-            try:
-                code = code_table[s]
-                res.append(decode(code))
-                codes.append(code)
-            except TypeError:
-                hira = code_table[s]
-                for h in hira:
-                    code = code_table[h]
-                    res.append(decode(code))
-                    codes.append(code)
-            s = ""
-    if s:
-        if saw_n:
-            # Must have been terminal 'n' at the end
-            code = code_table[s]
-            res.append(decode(code))
-            codes.append(code)
-        else:
-            raise NotKanaError(f'{s} is not kana')
-    hira = "".join(res)
-    if return_codes:
-        return hira, codes
-    else:
-        return hira
-
-
-def roma2kata(s):
-    return convert_roma(s, ROMA2KATA)
-
-
-def roma2hira(phr, **kwargs):
-    return convert_roma(phr, ROMA2HIRA, **kwargs)
-
-
-def load_cards(filename):
-    data = {}
-    with open(filename) as f:
-        r = csv.reader(f)
-        header = next(r)
-        for line in r:
-            pk, rk2, unic, mean, strok, on, rk1, phr,phr_kana,phr_eng=line
-            unic = decode(unic)
-            on = roma2kata(on) or None
-            phr = decode_phrase(phr) if phr else None
-            phr_kana = roma2hira(phr_kana)
-            data[pk] = {
-                "rk2": rk2,
-                "unicode": unic,
-                "meaning": mean,
-                "strokes": strok,
-                "on": on,
-                "rk1": rk1,
-                "phrase": {
-                    "kanji": phr,
-                    "kana": phr_kana,
-                    "meaning": phr_eng
-                }
-            }
-        return data
 
-    
-def dump_entry(d):
-    phr = d["phrase"]["kanji"] or '-'
-    phr_kana = d["phrase"]["kana"] or '-'
-    phr_eng =  d["phrase"]["meaning"] or '-'
-    on = d["on"] or '-'
-    print(f'{d["rk2"]:<4} {d["unicode"]} {d["meaning"]:12} {on:<6}  {phr:<6} {phr_kana:6} {phr_eng}')
-    
-def dump_csv(filename):
-    data = load_cards(filename)
-    for d in data.values():
-        dump_entry(d)
+def write_metrics(args):
+    import json
+    import sys
+    import metrics
+    report = {"command": args.func.__name__, "argv": sys.argv[1:]}
+    report.update(metrics.stop().to_json())
+    with open(args.metrics_json, 'w') as f:
+        json.dump(report, f, indent=1)
 
 
 def dump(args):
-    print_range("---hiragana---", 0x3041, 0x3096)
-    print_range("---katakana---", 0x30a1, 0x30fa)
-    dump_csv(args.kanji)
-
-
-def getch():
-    fd = sys.stdin.fileno()
-    old = termios.tcgetattr(fd)
+    """Write out the kana tables and every card, streamed from the deck."""
+    import itertools
+    from dump import dump_lines, kana_table_lines, parse_fields, parse_where
+    from metrics import phase
     try:
-        tty.setraw(sys.stdin.fileno())
-        ch = sys.stdin.read(1)
-    finally:
-        termios.tcsetattr(fd, termios.TCSADRAIN, old)
-    return ch
+        fields = parse_fields(args.fields) if args.fields else None
+        where = [parse_where(spec) for spec in args.where or ()]
+    except ValueError as e:
+        raise SystemExit(f'kanji.py: {e}')
+    if args.db:
+        from db import DbCards, open_db
+        cards = DbCards(open_db(args.db)).items()
+    else:
+        from cards import iter_cards
+        cards = iter_cards(args.kanji)
+    lines = dump_lines(cards, args.format, fields, where)
+    if args.format == 'text' and not args.fields:
+        lines = itertools.chain(kana_table_lines("---hiragana---", 0x3041, 0x3096),
+                                kana_table_lines("---katakana---", 0x30a1, 0x30fa), lines)
+    with phase('dump'):
+        write_batched(lines)
+
+
+def open_deck(args):
+    """Return the cards and session named by the command line options."""
+    from metrics import phase
+    if args.db:
+        from db import DbCards, DbSession, open_db
+        with phase('open_db'):
+            con = open_db(args.db)
+        cards = DbCards(con)
+        session = DbSession(con)
+    else:
+        from cards import load_cards
+        from session import load_session
+        with phase('load_cards'):
+            cards = load_cards(args.kanji, not args.no_cache)
+        with phase('load_session'):
+            session = load_session(args.record)
+    with phase('update_session'):
+        session.update(cards)
+    return cards, session
+
+
+def open_decks(args):
+    """
+    Load the cards and session of every deck named on the command line.
+    The files are read in a thread pool, all at once, so opening several
+    decks takes about as long as the largest one.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from cards import load_cards
+    from metrics import phase
+    from session import load_session
+    with phase('open_decks'), ThreadPoolExecutor(2 * len(args.decks)) as pool:
+        loads = [(pool.submit(load_cards, kanji, not args.no_cache), pool.submit(load_session, record))
+                 for kanji, record in args.decks]
+        decks = []
+        for cards, session in loads:
+            cards, session = cards.result(), session.result()
+            session.update(cards)
+            decks.append((cards, session))
+    return decks
+
+
+def make_drill(args, shortname, record=None):
+    """Return a drill with the scheduler chosen on the command line."""
+    from drills import DRILL_CLASSES
+    from scheduler import make_scheduler
+    if args.db and args.scheduler != 'streak':
+        raise SystemExit('kanji.py: --db keeps streaks only, so it takes only --scheduler streak')
+    try:
+        scheduler = make_scheduler(args.scheduler, record or args.record, args.retention)
+    except ValueError as e:
+        raise SystemExit(f'kanji.py: {e}')
+    return DRILL_CLASSES[shortname](scheduler)
 
 
-def prompt(str):
-    print(str, end='', flush=True)
-    return getch()
+def compact(args):
+    from session import load_session, save_session
+    session = load_session(args.record)
+    save_session(session, args.record)
 
 
-def backspace(str):
-    x = '\b' * len(str)
-    sys.stdout.write(x)
-    y = ' ' * len(str)
-    sys.stdout.write(y)
-    sys.stdout.write(x)
-        
-    
-def review_card(card):
-    instr1 = '<Write kanji on paper then press any key>'
-    instr2 = 'correct? <y/n>'
-    instr3 = '<Write "on" reading on paper then press any key>'
-    prompt(f'{colored(card["meaning"], attrs=["bold"]):16} {colored(instr1, "yellow")}')
-    backspace(instr1)
-    ok = prompt(f' {colored(card["unicode"], "cyan", attrs=["bold"])} {colored(instr2, "yellow")}')
-    backspace(instr2)
-    if ok != 'y':
-        return False
-    
-    prompt(f'{colored(instr3, "yellow")}')
-    backspace(instr3)
-    ok = prompt(f' {colored(card["on"], "cyan", attrs=["bold"])} {colored(instr2, "yellow")}')
-    backspace(instr2)
-    if ok != 'y':
-        return False
-    return True
-
-def load_session(filename):
-    # Load past session. A session is a dict where the keys are
-    # indices into the 'cards' array and the values are CardRecords.
-    try:
-        with open(filename) as f:
-            session = json.load(f)
-    except:
-        session = {}
-    for k, v in session.items():
-        session[k] = CardRecord.load(v)
-    return session
-
-
-def update_session(session, cards):
-    # Add any new cards added since the last session.
-    for k in cards.keys():
-        if k not in session:
-            session[k] = CardRecord()
-    
+def export_session(args):
+    from session import load_session, save_session
+    session = load_session(args.record)
+    save_session(session, args.filename)
 
-def save_session(session, filename):
-    # Save results.
-    for k, cr in session.items():
-        session[k] = cr.save()
-    with open(filename, 'w') as f:
-        json.dump(session, f)
+
+def import_session(args):
+    from session import load_session, save_session
+    session = load_session(args.filename)
+    save_session(session, args.record)
 
 
 def review(args):
-    cards = load_cards(args.kanji)
-    session = load_session(args.record)
-    update_session(session, cards)
+    from datetime import datetime
+    from drills import Deck, run_decks
+    from metrics import phase
+    from session import JOURNAL_COMPACT_BYTES, Journal, journal_name, save_session
+    if args.watch and args.db:
+        raise SystemExit('kanji.py: --watch follows CSV and record files, not --db')
+    # A mixed review asks every drill, interleaved.
+    drillnames = ('m2k', 'p2o', 'k2m') if args.drillname == 'mix' else (args.drillname,)
+    if len(args.decks) > 1:
+        if args.db:
+            raise SystemExit('kanji.py: review takes several decks only from CSV and record files')
+        opened = [(cards, session, Journal(journal_name(record)), record)
+                  for (cards, session), (_, record) in zip(open_decks(args), args.decks)]
+    else:
+        cards, session = open_deck(args)
+        # The database keeps the grades itself.
+        journal = None if args.db else Journal(journal_name(args.record))
+        opened = [(cards, session, journal, args.record)]
+    # One Deck per drill and deck file; a file's Decks share its journal.
+    decks = [[Deck(make_drill(args, shortname, record), cards, session, journal)
+              for shortname in drillnames]
+             for cards, session, journal, record in opened]
+    if 'k2m' in drillnames:
+        from answers import MeaningIndex, load_synonyms
+        # Meanings are checked against every meaning in their deck.
+        with phase('meaning_index'):
+            for file_decks, (kanji, _) in zip(decks, args.decks):
+                meanings = MeaningIndex(file_decks[0].cards, load_synonyms(kanji))
+                for deck in file_decks:
+                    if deck.drill.name == 'kanji2meaning':
+                        deck.drill.meanings = meanings
+
+    reviewer = None
+    if args.watch:
+        from terminal import TerminalReviewer
+        from watch import DeckWatcher, WatchingReviewer
+        watchers = [DeckWatcher(kanji, record, file_decks[0].cards, file_decks[0].session,
+                                [deck.drill for deck in file_decks])
+                    for file_decks, (kanji, record) in zip(decks, args.decks)]
+        reviewer = WatchingReviewer(TerminalReviewer(), watchers)
 
-    drill = DRILL_CLASSES[args.drillname]()
     start = datetime.now()
-    num_cards = drill.run(cards, session, args.limit)
+    try:
+        if len(decks) > 1 or len(drillnames) > 1:
+            num_cards = run_decks(sum(decks, []), args.limit, reviewer)
+        else:
+            deck = decks[0][0]
+            num_cards = deck.graded = deck.drill.run(deck.cards, deck.session, args.limit,
+                                                     deck.journal, reviewer)
+    finally:
+        for _, session, journal, _ in opened:
+            if journal:
+                journal.close()
+            else:
+                # Commit the database's grades, even after a ^C.
+                session.save()
     if not num_cards:
         return
     end = datetime.now()
-    save_session(session, args.record)
+    # Only decks that were graded have anything new to save.
+    for file_decks, (_, session, journal, record) in zip(decks, opened):
+        if any(deck.graded for deck in file_decks) and journal and journal.size() > JOURNAL_COMPACT_BYTES:
+            with phase('save_session'):
+                save_session(session, record)
 
     duration = (end - start)
-    sec_per_card = duration.seconds/num_cards
+    sec_per_card = duration.total_seconds()/num_cards
     print(f'{duration}--{sec_per_card} seconds per card')
 
 
+# The drills the forecast is printed for, in order.
+FORECAST_DRILLS = (('Writing', 'm2k'), ('Reading', 'p2o'), ('Meaning', 'k2m'))
+
+
+def days(text):
+    # argparse type for a number of days to forecast.
+    try:
+        n = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid number of days: {text}')
+    if n < 1:
+        raise argparse.ArgumentTypeError(f'need at least one day, not {n}')
+    return n
+
+
+def pass_rate(spec):
+    # argparse type for a pass rate: either a bare rate for every drill
+    # or DRILL=RATE, e.g. "0.9" or "p2o=0.75". Returns (drill, rate),
+    # with None for every drill.
+    name, _, rate = spec.rpartition('=')
+    if name and name not in [shortname for _, shortname in FORECAST_DRILLS]:
+        raise argparse.ArgumentTypeError(f'unknown drill {name}')
+    try:
+        rate = float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid pass rate: {rate}')
+    if not 0 <= rate <= 1:
+        raise argparse.ArgumentTypeError(f'pass rate must be from 0 to 1, not {rate}')
+    return name or None, rate
+
+
+def parse_pass_rates(specs):
+    rates = {shortname: 0.9 for _, shortname in FORECAST_DRILLS}
+    for name, rate in specs or ():
+        if name:
+            rates[name] = rate
+        else:
+            rates = dict.fromkeys(rates, rate)
+    return rates
+
+
+def print_forecast(cards, session, args):
+    from drills import DRILL_CLASSES
+    from forecast import forecast
+    from session import current_day
+    today = current_day()
+    rates = parse_pass_rates(args.pass_rate)
+    period = 30
+    print(f'Reviews per day over the next {args.forecast} days '
+          f'(+{args.new} new cards/day), averaged per {period} days:')
+    for label, shortname in FORECAST_DRILLS:
+        drill = DRILL_CLASSES[shortname]()
+        streaks, lasts = session.drill_columns(drill, cards)
+        counts = forecast(streaks, lasts, today, args.forecast, rates[shortname],
+                          args.new)
+        means = [round(sum(counts[i:i + period]) / len(counts[i:i + period]))
+                 for i in range(0, len(counts), period)]
+        peak = max(range(len(counts)), key=counts.__getitem__)
+        print(f'{label} ({rates[shortname]:.0%} pass): {" ".join(map(str, means))} '
+              f'peak {round(counts[peak])} on day {peak}')
+
+
 def stats(args):
     """
     Print a table. Rows indicate correct writing, columns correct phrasing.
     """
-    cards = load_cards(args.kanji)
-    session = load_session(args.record)
-    update_session(session, cards)
+    from metrics import phase
+    if args.watch and args.db:
+        raise SystemExit('kanji.py: --watch follows CSV and record files, not --db')
+    cards, session = open_deck(args)
+    if args.forecast:
+        def show():
+            with phase('forecast'):
+                print_forecast(cards, session, args)
+        drills = ()
+    else:
+        drills = (
+            ('Writing', make_drill(args, 'm2k')),
+            ('Reading', make_drill(args, 'p2o')),
+            ('Meaning', make_drill(args, 'k2m'))
+        )
+        for label, drill in drills:
+            with phase('build_index'):
+                drill.build_index(session, cards)
+
+        def show():
+            print_schedule(drills)
+    show()
+    if args.watch:
+        from watch import DeckWatcher, watch
+        watcher = DeckWatcher(args.kanji, args.record, cards, session,
+                              [drill for _, drill in drills])
+        watch([watcher], show)
+
+
+def print_schedule(drills):
+    from session import current_day
     N = 30
-    writing_sched = [0 for x in range(N)]
-    reading_sched = [0 for x in range(N)]
-    meaning_sched = [0 for x in range(N)]
-
-    drill = Meaning2KanjiDrill()
-
-    def get_due(record):
-        age = TODAY - datetime.strptime(record.last, FMT)
-        days_to_wait = math.ceil(record.streak * AGE_FACTOR)
-        days_until_due = days_to_wait - age.days
-        return max(0, days_until_due)
-
-    for k, r in session.items():
-        card = cards[k]
-        writing_sched[get_due(r.meaning2kanji)] += 1
-        if card['on'] is not None:
-            reading_sched[get_due(r.phrase2on)] += 1
-        meaning_sched[get_due(r.kanji2meaning)] += 1
-        
-    print('Writing Due: ', end='')
-    for x in range(N):
-        print(f'{writing_sched[x]} ', end='')
-    print('')
-
-    print('Reading Due: ', end='')
-    for x in range(N):
-        print(f'{reading_sched[x]} ', end='')
-    print('')
-
-    print('Meaning Due: ', end='')
-    for x in range(N):
-        print(f'{meaning_sched[x]} ', end='')
-    print('')
+    today = current_day()
+    for label, drill in drills:
+        sched = drill.due_index.schedule(today, N)
+        print(f'{label} Due: ', end='')
+        for x in range(N):
+            print(f'{sched[x]} ', end='')
+        print('')
+
+
+def search(args):
+    """Print the cards matching every term of the query."""
+    from metrics import phase
+    from search import SearchIndex, load_search_index
+    with phase('load_search_index'):
+        if args.db:
+            from db import DbCards, open_db
+            index = SearchIndex()
+            index.update(DbCards(open_db(args.db)))
+        else:
+            index = load_search_index(args.kanji, not args.no_cache)
+    try:
+        with phase('search'):
+            pks = index.search(args.query)
+    except ValueError as e:
+        raise SystemExit(f'kanji.py: {e}')
+    from dump import dump_lines
+    write_batched(dump_lines((pk, index.card(index.docs[pk])) for pk in pks[:args.limit]))
+
+
+def components(args):
+    """Print the kanji containing every given component, grouped by stroke count."""
+    import itertools
+    from components import ComponentIndex, parse_strokes, read_db_components, read_kradfile
+    from metrics import phase
+    with phase('load_components'):
+        try:
+            if args.db:
+                from db import open_db
+                entries, strokes = read_db_components(open_db(args.db))
+                if not entries:
+                    raise SystemExit('kanji.py: no components in the database; '
+                                     'load them with load_db.py --kradfile')
+            else:
+                from cards import load_cards
+                entries = read_kradfile(args.kradfile)
+                # Stroke counts come from the deck, for the kanji it has.
+                strokes = {card.kanji: card.strokes
+                           for card in load_cards(args.kanji, not args.no_cache).values()
+                           if card.strokes}
+        except (OSError, ValueError) as e:
+            raise SystemExit(f'kanji.py: {e}')
+        index = ComponentIndex(entries, strokes)
+    # Parts may be typed together, like 口木.
+    parts = [c for part in args.parts for c in part if not c.isspace()]
+    try:
+        with phase('match'):
+            hits = index.match(parts, parse_strokes(args.strokes) if args.strokes else None)
+    except ValueError as e:
+        raise SystemExit(f'kanji.py: {e}')
+    for count, group in itertools.groupby(hits, key=lambda k: strokes.get(k)):
+        print(f'{count or "?":>2}: {"".join(group)}')
+
+
+def serve_reviews(args):
+    """Run the multi-learner review service until interrupted."""
+    import asyncio
+    import os
+    from answers import load_synonyms
+    from cards import load_cards
+    from server import ReviewService, serve
+    if args.db:
+        raise SystemExit('kanji.py: serve keeps one record file per learner and cannot use --db')
+    cards = load_cards(args.kanji, not args.no_cache)
+    os.makedirs(args.records, exist_ok=True)
+    try:
+        service = ReviewService(cards, args.records, args.max_learners, args.scheduler, args.retention,
+                                load_synonyms(args.kanji))
+    except ValueError as e:
+        raise SystemExit(f'kanji.py: {e}')
+    asyncio.run(serve(service, args.host, args.port, args.unix, args.flush_interval))
+
+
+def fit_params(args):
+    """Fit the memory scheduler to the record's review history and save the result."""
+    from fit import fit
+    from metrics import phase
+    from scheduler import load_params, params_name, save_params
+    from session import iter_history
+    if args.db:
+        raise SystemExit('kanji.py: the review history is kept with record files, not in --db')
+    try:
+        with phase('fit'):
+            params, before, after, count = fit(iter_history(args.record), load_params(args.record),
+                                               args.steps)
+    except (RuntimeError, ValueError) as e:
+        raise SystemExit(f'kanji.py: {e}')
+    save_params(args.record, params)
+    print(f'Fitted {count} reviews: log loss {before:.4f} -> {after:.4f}')
+    print(' '.join(f'{name}={value:g}' for name, value in params.items()))
+    print(f'Saved to {params_name(args.record)}; review with --scheduler memory to use them.')
+
+
+def validate(args):
+    """Report every problem in the deck and the code tables."""
+    import sys
+    from validate import validate_deck
+    count = 0
+    for location, msg in validate_deck(args.kanji, args.jobs):
+        print(f'{location}: {msg}')
+        count += 1
+    if count:
+        print(f'{count} problems', file=sys.stderr)
+        sys.exit(1)
+
+
+# Batch output is written this many lines at a time.
+OUTPUT_BATCH = 4096
+
+
+def read_lines(args, positional):
+    """
+    Yield (line number, text) for each non-blank input line: the
+    positional argument, the --file argument ('-' for stdin) or stdin.
+    """
+    import sys
+    if args.file is None and not args.stdin:
+        if positional is None:
+            raise SystemExit('kanji.py: give an argument, --file or --stdin')
+        yield 1, positional
+        return
+    f = sys.stdin if args.stdin or args.file == '-' else open(args.file, encoding='utf-8')
+    try:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if line:
+                yield lineno, line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def write_batched(lines):
+    """Write an iterable of output lines to stdout a batch at a time."""
+    import itertools
+    import sys
+    out = sys.stdout
+    while True:
+        batch = list(itertools.islice(lines, OUTPUT_BATCH))
+        if not batch:
+            break
+        out.write(''.join(batch))
+    out.flush()
+
+
+def format_json(obj):
+    import json
+    return json.dumps(obj, ensure_ascii=False) + '\n'
 
 
 def roma(args):
-    kana, codes = roma2hira(args.hira, return_codes=True)
-    print(f'{kana} {",".join(codes)}')
+    """
+    Convert romaji to hiragana with the code of each kana. Lines that
+    are not kana are reported on stderr and the rest are still
+    converted; the exit status is 1 if there were any.
+    """
+    import sys
+    import metrics
+    from kana import ROMA2HIRA, NotKanaError, get_converter
+    convert = get_converter(ROMA2HIRA).convert
+    errors = 0
+
+    def convert_lines():
+        nonlocal errors
+        # Reading lists repeat the same words a lot.
+        seen = {}
+        for lineno, phr in read_lines(args, args.hira):
+            try:
+                out = seen[phr]
+            except KeyError:
+                try:
+                    out = seen[phr] = convert(phr, return_codes=True)
+                    metrics.count('conversions')
+                except NotKanaError as e:
+                    errors += 1
+                    print(f'line {lineno}: {e}', file=sys.stderr)
+                    continue
+            kana, codes = out
+            if args.format == 'tsv':
+                yield f'{phr}\t{kana}\t{",".join(codes)}\n'
+            elif args.format == 'jsonl':
+                yield format_json({"input": phr, "kana": kana, "codes": list(codes)})
+            else:
+                yield f'{kana} {",".join(codes)}\n'
+
+    write_batched(convert_lines())
+    if errors:
+        sys.exit(1)
 
 
 def kanji2unicode(args):
-    for k in args.kanji:
-        print(f'{k} {hex(ord(k))}')
+    def convert_lines():
+        for _, line in read_lines(args, args.text):
+            codes = [hex(ord(k)) for k in line]
+            if args.format == 'tsv':
+                yield f'{line}\t{",".join(codes)}\n'
+            elif args.format == 'jsonl':
+                yield format_json({"input": line, "codes": codes})
+            else:
+                yield ''.join(f'{k} {code}\n' for k, code in zip(line, codes))
+
+    write_batched(convert_lines())
 
 
 if __name__ == "__main__":
     pars = argparse.ArgumentParser(description="Kanji Tools")
-    pars.add_argument('-k', '--kanji', help="Kanji CSV file to load", default="kanji.csv")
-    pars.add_argument('-r', '--record',  help="Record file for tracking history", default="review.json")
+    pars.add_argument('-k', '--kanji', action='append', dest='kanji_files', help="Kanji CSV file to load (review takes several, each with its -r)")
+    pars.add_argument('-r', '--record', action='append', dest='record_files', help="Record file for tracking history")
+    pars.add_argument('--db', help="SQLite database to use for cards and history instead of the CSV and record files")
+    pars.add_argument('--scheduler', choices=('streak', 'memory'), default='streak',
+                      help="How cards are scheduled: by streak, or by a fitted model of each card's memory")
+    pars.add_argument('--retention', type=float, default=0.9,
+                      help="Chance of recalling a card when it falls due, for --scheduler memory")
+    pars.add_argument('--no-cache', action='store_true', help="Always re-parse the kanji CSV instead of using its catalog cache")
+    pars.add_argument('--metrics-json', metavar='PATH', help="Write timings and counts for each phase of the command to this file")
+    pars.add_argument('--profile', metavar='PATH', help="Profile the command with cProfile and write the stats to this file")
 
     subp = pars.add_subparsers(help="Commands", required=True)
     
     cmdp = subp.add_parser('dump', help="Dump kana and known kanji")
+    cmdp.add_argument('-o', '--format', choices=('text', 'tsv', 'csv', 'jsonl'), default='text',
+                      help="Output format; text also shows the kana tables")
+    cmdp.add_argument('-F', '--fields', metavar='F1,F2,...',
+                      help="Fields to write: pk rk2 kanji meaning strokes on rk1 phrase phrase-kana phrase-meaning")
+    cmdp.add_argument('-W', '--where', action='append', metavar='COND',
+                      help="Only cards meeting a condition, like strokes>=10 or meaning~water; may be repeated")
     cmdp.set_defaults(func=dump)
 
     cmdp = subp.add_parser('stats', help="Show drill stats")
+    cmdp.add_argument('-f', '--forecast', type=days, metavar='DAYS', help='Forecast daily reviews over this many days')
+    cmdp.add_argument('-p', '--pass-rate', type=pass_rate, action='append', metavar='[DRILL=]RATE', help='Assumed pass rate for the forecast, for all drills or one of m2k/p2o/k2m (default 0.9)')
+    cmdp.add_argument('-n', '--new', type=int, default=0, help='New cards added per day in the forecast')
+    cmdp.add_argument('-w', '--watch', action='store_true', help='Keep running, printing the stats again whenever the deck or record changes')
     cmdp.set_defaults(func=stats)
     
     cmdp = subp.add_parser('review', help="Drill Remembering the Kanji I")
-    cmdp.add_argument('-d', '--drillname', choices=('m2k', 'p2o', 'k2m'), default='m2k')
+    cmdp.add_argument('-d', '--drillname', choices=('m2k', 'p2o', 'k2m', 'mix'), default='m2k',
+                      help="Drill to review; mix interleaves all three")
     cmdp.add_argument('-l', '--limit', type=int, default=None, help='Limit the number of cards to review')
+    cmdp.add_argument('-w', '--watch', action='store_true', help='Pick up edits to the deck and record files during the review')
 
     cmdp.set_defaults(func=review)
 
-    cmdp = subp.add_parser('roma', help="Convert romaji to hiragana")
-    cmdp.add_argument('hira')
+    cmdp = subp.add_parser('compact', help="Fold the review journal into the record file")
+    cmdp.set_defaults(func=compact)
+
+    cmdp = subp.add_parser('export', help="Write the record (and its journal) to another file; *.json is JSON")
+    cmdp.add_argument('filename')
+    cmdp.set_defaults(func=export_session)
+
+    cmdp = subp.add_parser('import', help="Replace the record with the contents of another record file")
+    cmdp.add_argument('filename')
+    cmdp.set_defaults(func=import_session)
+
+    cmdp = subp.add_parser('search', help="Find cards; terms are FIELD:VALUE or a bare kanji, kana or word",
+                           description="Fields: meaning (m) and phrase-meaning (pm) match word prefixes; "
+                           "on in romaji or kana; kanji (k) and phrase (p) match kanji; strokes (s), "
+                           "rk1 and rk2 take a number or a range like 3-5.")
+    cmdp.add_argument('query', nargs='+')
+    cmdp.add_argument('-l', '--limit', type=int, default=None, help='Show at most this many cards')
+    cmdp.set_defaults(func=search)
+
+    cmdp = subp.add_parser('components', help="Find the kanji containing all of the given components")
+    cmdp.add_argument('parts', nargs='+', help="Components, or kanji standing for theirs")
+    cmdp.add_argument('-s', '--strokes', metavar='N|LOW-HIGH', help="Only kanji with this many strokes")
+    cmdp.add_argument('--kradfile', default='kradfile',
+                      help="KRADFILE to read the components from, unless --db is given")
+    cmdp.set_defaults(func=components)
+
+    cmdp = subp.add_parser('serve', help="Serve reviews for many learners over HTTP (JSON)")
+    cmdp.add_argument('--records', default='records', help="Directory of per-learner record files")
+    cmdp.add_argument('--host', default='127.0.0.1')
+    cmdp.add_argument('--port', type=int, default=8080)
+    cmdp.add_argument('--unix', metavar='PATH', help="Listen on this Unix socket instead of a port")
+    cmdp.add_argument('--max-learners', type=int, default=1000, help="Sessions kept in memory")
+    cmdp.add_argument('--flush-interval', type=float, default=30.0, help="Seconds between write-backs")
+    cmdp.set_defaults(func=serve_reviews)
+
+    cmdp = subp.add_parser('fit', help="Fit the memory scheduler to the record's review history (needs numpy)")
+    cmdp.add_argument('-s', '--steps', type=int, default=200, help="Gradient descent steps")
+    cmdp.set_defaults(func=fit_params)
+
+    cmdp = subp.add_parser('validate', help="Check every reading and phrase in the deck, and the romaji tables")
+    cmdp.add_argument('-j', '--jobs', type=int, default=None, help="Checking processes (default: one per CPU for big files)")
+    cmdp.set_defaults(func=validate)
+
+    batch = argparse.ArgumentParser(add_help=False)
+    batch.add_argument('--stdin', action='store_true', help="Read one input per line from stdin")
+    batch.add_argument('-f', '--file', help="Read one input per line from this file ('-' for stdin)")
+    batch.add_argument('-o', '--format', choices=('text', 'tsv', 'jsonl'), default='text',
+                       help="Output format; tsv and jsonl include the input")
+
+    cmdp = subp.add_parser('roma', parents=[batch], help="Convert romaji to hiragana")
+    cmdp.add_argument('hira', nargs='?')
     cmdp.set_defaults(func=roma)
 
-    cmdp = subp.add_parser('uni', help="Show the unicode for a character or list of characters")
-    cmdp.add_argument('kanji')
+    cmdp = subp.add_parser('uni', parents=[batch], help="Show the unicode for a character or list of characters")
+    cmdp.add_argument('text', nargs='?', metavar='kanji')
     cmdp.set_defaults(func=kanji2unicode)
     
     args = pars.parse_args()
-    args.func(args)
+    kanjis = args.kanji_files or ['kanji.csv']
+    records = args.record_files or ['review.json']
+    if len(kanjis) != len(records):
+        pars.error('give one --record for each --kanji')
+    if len(kanjis) > 1 and args.func is not review:
+        pars.error('only review takes several decks')
+    args.decks = list(zip(kanjis, records))
+    args.kanji, args.record = args.decks[0]
+    run_command(args)
@@ -2,46 +2,414 @@
 
 import argparse
 import csv
-import sqlite3
+import functools
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-from kanji import decode, decode_phrase, roma2kata, roma2hira
-    
+from components import read_kradfile
+from db import open_db
+from dictionaries import decode_jmdict, decode_kanjidic, iter_batches
+from kana import ROMA2HIRA, ROMA2KATA, convert_many, decode, decode_phrase
+from session import DRILL_NAMES, current_day
 
-def load_kanji_table(cur, data):
-    for e in data:
+
+# Rows are decoded and written in chunks of this many.
+CHUNK_SIZE = 5000
+
+# Inputs smaller than this are decoded in-process; a worker pool costs
+# more to start than it saves.
+POOL_MIN_BYTES = 8 * 1024 * 1024
+
+# Settings for the duration of a load. WAL with synchronous=NORMAL is
+# still safe against a crash, which matters for a nightly job.
+LOAD_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+)
+
+# Frames and phrases from KANJIDIC2 and JMdict have ids from here up,
+# and a CSV deck's pks, which key its frames and phrases, must be below
+# it, so neither import can overwrite or prune the other's cards.
+DICTIONARY_IDS = 1 << 30
+
+# The drills, as a table to join frames to when their review_state rows
+# are made.
+DRILLS = 'VALUES ' + ', '.join(f"('{name}')" for name in DRILL_NAMES)
+
+STAGING_SCHEMA = """
+CREATE TEMP TABLE staging (
+pk INTEGER PRIMARY KEY,
+rk2 INTEGER,
+unicode TEXT,
+meaning TEXT,
+strokes INTEGER,
+kana TEXT,
+rk1 INTEGER,
+phrase TEXT,
+phrase_kana TEXT,
+phrase_meaning TEXT
+);
+CREATE TEMP TABLE staging_phrase_kanji (
+pk INTEGER,
+position INTEGER,
+unicode TEXT
+);
+"""
+
+# Move the staged rows into the real tables. Every upsert only writes
+# a row when some column actually differs, so reloading an unchanged
+# export writes nothing. Cards are RK2 frames keyed by the CSV pk, and
+# each card's phrase shares its id. A kanji's RK1 frame comes from its
+# first row. New cards get their review_state rows, due :today.
+MERGE_STATEMENTS = (
+    ("kanji", """
+INSERT INTO kanji (unicode, strokes)
+SELECT unicode, strokes FROM (SELECT unicode, strokes, min(pk) FROM staging GROUP BY unicode)
+WHERE true
+ON CONFLICT(unicode) DO UPDATE SET strokes = excluded.strokes
+WHERE kanji.strokes IS NOT excluded.strokes
+"""),
+    ("kanji", """
+INSERT OR IGNORE INTO kanji (unicode)
+SELECT DISTINCT unicode FROM staging_phrase_kanji
+"""),
+    ("frame_v1_6", """
+INSERT INTO frame_v1_6 (frame_number, meaning, kanji_id)
+SELECT rk1, meaning, kanji_id FROM (
+  SELECT s.rk1, s.meaning, k.id AS kanji_id, min(s.pk)
+  FROM staging s JOIN kanji k ON k.unicode = s.unicode
+  GROUP BY k.id)
+WHERE true
+ON CONFLICT(kanji_id) DO UPDATE SET frame_number = excluded.frame_number, meaning = excluded.meaning
+WHERE (frame_v1_6.frame_number, frame_v1_6.meaning) IS NOT (excluded.frame_number, excluded.meaning)
+"""),
+    ("phrase", """
+INSERT INTO phrase (id, meaning, hiragana, unicode)
+SELECT pk, phrase_meaning, phrase_kana, phrase FROM staging
+WHERE phrase IS NOT NULL
+ON CONFLICT(id) DO UPDATE SET
+  meaning = excluded.meaning, hiragana = excluded.hiragana, unicode = excluded.unicode
+WHERE (phrase.meaning, phrase.hiragana, phrase.unicode)
+  IS NOT (excluded.meaning, excluded.hiragana, excluded.unicode)
+"""),
+    ("phrase", """
+DELETE FROM phrase WHERE id IN (SELECT pk FROM staging WHERE phrase IS NULL)
+"""),
+    ("phrase_kanji", """
+DELETE FROM phrase_kanji
+WHERE phrase_id IN (SELECT pk FROM staging)
+AND NOT EXISTS (
+  SELECT 1 FROM staging_phrase_kanji sp JOIN kanji k ON k.unicode = sp.unicode
+  WHERE sp.pk = phrase_kanji.phrase_id AND k.id = phrase_kanji.kanji_id)
+"""),
+    ("phrase_kanji", """
+INSERT INTO phrase_kanji (phrase_id, kanji_id, position)
+SELECT sp.pk, k.id, sp.position
+FROM staging_phrase_kanji sp JOIN kanji k ON k.unicode = sp.unicode
+WHERE true
+ON CONFLICT(phrase_id, kanji_id) DO UPDATE SET position = excluded.position
+WHERE phrase_kanji.position IS NOT excluded.position
+"""),
+    ("frame_v2_4", """
+INSERT INTO frame_v2_4 (id, frame_number, kana, kanji_id, phrase_id)
+SELECT s.pk, s.rk2, s.kana, k.id, CASE WHEN s.phrase IS NULL THEN NULL ELSE s.pk END
+FROM staging s JOIN kanji k ON k.unicode = s.unicode
+WHERE true
+ON CONFLICT(id) DO UPDATE SET
+  frame_number = excluded.frame_number, kana = excluded.kana,
+  kanji_id = excluded.kanji_id, phrase_id = excluded.phrase_id
+WHERE (frame_v2_4.frame_number, frame_v2_4.kana, frame_v2_4.kanji_id, frame_v2_4.phrase_id)
+  IS NOT (excluded.frame_number, excluded.kana, excluded.kanji_id, excluded.phrase_id)
+"""),
+    ("review_state", f"""
+INSERT OR IGNORE INTO review_state (card_id, drill, streak, last, due)
+SELECT s.pk, d.column1, 0, :today, :today FROM staging s, ({DRILLS}) d
+"""),
+)
+
+# Drop cards that are no longer in the export, with their phrases and
+# drill history. Cards from the dictionaries are not the export's to
+# drop.
+PRUNE_STATEMENTS = (
+    ("phrase_kanji", f"""
+DELETE FROM phrase_kanji WHERE phrase_id < {DICTIONARY_IDS} AND phrase_id NOT IN (SELECT pk FROM staging)
+"""),
+    ("phrase", f"""
+DELETE FROM phrase WHERE id < {DICTIONARY_IDS} AND id NOT IN (SELECT pk FROM staging)
+"""),
+    ("frame_v2_4", f"""
+DELETE FROM frame_v2_4 WHERE id < {DICTIONARY_IDS} AND id NOT IN (SELECT pk FROM staging)
+"""),
+    ("review_state", """
+DELETE FROM review_state WHERE card_id NOT IN (SELECT id FROM frame_v2_4)
+"""),
+)
+
+
+COMPONENT_STAGING_SCHEMA = """
+CREATE TEMP TABLE staging_component (
+kanji TEXT,
+component TEXT
+);
+"""
+
+# Replace the components of every kanji in the KRADFILE. Kanji not in
+# the deck are added without a stroke count, like the kanji of phrases.
+COMPONENT_STATEMENTS = (
+    ("kanji", """
+INSERT OR IGNORE INTO kanji (unicode)
+SELECT DISTINCT kanji FROM staging_component
+"""),
+    ("component", """
+INSERT OR IGNORE INTO component (unicode)
+SELECT DISTINCT component FROM staging_component
+"""),
+    ("kanji_component", """
+DELETE FROM kanji_component
+WHERE kanji_id IN (SELECT k.id FROM kanji k JOIN staging_component s ON s.kanji = k.unicode)
+AND NOT EXISTS (
+  SELECT 1 FROM staging_component s
+  JOIN kanji k ON k.unicode = s.kanji JOIN component c ON c.unicode = s.component
+  WHERE k.id = kanji_component.kanji_id AND c.id = kanji_component.component_id)
+"""),
+    ("kanji_component", """
+INSERT OR IGNORE INTO kanji_component (kanji_id, component_id)
+SELECT k.id, c.id
+FROM staging_component s JOIN kanji k ON k.unicode = s.kanji JOIN component c ON c.unicode = s.component
+"""),
+)
+
+
+DICTIONARY_STAGING_SCHEMA = """
+CREATE TEMP TABLE staging_kanji (
+unicode TEXT PRIMARY KEY,
+strokes INTEGER,
+rk1 INTEGER,
+meaning TEXT
+);
+CREATE TEMP TABLE staging_reading (
+unicode TEXT,
+position INTEGER,
+kana TEXT,
+hiragana TEXT
+);
+CREATE TEMP TABLE staging_entry (
+id INTEGER PRIMARY KEY,
+unicode TEXT,
+hiragana TEXT,
+meaning TEXT,
+rank INTEGER
+);
+CREATE TEMP TABLE staging_entry_kanji (
+id INTEGER,
+position INTEGER,
+unicode TEXT
+);
+"""
+
+# Merge KANJIDIC2 kanji. Every kanji with a meaning or a heisig6 number
+# gets an RK1 frame to hold its meaning; a meaning a deck already gave
+# it is kept.
+KANJIDIC_STATEMENTS = (
+    ("kanji", """
+INSERT INTO kanji (unicode, strokes)
+SELECT unicode, strokes FROM staging_kanji
+WHERE true
+ON CONFLICT(unicode) DO UPDATE SET strokes = excluded.strokes
+WHERE kanji.strokes IS NOT excluded.strokes
+"""),
+    ("frame_v1_6", """
+INSERT INTO frame_v1_6 (frame_number, meaning, kanji_id)
+SELECT s.rk1, s.meaning, k.id
+FROM staging_kanji s JOIN kanji k ON k.unicode = s.unicode
+WHERE s.rk1 IS NOT NULL OR s.meaning IS NOT NULL
+ON CONFLICT(kanji_id) DO UPDATE SET
+  frame_number = coalesce(excluded.frame_number, frame_v1_6.frame_number),
+  meaning = coalesce(frame_v1_6.meaning, excluded.meaning)
+WHERE (frame_v1_6.frame_number, frame_v1_6.meaning)
+  IS NOT (coalesce(excluded.frame_number, frame_v1_6.frame_number),
+          coalesce(frame_v1_6.meaning, excluded.meaning))
+"""),
+)
+
+# Merge JMdict entries as phrases, keyed by their entry number, which
+# is staged already moved up by DICTIONARY_IDS.
+JMDICT_STATEMENTS = (
+    ("kanji", """
+INSERT OR IGNORE INTO kanji (unicode)
+SELECT DISTINCT unicode FROM staging_entry_kanji
+"""),
+    ("phrase", """
+INSERT INTO phrase (id, meaning, hiragana, unicode)
+SELECT id, meaning, hiragana, unicode FROM staging_entry
+WHERE true
+ON CONFLICT(id) DO UPDATE SET
+  meaning = excluded.meaning, hiragana = excluded.hiragana, unicode = excluded.unicode
+WHERE (phrase.meaning, phrase.hiragana, phrase.unicode)
+  IS NOT (excluded.meaning, excluded.hiragana, excluded.unicode)
+"""),
+    ("phrase_kanji", """
+DELETE FROM phrase_kanji
+WHERE phrase_id IN (SELECT id FROM staging_entry)
+AND NOT EXISTS (
+  SELECT 1 FROM staging_entry_kanji se JOIN kanji k ON k.unicode = se.unicode
+  WHERE se.id = phrase_kanji.phrase_id AND k.id = phrase_kanji.kanji_id)
+"""),
+    ("phrase_kanji", """
+INSERT INTO phrase_kanji (phrase_id, kanji_id, position)
+SELECT se.id, k.id, se.position
+FROM staging_entry_kanji se JOIN kanji k ON k.unicode = se.unicode
+WHERE true
+ON CONFLICT(phrase_id, kanji_id) DO UPDATE SET position = excluded.position
+WHERE phrase_kanji.position IS NOT excluded.position
+"""),
+)
+
+# With both files, each on reading of a kanji is a card, an RK2 frame
+# without a number, illustrated by the most common word that has the
+# kanji and the reading. Cards are matched by kanji and reading, so a
+# new import keeps their history; frames from a deck are left alone.
+# New cards are numbered on from the last one, from DICTIONARY_IDS up,
+# and get their review_state rows, due :today.
+FRAME_STATEMENTS = (
+    (None, """
+CREATE TEMP TABLE staging_frame AS
+SELECT k.id AS kanji_id, r.kana, (
+  SELECT e.id FROM staging_entry_kanji se JOIN staging_entry e ON e.id = se.id
+  WHERE se.unicode = r.unicode AND instr(e.hiragana, r.hiragana)
+  ORDER BY e.rank, length(e.unicode), e.id LIMIT 1) AS phrase_id
+FROM staging_reading r JOIN kanji k ON k.unicode = r.unicode
+ORDER BY k.id, r.position
+"""),
+    ("frame_v2_4", f"""
+UPDATE frame_v2_4 SET phrase_id = s.phrase_id
+FROM staging_frame s
+WHERE frame_v2_4.kanji_id = s.kanji_id AND frame_v2_4.kana = s.kana
+AND frame_v2_4.id >= {DICTIONARY_IDS} AND frame_v2_4.phrase_id IS NOT s.phrase_id
+"""),
+    ("frame_v2_4", f"""
+INSERT INTO frame_v2_4 (id, kana, kanji_id, phrase_id)
+SELECT max(coalesce((SELECT max(id) + 1 FROM frame_v2_4), 0), {DICTIONARY_IDS})
+  + row_number() OVER (ORDER BY s.rowid) - 1,
+  kana, kanji_id, phrase_id
+FROM staging_frame s
+WHERE NOT EXISTS (
+  SELECT 1 FROM frame_v2_4 f WHERE f.kanji_id = s.kanji_id AND f.kana = s.kana)
+"""),
+    ("review_state", f"""
+INSERT OR IGNORE INTO review_state (card_id, drill, streak, last, due)
+SELECT f.id, d.column1, 0, :today, :today FROM frame_v2_4 f, ({DRILLS}) d
+WHERE f.id >= {DICTIONARY_IDS}
+"""),
+)
+
+
+def to_int(s):
+    s = s.strip()
+    return int(s) if s else None
+
+
+def is_kana(c):
+    return '\u3040' <= c <= '\u30ff'
+
+
+def decode_rows(lines):
+    """
+    Decode a chunk of CSV lines into staging rows and the (pk, position,
+    kanji) rows of their phrases. Runs in the worker pool for big files.
+    """
+    ons = convert_many((line[5] for line in lines), ROMA2KATA)
+    phr_kanas = convert_many((line[8] for line in lines), ROMA2HIRA)
+    rows = []
+    phrase_kanji = []
+    # Exports repeat the same phrases a lot, so decode each one once.
+    phrases = {'': (None, ())}
+    for line, on, phr_kana in zip(lines, ons, phr_kanas):
+        pk, rk2, unic, mean, strok, _, rk1, phr, _, phr_eng = line
+        pk = int(pk)
         try:
-            cur.execute(
-                "INSERT INTO kanji (unicode, strokes) VALUES(?, ?)",
-                (e["kanji_unicode_char"],
-                 e["kanji_strokes"])
-            )
-        except sqlite3.IntegrityError:
-            # Probably already loaded. Ignore.
-            pass
+            phr, kanji = phrases[phr]
+        except KeyError:
+            text = decode_phrase(phr)
+            kanji = []
+            for position, c in enumerate(text):
+                if not is_kana(c) and c not in text[:position]:
+                    kanji.append((position, c))
+            phrases[phr] = text, kanji
+            phr = text
+        rows.append((pk, to_int(rk2), decode(unic), mean, to_int(strok), on,
+                     to_int(rk1), phr, phr_kana, phr_eng))
+        phrase_kanji.extend([(pk, position, c) for position, c in kanji])
+    return rows, phrase_kanji
 
 
-def load_database(dbname, data):
-    con = sqlite3.connect(dbname)
-    cur = con.cursor()
-    load_kanji_table(cur, data)
-    con.commit()
-    con.close()
+def iter_chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
 
 
-def parse_csv_file(filename):
-    """ Read CSV file into flat Python arrays.
+def iter_csv_file(filename, jobs=None, decoder=decode_rows):
     """
-    data = []
+    Stream a CSV file as decoded chunks, by default (rows, phrase_kanji)
+    from decode_rows. With jobs > 1 the chunks are decoded in a process
+    pool, keeping only a few chunks in flight so memory stays flat. By
+    default the pool is only used for big files.
+    """
+    if jobs is None:
+        jobs = default_jobs(filename)
     with open(filename) as f:
         r = csv.reader(f)
         header = next(r)
-        for line in r:
-            rk2, unic, mean, strok, on, rk1, phr,phr_kana,phr_eng=line
-            unic = decode(unic)
-            on = roma2kata(on)
-            phr = decode_phrase(phr)
-            phr_kana = roma2hira(phr_kana)
+        yield from decode_chunks(iter_chunks(r, CHUNK_SIZE), decoder, jobs)
+
+
+def iter_xml_file(filename, tag, decoder, jobs=None):
+    """
+    Stream the <tag> records of a KANJIDIC2 or JMdict file as chunks
+    decoded by decoder, in a process pool like iter_csv_file.
+    """
+    if jobs is None:
+        jobs = default_jobs(filename)
+    yield from decode_chunks(iter_batches(filename, tag), decoder, jobs)
+
+
+def default_jobs(filename):
+    return os.cpu_count() if os.path.getsize(filename) >= POOL_MIN_BYTES else 1
+
+
+def decode_chunks(chunks, decoder, jobs):
+    # Decode in order, keeping only a few chunks in flight so memory
+    # stays flat while the next ones are read.
+    if jobs <= 1:
+        for chunk in chunks:
+            yield decoder(chunk)
+        return
+    with ProcessPoolExecutor(jobs) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(decoder, chunk))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def parse_csv_file(filename):
+    """ Read CSV file into flat Python arrays.
+    """
+    data = []
+    for rows, _ in iter_csv_file(filename, jobs=1):
+        for pk, rk2, unic, mean, strok, on, rk1, phr, phr_kana, phr_eng in rows:
             data.append({
+                "pk": pk,
                 "framev2_4_frame_number": rk2,
                 "kanji_unicode_char": unic,
                 "framev1_6_meaning": mean,
@@ -53,14 +421,156 @@ def parse_csv_file(filename):
                 "phrase_meaning": phr_eng
             })
     return data
-    
+
+
+def load_database(dbname, chunks, prune=False):
+    """
+    Load decoded chunks into every table in one transaction, and return
+    the number of rows changed in each table.
+    """
+    con = open_db(dbname)
+    for pragma in LOAD_PRAGMAS:
+        con.execute(pragma)
+    con.executescript(STAGING_SCHEMA)
+    params = {'today': current_day()}
+    changes = {}
+    try:
+        con.execute("BEGIN")
+        for rows, phrase_kanji in chunks:
+            con.executemany("INSERT OR REPLACE INTO staging VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            con.executemany("INSERT INTO staging_phrase_kanji VALUES (?, ?, ?)", phrase_kanji)
+        # Indexing once the rows are in is cheaper than as they go.
+        con.execute("CREATE INDEX temp.staging_phrase_kanji_pk ON staging_phrase_kanji(pk, unicode)")
+        (high,) = con.execute("SELECT max(pk) FROM staging").fetchone()
+        if high is not None and high >= DICTIONARY_IDS:
+            raise ValueError(f'pk {high} is too big: pks from {DICTIONARY_IDS} up are for dictionary cards')
+        statements = MERGE_STATEMENTS + (PRUNE_STATEMENTS if prune else ())
+        for table, sql in statements:
+            before = con.total_changes
+            con.execute(sql, params)
+            changes[table] = changes.get(table, 0) + con.total_changes - before
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+    return changes
+
+
+def load_dictionaries(dbname, kanji_chunks=None, entry_chunks=None):
+    """
+    Load decoded KANJIDIC2 chunks, JMdict chunks or both in one
+    transaction, and return the number of rows changed in each table.
+    Cards are only made when both are given.
+    """
+    con = open_db(dbname)
+    for pragma in LOAD_PRAGMAS:
+        con.execute(pragma)
+    con.executescript(DICTIONARY_STAGING_SCHEMA)
+    params = {'today': current_day()}
+    statements = ()
+    changes = {}
+    try:
+        con.execute("BEGIN")
+        if kanji_chunks is not None:
+            for kanji, readings in kanji_chunks:
+                con.executemany("INSERT OR REPLACE INTO staging_kanji VALUES (?, ?, ?, ?)", kanji)
+                con.executemany("INSERT INTO staging_reading VALUES (?, ?, ?, ?)", readings)
+            statements += KANJIDIC_STATEMENTS
+        if entry_chunks is not None:
+            for phrases, phrase_kanji in entry_chunks:
+                con.executemany(f"INSERT OR REPLACE INTO staging_entry VALUES (? + {DICTIONARY_IDS}, ?, ?, ?, ?)",
+                                phrases)
+                con.executemany(f"INSERT INTO staging_entry_kanji VALUES (? + {DICTIONARY_IDS}, ?, ?)",
+                                phrase_kanji)
+            con.execute("CREATE INDEX temp.staging_entry_kanji_id ON staging_entry_kanji(id, unicode)")
+            con.execute("CREATE INDEX temp.staging_entry_kanji_unicode ON staging_entry_kanji(unicode)")
+            statements += JMDICT_STATEMENTS
+        if kanji_chunks is not None and entry_chunks is not None:
+            statements += FRAME_STATEMENTS
+        for table, sql in statements:
+            before = con.total_changes
+            con.execute(sql, params)
+            if table is not None:
+                changes[table] = changes.get(table, 0) + con.total_changes - before
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+    return changes
+
+
+def load_components(dbname, entries):
+    """
+    Load the (kanji, components) pairs of a KRADFILE in one transaction,
+    and return the number of rows changed in each table.
+    """
+    con = open_db(dbname)
+    for pragma in LOAD_PRAGMAS:
+        con.execute(pragma)
+    con.executescript(COMPONENT_STAGING_SCHEMA)
+    changes = {}
+    try:
+        con.execute("BEGIN")
+        con.executemany("INSERT INTO staging_component VALUES (?, ?)",
+                        [(kanji, part) for kanji, parts in entries for part in parts])
+        con.execute("CREATE INDEX temp.staging_component_kanji ON staging_component(kanji, component)")
+        for table, sql in COMPONENT_STATEMENTS:
+            before = con.total_changes
+            con.execute(sql)
+            changes[table] = changes.get(table, 0) + con.total_changes - before
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+    return changes
+
 
 if __name__ == "__main__":
 
     pars = argparse.ArgumentParser(description="Load Sqlite3 database from CSV file")
     pars.add_argument('-d', '--dbname', help="Database name", default='kanji.db')
-    pars.add_argument('-f', '--filename', help="CSV filename", default='kanji.csv')
+    pars.add_argument('-f', '--filename', help="CSV filename (default: kanji.csv, unless loading XML)")
+    pars.add_argument('-j', '--jobs', type=int, default=None, help="Decoding processes (default: one per CPU for big files)")
+    pars.add_argument('--prune', action='store_true', help="Delete cards that are not in the CSV file")
+    pars.add_argument('-K', '--kradfile', help="Also load kanji components from this KRADFILE")
+    pars.add_argument('--kanjidic', help="Load kanji from this KANJIDIC2 XML file")
+    pars.add_argument('--jmdict', help="Load phrases from this JMdict XML file; with --kanjidic, "
+                      "also make a card for each on reading")
+    pars.add_argument('--grade', type=int, default=None,
+                      help="Only KANJIDIC2 kanji up to this school grade (8: jouyou, 10: jinmeiyou)")
 
     args = pars.parse_args()
-    data = parse_csv_file(args.filename)
-    load_database(args.dbname, data)
+    if args.filename or not (args.kanjidic or args.jmdict):
+        chunks = iter_csv_file(args.filename or 'kanji.csv', args.jobs)
+        try:
+            changes = load_database(args.dbname, chunks, args.prune)
+        except ValueError as e:
+            raise SystemExit(f'load_db.py: {e}')
+        for table, count in changes.items():
+            print(f'{table}: {count} rows changed')
+    if args.kanjidic or args.jmdict:
+        kanji_chunks = entry_chunks = None
+        if args.kanjidic:
+            kanji_chunks = iter_xml_file(args.kanjidic, 'character',
+                                         functools.partial(decode_kanjidic, grade=args.grade), args.jobs)
+        if args.jmdict:
+            entry_chunks = iter_xml_file(args.jmdict, 'entry', decode_jmdict, args.jobs)
+        try:
+            changes = load_dictionaries(args.dbname, kanji_chunks, entry_chunks)
+        except (OSError, ValueError) as e:
+            raise SystemExit(f'load_db.py: {e}')
+        for table, count in changes.items():
+            print(f'{table}: {count} rows changed')
+    if args.kradfile:
+        try:
+            entries = read_kradfile(args.kradfile)
+        except ValueError as e:
+            raise SystemExit(f'load_db.py: {e}')
+        for table, count in load_components(args.dbname, entries).items():
+            print(f'{table}: {count} rows changed')
@@ -0,0 +1,114 @@
+"""
+Phase timings, counters and histograms for a run of a command, written
+out by kanji.py --metrics-json. Recording is off until start() is
+called, and then every call here is a dict update, so the hooks can
+stay in the code paths for good.
+"""
+import time
+
+
+# Upper bounds, in seconds, of the buckets of the answer latency
+# histogram. The last bucket takes everything slower.
+LATENCY_BOUNDS = (0.5, 1, 2, 3, 5, 8, 13, 21, 34, 55, float('inf'))
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}      # name -> [seconds, calls]
+        self.counts = {}      # name -> number
+        self.histograms = {}  # name -> Histogram
+
+    def to_json(self):
+        return {
+            "wall_seconds": time.perf_counter() - self.start,
+            "phases": {name: {"seconds": seconds, "calls": calls}
+                       for name, (seconds, calls) in self.phases.items()},
+            "counts": self.counts,
+            "histograms": {name: h.to_json() for name, h in self.histograms.items()},
+        }
+
+
+class Histogram(object):
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * len(bounds)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def to_json(self):
+        return {
+            "bounds": [b if b != float('inf') else None for b in self.bounds],
+            "buckets": self.buckets,
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+_current = None
+
+
+def start():
+    """Start recording, and return the Metrics being recorded into."""
+    global _current
+    _current = Metrics()
+    return _current
+
+
+def stop():
+    global _current
+    metrics, _current = _current, None
+    return metrics
+
+
+def count(name, n=1):
+    if _current is not None:
+        _current.counts[name] = _current.counts.get(name, 0) + n
+
+
+def observe(name, value, bounds=LATENCY_BOUNDS):
+    if _current is not None:
+        h = _current.histograms.get(name)
+        if h is None:
+            h = _current.histograms[name] = Histogram(bounds)
+        h.add(value)
+
+
+class phase(object):
+    """
+    Time a block as a named phase. Phases with the same name add up, and
+    phases may nest, in which case the inner time is in both.
+
+        with metrics.phase('load_cards'):
+            cards = load_cards(filename)
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if _current is not None:
+            entry = _current.phases.setdefault(self.name, [0.0, 0])
+            entry[0] += time.perf_counter() - self.t0
+            entry[1] += 1
+        return False
@@ -0,0 +1,172 @@
+"""
+Schedulers decide when a card is next due. Every drill has one. The
+streak scheduler is the rule kanji.py has always used; the memory
+scheduler keeps a model of how well each card is remembered, so easy
+cards are seen far less often, and its parameters can be fitted to the
+review history (see fit.py).
+"""
+import json
+import math
+import os
+
+from session import DEFAULT_DIFFICULTY, due_day, initial_memory
+
+
+SCHEDULERS = ('streak', 'memory')
+
+# The chance of recalling a card when it falls due, by default.
+RETENTION = 0.9
+
+# Parameters of the memory model, as fitted by kanji.py fit:
+#   first_pass, first_fail  stability after a card's first review
+#   growth, decay, spacing  how much a pass multiplies the stability:
+#                           more for easy cards, less for stable ones,
+#                           more the longer the card was left
+#   lapse                   the share of its stability a card keeps when
+#                           it is failed
+#   difficulty_step         how much harder a fail makes a card
+DEFAULT_PARAMS = {
+    'first_pass': 2.0,
+    'first_fail': 0.5,
+    'growth': 1.5,
+    'decay': 0.15,
+    'spacing': 1.0,
+    'lapse': 0.3,
+    'difficulty_step': 1.0,
+}
+PARAM_NAMES = tuple(DEFAULT_PARAMS)
+
+MIN_STABILITY = 0.1
+# Each review pulls the difficulty this far back towards the default,
+# so a card that was once hard can become easy again.
+REVERSION = 0.1
+
+
+def params_name(filename):
+    return filename + '.params'
+
+
+def load_params(filename):
+    """Return the fitted parameters kept with a record file, or the defaults."""
+    try:
+        with open(params_name(filename)) as f:
+            params = json.load(f)
+    except FileNotFoundError:
+        return dict(DEFAULT_PARAMS)
+    return {name: float(params.get(name, value)) for name, value in DEFAULT_PARAMS.items()}
+
+
+def save_params(filename, params):
+    tmpname = f'{params_name(filename)}.tmp'
+    with open(tmpname, 'w') as f:
+        json.dump(params, f, indent=1)
+    os.replace(tmpname, params_name(filename))
+
+
+def recall(stability, elapsed):
+    """The chance of recalling a card elapsed days after its last review."""
+    return 0.9 ** (elapsed / stability)
+
+
+def update(params, stability, difficulty, elapsed, ok):
+    """
+    Return a card's (stability, difficulty) after a review elapsed days
+    after the last one. A stability of 0 is a card never reviewed.
+    """
+    p = params
+    if stability <= 0:
+        if ok:
+            return p['first_pass'], DEFAULT_DIFFICULTY
+        return p['first_fail'], min(10.0, DEFAULT_DIFFICULTY + p['difficulty_step'])
+    if ok:
+        r = recall(stability, elapsed)
+        stability *= 1 + (math.exp(p['growth']) * (11 - difficulty) * stability ** -p['decay']
+                          * math.expm1(p['spacing'] * (1 - r)))
+    else:
+        stability = max(MIN_STABILITY, p['lapse'] * stability)
+        difficulty += p['difficulty_step']
+    difficulty += REVERSION * (DEFAULT_DIFFICULTY - difficulty)
+    return stability, min(10.0, max(1.0, difficulty))
+
+
+class StreakScheduler(object):
+    """
+    A card that has passed N times in a row is due AGE_FACTOR * N days
+    after its last review. A fail starts the streak again.
+    """
+
+    name = 'streak'
+
+    def prepare(self, session):
+        pass
+
+    def due(self, session, name, row):
+        return due_day(*session.get(name, row))
+
+    def due_days(self, session, name):
+        return map(due_day, *session.column(name))
+
+    def grade(self, session, name, row, ok, today):
+        streak, _ = session.get(name, row)
+        streak = streak + 1 if ok else 0
+        session.set(name, row, streak, today)
+        return streak
+
+
+class MemoryScheduler(object):
+    """
+    Each card has a stability, the days until the chance of recalling it
+    falls to 90%, and a difficulty from 1 to 10. A card is due when the
+    chance falls to the target retention; passing it raises its
+    stability, most for easy cards reviewed late, and failing it cuts
+    the stability and makes it harder. Streaks are still kept, for stats
+    and for going back to the streak scheduler.
+
+    The state lives in the session's memory columns. A session without
+    them gets them from its streaks the first time it is used.
+    """
+
+    name = 'memory'
+
+    def __init__(self, params=None, retention=RETENTION):
+        if not 0 < retention < 1:
+            raise ValueError(f'retention must be between 0 and 1, not {retention}')
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        # Recall falls to the retention after this many stabilities.
+        self.factor = math.log(retention) / math.log(0.9)
+
+    def prepare(self, session):
+        if not hasattr(session, 'memory'):
+            raise ValueError('the memory scheduler needs a record file, not a database')
+        if not session.memory:
+            session.add_memory(initial_memory(session))
+
+    def due_on(self, last, stability):
+        # A new or relearned card is due straight away.
+        if stability <= 0:
+            return last
+        return last + max(1, round(stability * self.factor))
+
+    def due(self, session, name, row):
+        return self.due_on(session.get(name, row)[1], session.get_memory(name, row)[0])
+
+    def due_days(self, session, name):
+        return map(self.due_on, session.column(name)[1], session.memory[name][0])
+
+    def grade(self, session, name, row, ok, today):
+        streak, last = session.get(name, row)
+        stability, difficulty = update(self.params, *session.get_memory(name, row), today - last, ok)
+        streak = streak + 1 if ok else 0
+        session.set(name, row, streak, today)
+        session.set_memory(name, row, stability, difficulty)
+        return streak
+
+
+def make_scheduler(kind, record=None, retention=RETENTION):
+    """Return a scheduler by name, with the parameters fitted for a record file."""
+    if kind == 'streak':
+        return StreakScheduler()
+    if kind == 'memory':
+        return MemoryScheduler(load_params(record) if record else None, retention)
+    raise ValueError(f'unknown scheduler {kind}; schedulers are {", ".join(SCHEDULERS)}')
+
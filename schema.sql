@@ -1,23 +1,28 @@
 PRAGMA foreign_key = ON;
 
+/* Every statement is idempotent so that kanji.py can apply the schema
+   to an existing database when it opens it. */
+
 /* A single kanji character. */
-CREATE TABLE kanji (
+CREATE TABLE IF NOT EXISTS kanji (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 unicode TEXT CHECK(length(unicode) = 1) NOT NULL UNIQUE,
 strokes INTEGER
 );
 
 
-/* A meaningful sequence of kanji characters. */
-CREATE TABLE phrase (
+/* A meaningful sequence of kanji characters. The unicode column holds
+   the phrase as written, which may mix kanji and kana. */
+CREATE TABLE IF NOT EXISTS phrase (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 meaning TEXT NOT NULL,
-hiragana TEXT NOT NULL
+hiragana TEXT NOT NULL,
+unicode TEXT
 );
 
 
 /* An association table between a phrase and it's constituent kanji. */
-CREATE TABLE phrase_kanji (
+CREATE TABLE IF NOT EXISTS phrase_kanji (
 phrase_id INTEGER,
 kanji_id INTEGER,
 position INTEGER,
@@ -26,12 +31,14 @@ FOREIGN KEY (phrase_id) REFERENCES phrase(id),
 FOREIGN KEY (kanji_id) REFERENCES kanji(id)
 );
 
+CREATE INDEX IF NOT EXISTS phrase_kanji_kanji ON phrase_kanji(kanji_id);
+
 
 /* A frame from Heisig's Remembering the Kanji Volume 1 (Sixth
    Edition). Each kanji is assigned a canonical meaning for
-   memorization purposes.
+   memorization purposes, so there is at most one frame per kanji.
 */
-CREATE TABLE frame_v1_6 (
+CREATE TABLE IF NOT EXISTS frame_v1_6 (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 frame_number INTEGER,
 meaning TEXT,
@@ -39,12 +46,14 @@ kanji_id INTEGER,
 FOREIGN KEY (kanji_id) REFERENCES kanji(id)
 );
 
+CREATE UNIQUE INDEX IF NOT EXISTS frame_v1_6_kanji ON frame_v1_6(kanji_id);
+
 
 /* A frame from Heisig's Remembering the Kanji Volume 2 (Fourth
    Edition). Each frame represents a reading of one kanji, illustrated
-   by a phrase that employs that reading.
+   by a phrase that employs that reading. A frame is one drill card.
 */
-CREATE TABLE frame_v2_4 (
+CREATE TABLE IF NOT EXISTS frame_v2_4 (
 id INTEGER PRIMARY KEY AUTOINCREMENT,
 frame_number INTEGER,
 kana TEXT NOT NULL,
@@ -53,3 +62,43 @@ phrase_id INTEGER,
 FOREIGN KEY(kanji_id) REFERENCES kanji(id),
 FOREIGN KEY(phrase_id) REFERENCES phrase(id)
 );
+
+CREATE INDEX IF NOT EXISTS frame_v2_4_kanji ON frame_v2_4(kanji_id);
+CREATE INDEX IF NOT EXISTS frame_v2_4_phrase ON frame_v2_4(phrase_id);
+
+
+/* A component of kanji: a radical or other part, as listed in a
+   KRADFILE. */
+CREATE TABLE IF NOT EXISTS component (
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+unicode TEXT NOT NULL UNIQUE
+);
+
+
+/* An association table between a kanji and its components. */
+CREATE TABLE IF NOT EXISTS kanji_component (
+kanji_id INTEGER,
+component_id INTEGER,
+PRIMARY KEY (kanji_id, component_id),
+FOREIGN KEY (kanji_id) REFERENCES kanji(id),
+FOREIGN KEY (component_id) REFERENCES component(id)
+);
+
+CREATE INDEX IF NOT EXISTS kanji_component_component ON kanji_component(component_id);
+
+
+/* The drill history of one card in one drill. Days are ordinals (day 1
+   is 0001-01-01), and due is kept alongside streak and last so that
+   "what is due today" is a range scan over (drill, due).
+*/
+CREATE TABLE IF NOT EXISTS review_state (
+card_id INTEGER NOT NULL,
+drill TEXT NOT NULL,
+streak INTEGER NOT NULL DEFAULT 0,
+last INTEGER NOT NULL,
+due INTEGER NOT NULL,
+PRIMARY KEY (card_id, drill),
+FOREIGN KEY (card_id) REFERENCES frame_v2_4(id)
+);
+
+CREATE INDEX IF NOT EXISTS review_state_due ON review_state(drill, due);
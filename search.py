@@ -0,0 +1,358 @@
+"""
+An inverted index over the card catalog, for the search command.
+"""
+import bisect
+import functools
+import os
+import pickle
+import re
+from array import array
+
+import metrics
+from cards import Card, number, to_int
+from kana import NotKanaError, roma2kata
+
+
+# Bump this whenever the layout of the index changes.
+SEARCH_INDEX_VERSION = 3
+SEARCH_INDEX_MAGIC = b'KANJI-INDEX\n'
+
+# Fields searched by word, with prefix matching.
+WORD_FIELDS = ('meaning', 'phrase-meaning')
+# Fields searched by number, with ranges.
+NUMBER_FIELDS = ('strokes', 'rk1', 'rk2')
+
+# Short names for query fields.
+FIELD_ALIASES = {
+    'm': 'meaning',
+    'pm': 'phrase-meaning',
+    'p': 'phrase',
+    'k': 'kanji',
+    's': 'strokes',
+}
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def search_index_name(filename):
+    return filename + '.index'
+
+
+# Decks repeat the same meanings, readings and phrases a lot, so the
+# per-string work of indexing is cached.
+
+@functools.lru_cache(maxsize=65536)
+def words(text):
+    return frozenset(WORD_RE.findall(text.lower())) if text else frozenset()
+
+
+@functools.lru_cache(maxsize=65536)
+def to_katakana(text):
+    # Hiragana and katakana are the same distance apart throughout.
+    return "".join(chr(ord(c) + 0x60) if '\u3041' <= c <= '\u3096' else c for c in text)
+
+
+@functools.lru_cache(maxsize=65536)
+def phrase_kanji(text):
+    return frozenset(c for c in text if not is_kana(c)) if text else frozenset()
+
+
+def is_kana(text):
+    return all('\u3040' <= c <= '\u30ff' for c in text)
+
+
+def card_terms(card):
+    """
+    Return the (field, term) pairs a card is indexed under, and its
+    value for each number field.
+    """
+    terms = set()
+    for word in words(card.meaning):
+        terms.add(('meaning', word))
+    for word in words(card.phrase_meaning):
+        terms.add(('phrase-meaning', word))
+    if card.kanji:
+        terms.add(('kanji', card.kanji))
+    if card.on:
+        terms.add(('on', to_katakana(card.on)))
+    for c in phrase_kanji(card.phrase):
+        terms.add(('phrase', c))
+    return frozenset(terms), (card.strokes, card.rk1, card.rk2)
+
+
+# A card is stored as its fields joined with a separator that never
+# appears in the deck, which is far smaller and quicker than a pickle.
+RECORD_SEP = '\x1f'
+
+
+def card_record(card):
+    return RECORD_SEP.join((number(card.rk2), card.kanji or '', card.meaning,
+                            number(card.strokes), card.on or '', number(card.rk1),
+                            card.phrase or '', card.phrase_kana, card.phrase_meaning))
+
+
+def record_card(pk, record):
+    rk2, unic, mean, strok, on, rk1, phr, phr_kana, phr_eng = record.split(RECORD_SEP)
+    return Card(pk, to_int(rk2), unic, mean, to_int(strok), on or None, to_int(rk1),
+                phr or None, phr_kana, phr_eng)
+
+
+def contains(docs, doc):
+    i = bisect.bisect_left(docs, doc)
+    return i < len(docs) and docs[i] == doc
+
+
+class SearchIndex(object):
+    """
+    Cards are numbered with dense doc ids in the order they were first
+    indexed. Postings map (field, term) to a sorted array of doc ids, and
+    each number field is a pair of arrays, values and doc ids, sorted by
+    value, so prefix and range queries are a bisect. Each doc's card is
+    kept as a record string and only turned back into a Card when it is
+    a hit, and its position in the deck, which hits are sorted by.
+
+    When the deck changes, only the cards whose record differs are
+    re-indexed; the terms to remove are worked out again from the old
+    record. A changed card gets a new doc id, so doc ids are not in deck
+    order once the index has been updated.
+    """
+
+    def __init__(self):
+        self.source = None
+        self.pks = []
+        self.records = []
+        self.postings = {}
+        self.fields = {field: [] for field in WORD_FIELDS}
+        self.numbers = {field: (array('q'), array('i')) for field in NUMBER_FIELDS}
+        self.positions = array('i')
+        self.docs = {}
+
+    def __len__(self):
+        return len(self.docs)
+
+    def card(self, doc):
+        return record_card(self.pks[doc], self.records[doc])
+
+    def add(self, pk, record, terms, numbers):
+        # Doc ids only grow, so appending keeps every posting sorted.
+        doc = len(self.pks)
+        self.pks.append(pk)
+        self.records.append(record)
+        self.docs[pk] = doc
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = array('i')
+                field, word = term
+                if field in self.fields:
+                    bisect.insort(self.fields[field], word)
+            docs.append(doc)
+        # New docs go on the end of the number columns, which update()
+        # then sorts again in one go; until then remove() can't find
+        # anything in them.
+        for field, value in zip(NUMBER_FIELDS, numbers):
+            if value is not None:
+                values, docs = self.numbers[field]
+                values.append(value)
+                docs.append(doc)
+
+    def remove(self, pk):
+        doc = self.docs.pop(pk)
+        terms, numbers = card_terms(record_card(pk, self.records[doc]))
+        for term in terms:
+            docs = self.postings[term]
+            docs.pop(bisect.bisect_left(docs, doc))
+            if not docs:
+                del self.postings[term]
+                field, word = term
+                if field in self.fields:
+                    words = self.fields[field]
+                    words.pop(bisect.bisect_left(words, word))
+        for field, value in zip(NUMBER_FIELDS, numbers):
+            if value is not None:
+                values, docs = self.numbers[field]
+                # Equal values are sorted by doc id.
+                i = bisect.bisect_left(docs, doc, bisect.bisect_left(values, value),
+                                       bisect.bisect_right(values, value))
+                del values[i]
+                del docs[i]
+        # The doc id is not reused; its slots are left empty.
+        self.pks[doc] = None
+        self.records[doc] = None
+
+    def update(self, cards):
+        """
+        Bring the index in line with a card dict. Returns the number of
+        cards added, changed or removed.
+        """
+        added = {}
+        order = []
+        for pk, card in cards.items():
+            order.append(pk)
+            record = card_record(card)
+            doc = self.docs.get(pk)
+            if doc is None or self.records[doc] != record:
+                added[pk] = card, record
+        removed = [pk for pk in self.docs if pk in added or pk not in cards]
+        # Every removal comes before the first add, while the number
+        # columns are still sorted.
+        for pk in removed:
+            self.remove(pk)
+        for pk, (card, record) in added.items():
+            self.add(pk, record, *card_terms(card))
+        changed = len(added) + sum(pk not in cards for pk in removed)
+        if changed:
+            self.sort_numbers()
+        # The deck may also have been reordered without changing a card.
+        self.positions = array('i', [-1]) * len(self.pks)
+        for position, pk in enumerate(order):
+            self.positions[self.docs[pk]] = position
+        return changed
+
+    def sort_numbers(self):
+        # Only the docs added since the last sort are out of order, and
+        # they are one run at the end, which sorted() merges cheaply.
+        for field, (values, docs) in self.numbers.items():
+            pairs = sorted(zip(values, docs))
+            self.numbers[field] = (array('q', [v for v, _ in pairs]),
+                                   array('i', [d for _, d in pairs]))
+
+    def lookup(self, field, term):
+        return self.postings.get((field, term), ())
+
+    def lookup_prefix(self, field, prefix):
+        words = self.fields[field]
+        i = bisect.bisect_left(words, prefix)
+        res = set()
+        while i < len(words) and words[i].startswith(prefix):
+            res.update(self.postings[field, words[i]])
+            i += 1
+        return res
+
+    def lookup_range(self, field, low, high):
+        values, docs = self.numbers[field]
+        return docs[bisect.bisect_left(values, low):bisect.bisect_right(values, high)]
+
+    def match(self, field, value):
+        """Return the docs matching one query term, as a set or array."""
+        field = FIELD_ALIASES.get(field, field)
+        if field in WORD_FIELDS:
+            return self.lookup_prefix(field, value.lower())
+        if field in NUMBER_FIELDS:
+            low, sep, high = value.partition('-')
+            try:
+                low = int(low) if low else 0
+                high = int(high) if high else (2**63 - 1 if sep else low)
+            except ValueError:
+                raise ValueError(f'{field} wants a number or a range, not {value}')
+            return self.lookup_range(field, low, high)
+        if field == 'on':
+            if not is_kana(value):
+                try:
+                    value = roma2kata(value.lower())
+                except NotKanaError:
+                    return ()
+            return self.lookup('on', to_katakana(value))
+        if field in ('kanji', 'phrase'):
+            return self.intersect([self.lookup(field, c) for c in value])
+        if field:
+            raise ValueError(f'unknown search field {field}')
+        # A bare term is a kanji, a kana reading or a meaning.
+        if is_kana(value):
+            return self.match('on', value)
+        if value.isascii():
+            return self.match('meaning', value)
+        return self.match('kanji', value)
+
+    @staticmethod
+    def intersect(hits):
+        if not hits:
+            return set()
+        hits = sorted(hits, key=len)
+        res = set(hits[0])
+        for docs in hits[1:]:
+            if not res:
+                break
+            if isinstance(docs, array) and len(res) * 16 < len(docs):
+                # A few candidates against a long posting: probe it.
+                res = {doc for doc in res if contains(docs, doc)}
+            else:
+                res.intersection_update(docs)
+        return res
+
+    def search(self, query):
+        """
+        Return the pks of the cards matching every term of a query, each
+        either FIELD:VALUE or a bare value, in deck order.
+        """
+        hits = []
+        for term in query:
+            field, sep, value = term.partition(':')
+            if not sep:
+                field, value = '', term
+            hits.append(self.match(field, value))
+        docs = sorted(self.intersect(hits), key=self.positions.__getitem__)
+        return [self.pks[doc] for doc in docs]
+
+    def dump(self, f):
+        pickle.dump((SEARCH_INDEX_VERSION, self.source, self.pks, self.records, self.postings,
+                     self.fields, self.numbers, self.positions), f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, f):
+        """Read an index, or return None if it is from another version."""
+        state = pickle.load(f)
+        if state[0] != SEARCH_INDEX_VERSION:
+            return None
+        index = cls()
+        (_, index.source, index.pks, index.records, index.postings, index.fields, index.numbers,
+         index.positions) = state
+        index.docs = {pk: doc for doc, pk in enumerate(index.pks) if pk is not None}
+        return index
+
+
+def load_search_index(filename, use_cache=True):
+    """
+    Return the search index for a CSV deck. The index is kept next to
+    the CSV and, when the CSV changes, updated from the new card catalog
+    rather than rebuilt.
+    """
+    from cards import load_cards
+    st = os.stat(filename)
+    source = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+    indexname = search_index_name(filename)
+    index = None
+    if use_cache:
+        try:
+            with open(indexname, 'rb') as f:
+                if f.read(len(SEARCH_INDEX_MAGIC)) == SEARCH_INDEX_MAGIC:
+                    index = SearchIndex.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, ValueError, TypeError):
+            index = None
+        if index is not None and index.source == source:
+            metrics.count('search_index_hits')
+            return index
+    if index is None:
+        index = SearchIndex()
+    metrics.count('search_index_cards_updated', index.update(load_cards(filename, use_cache)))
+    index.source = source
+    if use_cache:
+        save_search_index(indexname, index)
+    return index
+
+
+def save_search_index(indexname, index):
+    # Like the card cache, written to a temporary file and renamed into
+    # place, and skipped if the directory is read-only.
+    tmpname = f'{indexname}.{os.getpid()}.tmp'
+    try:
+        with open(tmpname, 'wb') as f:
+            f.write(SEARCH_INDEX_MAGIC)
+            index.dump(f)
+            metrics.count('bytes_written', f.tell())
+        os.replace(tmpname, indexname)
+    except OSError:
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
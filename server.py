@@ -0,0 +1,336 @@
+"""
+A review service for many learners at once. The card catalog is loaded
+once and shared; each learner has their own session (a record file and
+journal in the records directory), kept in memory while in use.
+
+The API is JSON over HTTP, on a TCP port or a Unix socket:
+
+    GET  /health
+    GET  /learners/NAME/due?drill=m2k&limit=20
+    POST /learners/NAME/grade   {"drill": "m2k", "pk": "12", "answer": "y"}
+                                (or "ok": true/false instead of "answer")
+    GET  /learners/NAME/stats?days=30
+
+A wrong kanji2meaning answer that is another card's meaning, or one
+typo from it, gets those cards' pks back under "others".
+
+Grades are journaled as they are made, like kanji.py review, and the
+sessions are written back in the background and when evicted.
+"""
+import asyncio
+import json
+import os
+import re
+import signal
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+from answers import MeaningIndex
+from drills import DRILL_CLASSES, Deck
+from scheduler import RETENTION, make_scheduler
+from session import Journal, current_day, journal_name, load_session, save_session
+
+
+LEARNER_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+# Requests bigger than this are refused.
+MAX_BODY = 64 * 1024
+# Pending connections; asyncio's default of 100 is too few when
+# hundreds of learners connect at once.
+BACKLOG = 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Learner(object):
+    """
+    One learner's session and due indexes. Every change to the session
+    happens under the lock, so concurrent answers from the same learner
+    are applied one at a time, and a write-back never sees a half-made
+    grade.
+    """
+
+    def __init__(self, name, filename, session, drills):
+        self.name = name
+        self.filename = filename
+        self.session = session
+        self.drills = drills
+        self.journal = Journal(journal_name(filename))
+        self.lock = asyncio.Lock()
+        self.dirty = False
+        self.evicted = False
+
+    def save(self):
+        # Runs in a worker thread, with the lock held.
+        save_session(self.session, self.filename)
+        self.journal.close()
+        self.dirty = False
+
+
+def open_learner(name, filename, cards, scheduler='streak', retention=RETENTION, meanings=None):
+    """Load a learner's session and index it. Runs in a worker thread."""
+    session = load_session(filename)
+    session.update(cards)
+    drills = {}
+    for shortname, cls in DRILL_CLASSES.items():
+        # Each learner's memory model has their own fitted parameters.
+        drill = cls(make_scheduler(scheduler, filename, retention))
+        if shortname == 'k2m':
+            drill.meanings = meanings
+        drill.build_index(session, cards)
+        drills[shortname] = drill
+    return Learner(name, filename, session, drills)
+
+
+class ReviewService(object):
+
+    def __init__(self, cards, records, max_learners=1000, scheduler='streak', retention=RETENTION,
+                 synonyms=()):
+        self.cards = cards
+        # Shared by every learner's kanji2meaning drill.
+        self.meanings = MeaningIndex(cards, synonyms)
+        self.records = records
+        self.max_learners = max_learners
+        self.scheduler = scheduler
+        self.retention = retention
+        self.learners = OrderedDict()  # name -> Learner, least recently used first
+        self.loading = {}              # name -> Future of a Learner
+        self.evicting = {}             # name -> Task writing it back
+
+    async def learner(self, name):
+        """Return a learner's state, loading it if it isn't in memory."""
+        if not LEARNER_RE.match(name):
+            raise HttpError(400, f'bad learner name {name!r}')
+        while True:
+            learner = self.learners.get(name)
+            if learner is not None:
+                self.learners.move_to_end(name)
+                return learner
+            # A learner being evicted is reloaded only once it is on disk.
+            evicting = self.evicting.get(name)
+            if evicting is None or evicting.done():
+                break
+            await asyncio.shield(evicting)
+        # Only one request loads a learner; the others wait for it.
+        future = self.loading.get(name)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self.loading[name] = asyncio.ensure_future(asyncio.to_thread(
+            open_learner, name, os.path.join(self.records, name + '.dat'), self.cards,
+            self.scheduler, self.retention, self.meanings))
+        try:
+            learner = await future
+        finally:
+            del self.loading[name]
+        self.learners[name] = learner
+        await self.evict()
+        return learner
+
+    async def evict(self):
+        while len(self.learners) > self.max_learners:
+            name, learner = self.learners.popitem(last=False)
+            task = self.evicting[name] = asyncio.ensure_future(self.write_back(learner, True))
+            try:
+                await asyncio.shield(task)
+            finally:
+                if self.evicting.get(name) is task:
+                    del self.evicting[name]
+
+    async def write_back(self, learner, evict=False):
+        async with learner.lock:
+            if learner.dirty:
+                await asyncio.to_thread(learner.save)
+            else:
+                learner.journal.close()
+            learner.evicted = evict
+
+    async def flush(self):
+        for learner in list(self.learners.values()):
+            await self.write_back(learner)
+
+    async def flush_every(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def drill(self, learner, shortname):
+        try:
+            return learner.drills[shortname or 'm2k']
+        except KeyError:
+            raise HttpError(400, f'unknown drill {shortname}')
+
+    async def due(self, name, query):
+        learner = await self.learner(name)
+        drill = self.drill(learner, query.get('drill'))
+        limit = int(query.get('limit', 20))
+        today = current_day()
+        session = learner.session
+        deck = Deck(drill, self.cards, session)
+        # The longest overdue first.
+        first = [row for _, _, _, row in deck.iter_due(today, 0, limit)]
+        cards = [dict(self.cards[session.key(row)].to_dict(), pk=str(session.key(row)))
+                 for row in first]
+        return {"drill": drill.name, "available": deck.count_due(today), "cards": cards}
+
+    async def grade(self, name, body):
+        try:
+            pk = int(body.get('pk'))
+        except (TypeError, ValueError):
+            raise HttpError(404, f'no card {body.get("pk")}')
+        card = self.cards.get(pk)
+        if card is None:
+            raise HttpError(404, f'no card {pk}')
+        while True:
+            learner = await self.learner(name)
+            drill = self.drill(learner, body.get('drill'))
+            if 'answer' in body:
+                ok = drill.check(card, body['answer'])
+            elif 'ok' in body:
+                ok = bool(body['ok'])
+            else:
+                raise HttpError(400, 'give an answer or ok')
+            today = current_day()
+            async with learner.lock:
+                # Evicted while this waited for the lock: grade the
+                # reloaded copy instead.
+                if learner.evicted:
+                    continue
+                row = learner.session.rows()[pk]
+                streak = drill.grade(learner.session, row, ok, today)
+                due = drill.scheduler.due(learner.session, drill.name, row)
+                learner.dirty = True
+                # The journal fsyncs, so it is written off the event loop.
+                await asyncio.to_thread(learner.journal.append, pk, drill.name, streak, today,
+                                        learner.session.get_memory(drill.name, row))
+            break
+        result = {"pk": str(pk), "drill": drill.name, "ok": ok, "streak": streak, "due": due - today}
+        if not ok and 'answer' in body and drill.name == 'kanji2meaning':
+            result["others"] = [str(other.pk) for other in drill.other_cards(card, body['answer'])]
+        return result
+
+    async def stats(self, name, query):
+        learner = await self.learner(name)
+        days = int(query.get('days', 30))
+        today = current_day()
+        return {drill.name: drill.due_index.schedule(today, days)
+                for drill in learner.drills.values()}
+
+    async def route(self, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if parts == ['health']:
+            return {"learners": len(self.learners), "cards": len(self.cards)}
+        if len(parts) != 3 or parts[0] != 'learners':
+            raise HttpError(404, f'no such path {path}')
+        name, action = parts[1], parts[2]
+        if action == 'grade':
+            if method != 'POST':
+                raise HttpError(405, 'grade wants POST')
+            return await self.grade(name, body)
+        if method != 'GET':
+            raise HttpError(405, f'{action} wants GET')
+        if action == 'due':
+            return await self.due(name, query)
+        if action == 'stats':
+            return await self.stats(name, query)
+        raise HttpError(404, f'no such path {path}')
+
+    async def handle(self, reader, writer):
+        """Serve the requests on one connection, keeping it alive."""
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, raw = request
+                try:
+                    url = urlsplit(target)
+                    query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                    body = json.loads(raw) if raw else {}
+                    if not isinstance(body, dict):
+                        raise HttpError(400, 'body must be a JSON object')
+                    status, result = 200, await self.route(method, url.path, query, body)
+                except HttpError as e:
+                    status, result = e.status, {"error": str(e)}
+                except ValueError as e:
+                    status, result = 400, {"error": str(e)}
+                except Exception as e:
+                    status, result = 500, {"error": f'{type(e).__name__}: {e}'}
+                write_response(writer, status, result)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HttpError as e:
+            write_response(writer, e.status, {"error": str(e)})
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    """
+    Read one HTTP/1.1 request, returning (method, target, headers, body),
+    or None at the end of the connection.
+    """
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HttpError(400, 'bad request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise HttpError(400, 'bad content-length')
+    if length > MAX_BODY:
+        raise HttpError(413, 'request too big')
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+
+def write_response(writer, status, result):
+    body = json.dumps(result, ensure_ascii=False).encode()
+    writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                 f'Content-Type: application/json\r\n'
+                 f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+
+
+async def serve(service, host='127.0.0.1', port=8080, unix=None, flush_interval=30.0, ready=None):
+    """Run the service until cancelled or signalled, then write everything back."""
+    if unix:
+        server = await asyncio.start_unix_server(service.handle, unix, backlog=BACKLOG)
+    else:
+        server = await asyncio.start_server(service.handle, host, port, backlog=BACKLOG)
+    flusher = asyncio.ensure_future(service.flush_every(flush_interval))
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    if ready is not None:
+        ready.set_result(server)
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        flusher.cancel()
+        await service.flush()
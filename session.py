@@ -0,0 +1,569 @@
+"""
+Drill history: due dates, the columnar session store, its record file
+formats and the review journal.
+"""
+import bisect
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import date
+
+import metrics
+
+
+AGE_FACTOR = 1.6
+
+FMT = '%Y-%m-%d'
+
+
+def current_day():
+    # Resolved per call, so a long-running process that crosses midnight
+    # sees the new day.
+    return date.today().toordinal()
+
+
+def str2day(s):
+    # FMT is ISO 8601, which fromisoformat parses much faster than
+    # strptime.
+    return date.fromisoformat(s).toordinal()
+
+
+def day2str(day):
+    return date.fromordinal(day).strftime(FMT)
+
+
+def due_day(streak, last):
+    # If a card has passed N times, it is due AGE_FACTOR * N days from
+    # the last day it was reviewed.
+    return last + math.ceil(AGE_FACTOR * streak)
+
+
+class DueIndex(object):
+    """
+    The cards of one drill bucketed by the day they fall due, so asking
+    what is due costs O(due cards) rather than a pass over the deck.
+    filtered is true when only the cards the drill wants were indexed.
+    """
+
+    filtered = False
+
+    def __init__(self):
+        self.buckets = {}  # due day -> set of rows
+        self.days = []     # sorted keys of self.buckets
+
+    def add(self, row, day):
+        bucket = self.buckets.get(day)
+        if bucket is None:
+            bucket = self.buckets[day] = set()
+            bisect.insort(self.days, day)
+        bucket.add(row)
+
+    def remove(self, row, day):
+        """Take a row out, returning whether it was in the index."""
+        bucket = self.buckets.get(day)
+        if bucket is None or row not in bucket:
+            return False
+        bucket.remove(row)
+        if not bucket:
+            del self.buckets[day]
+            del self.days[bisect.bisect_left(self.days, day)]
+        return True
+
+    def move(self, row, old, new):
+        # A row that has left the index, because its card was deleted
+        # from the deck while it was being reviewed, stays out.
+        if old != new and self.remove(row, old):
+            self.add(row, new)
+
+    def due(self, today):
+        """Return the rows of every card due on or before today."""
+        rows = []
+        for day in self.days[:bisect.bisect_right(self.days, today)]:
+            rows.extend(self.buckets[day])
+        return rows
+
+    def bands(self, today):
+        """
+        Yield (day, rows) for each day with cards due by today, the
+        earliest first. Days are only looked at as they are reached.
+        """
+        for day in self.days[:bisect.bisect_right(self.days, today)]:
+            yield day, self.buckets[day]
+
+    def count(self, today):
+        return sum(len(self.buckets[day])
+                   for day in self.days[:bisect.bisect_right(self.days, today)])
+
+    def schedule(self, today, n):
+        """
+        Return a histogram of the number of cards due in 0..n-1 days.
+        Overdue cards count as due today.
+        """
+        sched = [0] * n
+        for day in self.days:
+            days_until_due = max(0, day - today)
+            if days_until_due >= n:
+                break
+            sched[days_until_due] += len(self.buckets[day])
+        return sched
+
+
+# The drills tracked for every card, in record file order.
+DRILL_NAMES = ('meaning2kanji', 'phrase2on', 'kanji2meaning')
+
+RECORD_MAGIC = b'KANJIREC'
+# Version 2 files add the memory columns after the version 1 ones.
+RECORD_VERSION = 1
+RECORD_VERSION_MEMORY = 2
+RECORD_HEADER = struct.Struct('<8sIII')  # magic, version, count, drills
+
+
+class Session(object):
+    """
+    Drill history for a deck, stored by column: one array of pks plus,
+    for each drill, one array of streaks and one of last-review days.
+    Cards are addressed by row. Nothing is created per card, so a scan
+    over a few hundred thousand cards is just a walk over int arrays.
+
+    A session loaded from a binary record file starts out as read-only
+    views over the memory-mapped file, so only the columns actually
+    touched get decoded. The first change copies them into arrays.
+
+    Sessions used with the memory scheduler also have, for each drill, a
+    column of stabilities and one of difficulties (see scheduler.py).
+    They are only there once add_memory has been called, or if the file
+    had them.
+    """
+
+    def __init__(self):
+        self.pks = array('q')
+        self.columns = {name: (array('i'), array('i')) for name in DRILL_NAMES}
+        self.memory = {}
+        self.mapped = None
+        self._rows = None
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __contains__(self, k):
+        return k in self.rows()
+
+    def rows(self):
+        """Return a dict mapping card pk to row, built on first use."""
+        if self._rows is None:
+            self._rows = {pk: row for row, pk in enumerate(self.pks)}
+        return self._rows
+
+    def key(self, row):
+        return self.pks[row]
+
+    def column(self, name):
+        """Return the (streaks, lasts) columns of a drill."""
+        return self.columns[name]
+
+    def get(self, name, row):
+        streaks, lasts = self.columns[name]
+        return streaks[row], lasts[row]
+
+    def set(self, name, row, streak, last):
+        if self.mapped is not None:
+            self.unmap()
+        streaks, lasts = self.columns[name]
+        streaks[row] = streak
+        lasts[row] = last
+
+    def add_memory(self, columns):
+        """
+        Add the memory columns, a dict mapping each drill name to a pair
+        of float sequences, (stabilities, difficulties), one per row.
+        """
+        if self.mapped is not None:
+            self.unmap()
+        self.memory = {name: (array('f', stabilities), array('f', difficulties))
+                       for name, (stabilities, difficulties) in columns.items()}
+
+    def get_memory(self, name, row):
+        """Return a card's (stability, difficulty), or None if there are none."""
+        if not self.memory:
+            return None
+        stabilities, difficulties = self.memory[name]
+        return stabilities[row], difficulties[row]
+
+    def set_memory(self, name, row, stability, difficulty):
+        if self.mapped is not None:
+            self.unmap()
+        stabilities, difficulties = self.memory[name]
+        stabilities[row] = stability
+        difficulties[row] = difficulty
+
+    def add(self, k, today=None):
+        """Add a new card, due today in every drill, and return its row."""
+        if self.mapped is not None:
+            self.unmap()
+        if today is None:
+            today = current_day()
+        k = int(k)
+        row = len(self.pks)
+        self.pks.append(k)
+        for streaks, lasts in self.columns.values():
+            streaks.append(0)
+            lasts.append(today)
+        # A stability of 0 marks a card never reviewed.
+        for stabilities, difficulties in self.memory.values():
+            stabilities.append(0.0)
+            difficulties.append(0.0)
+        self.rows()[k] = row
+        return row
+
+    def update(self, cards):
+        # Add any new cards added since the last session.
+        rows = self.rows()
+        for k in cards.keys():
+            if k not in rows:
+                self.add(k)
+
+    def build_index(self, drill, cards=None):
+        """
+        Index a drill by due day. This is the only pass over the whole
+        deck; after it, due queries and grading are incremental.
+        """
+        return self.build_indexes([drill], cards)[0]
+
+    def build_indexes(self, drills, cards=None):
+        """Index several drills in the same pass over the deck."""
+        indexes = [DueIndex() for drill in drills]
+        rows = enumerate(zip(*[drill.scheduler.due_days(self, drill.name) for drill in drills]))
+        if cards is None:
+            for row, days in rows:
+                for index, day in zip(indexes, days):
+                    index.add(row, day)
+            return indexes
+        # Cards deleted from the deck keep their history but are not
+        # indexed.
+        for index in indexes:
+            index.filtered = True
+        for row, days in rows:
+            card = cards.get(self.key(row))
+            if card is not None:
+                for drill, index, day in zip(drills, indexes, days):
+                    if drill.wants(card):
+                        index.add(row, day)
+        return indexes
+
+    def drill_columns(self, drill, cards):
+        """Return the (streaks, lasts) columns of the cards a drill wants."""
+        streaks, lasts = self.column(drill.name)
+        # Like build_indexes, leave out the cards deleted from the deck.
+        rows = []
+        for row in range(len(self)):
+            card = cards.get(self.key(row))
+            if card is not None and drill.wants(card):
+                rows.append(row)
+        if len(rows) == len(self):
+            return streaks, lasts
+        return [streaks[row] for row in rows], [lasts[row] for row in rows]
+
+    def save(self, filename):
+        # Save a full snapshot, then drop the journal it supersedes. The
+        # snapshot is renamed into place so a crash leaves either the old
+        # or the new one, and the journal is only removed once it is safe.
+        # Files named *.json get the JSON format, anything else is binary.
+        tmpname = f'{filename}.{os.getpid()}.tmp'
+        if filename.endswith('.json'):
+            with open(tmpname, 'w') as f:
+                json.dump(self.to_json(), f)
+        else:
+            with open(tmpname, 'wb') as f:
+                self.write(f)
+        metrics.count('bytes_written', os.path.getsize(tmpname))
+        os.replace(tmpname, filename)
+        archive_journal(filename)
+
+    def unmap(self):
+        # Copy the file-backed views into arrays that can grow.
+        def copy(view):
+            a = array(view.format)
+            a.frombytes(view.cast('B'))
+            view.release()
+            if sys.byteorder != 'little':
+                a.byteswap()
+            return a
+        self.pks = copy(self.pks)
+        self.columns = {name: (copy(s), copy(l))
+                        for name, (s, l) in self.columns.items()}
+        self.memory = {name: (copy(s), copy(d))
+                       for name, (s, d) in self.memory.items()}
+        self.mapped.close()
+        self.mapped = None
+
+    @classmethod
+    def map(klass, f):
+        """Load a binary record file lazily, by memory-mapping it."""
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, ndrills = RECORD_HEADER.unpack_from(mm)
+        if magic != RECORD_MAGIC or version not in (RECORD_VERSION, RECORD_VERSION_MEMORY):
+            mm.close()
+            raise ValueError(f'{f.name} is not a version {RECORD_VERSION} '
+                             f'or {RECORD_VERSION_MEMORY} record file')
+        session = klass()
+        view = memoryview(mm)
+        offset = RECORD_HEADER.size
+
+        def take(typecode):
+            nonlocal offset
+            size = array(typecode).itemsize * count
+            col = view[offset:offset + size].cast(typecode)
+            offset += size
+            return col
+
+        session.pks = take('q')
+        for name in DRILL_NAMES[:ndrills]:
+            session.columns[name] = (take('i'), take('i'))
+        if version == RECORD_VERSION_MEMORY:
+            for name in DRILL_NAMES[:ndrills]:
+                session.memory[name] = (take('f'), take('f'))
+        session.mapped = mm
+        if sys.byteorder != 'little' or ndrills < len(DRILL_NAMES):
+            # Fill in any missing drills (and fix the byte order).
+            session.unmap()
+            today = current_day()
+            for name in DRILL_NAMES[ndrills:]:
+                session.columns[name] = (array('i', [0] * count),
+                                         array('i', [today] * count))
+                if session.memory:
+                    session.memory[name] = (array('f', [0.0] * count),
+                                            array('f', [0.0] * count))
+        return session
+
+    def write(self, f):
+        version = RECORD_VERSION_MEMORY if self.memory else RECORD_VERSION
+        f.write(RECORD_HEADER.pack(RECORD_MAGIC, version, len(self), len(DRILL_NAMES)))
+        cols = [self.pks]
+        for name in DRILL_NAMES:
+            cols.extend(self.columns[name])
+        if self.memory:
+            for name in DRILL_NAMES:
+                cols.extend(self.memory[name])
+        for col in cols:
+            if sys.byteorder != 'little':
+                col = array(col.format, col)
+                col.byteswap()
+            f.write(col)
+
+    @classmethod
+    def from_json(klass, data):
+        # The JSON record maps each key to a list of [streak, "YYYY-MM-DD"]
+        # pairs in DRILL_NAMES order, with the stability and difficulty
+        # on the end if the session has them. Old files lack the last
+        # drill.
+        session = klass()
+        today = current_day()
+        if any(len(entry) == 4 for v in data.values() for entry in v[:1]):
+            session.memory = {name: (array('f'), array('f')) for name in DRILL_NAMES}
+        for k, v in data.items():
+            session.pks.append(int(k))
+            for i, name in enumerate(DRILL_NAMES):
+                streaks, lasts = session.columns[name]
+                entry = v[i] if i < len(v) else (0, day2str(today))
+                streaks.append(entry[0])
+                lasts.append(str2day(entry[1]))
+                if session.memory:
+                    stabilities, difficulties = session.memory[name]
+                    stabilities.append(entry[2] if len(entry) == 4 else 0.0)
+                    difficulties.append(entry[3] if len(entry) == 4 else 0.0)
+        return session
+
+    def to_json(self):
+        data = {}
+        cols = [self.columns[name] for name in DRILL_NAMES]
+        if self.memory:
+            mems = [self.memory[name] for name in DRILL_NAMES]
+            for row, pk in enumerate(self.pks):
+                data[str(pk)] = [(streaks[row], day2str(lasts[row]),
+                                  stabilities[row], difficulties[row])
+                                 for (streaks, lasts), (stabilities, difficulties)
+                                 in zip(cols, mems)]
+            return data
+        for row, pk in enumerate(self.pks):
+            data[str(pk)] = [(streaks[row], day2str(lasts[row]))
+                             for streaks, lasts in cols]
+        return data
+
+
+# Compact the journal into the record file once it grows past this.
+JOURNAL_COMPACT_BYTES = 256 * 1024
+
+
+def journal_name(filename):
+    return filename + '.journal'
+
+
+class Journal(object):
+    """
+    Append-only log of graded cards, kept next to the record file. Each
+    answer is written out as soon as it is graded, so a killed process
+    or a Ctrl-C keeps the progress made so far, and a review costs
+    O(cards reviewed) to save instead of O(deck).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = None
+
+    def open(self):
+        self.f = open(self.filename, 'ab')
+        # A process killed mid-write can leave a torn last line. Start on
+        # a fresh line so it doesn't swallow the next record.
+        if self.f.tell() > 0:
+            with open(self.filename, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.f.write(b'\n')
+
+    def append(self, k, name, streak, last, memory=None):
+        # memory is the card's (stability, difficulty), if it has them.
+        if self.f is None:
+            self.open()
+        entry = [str(k), name, streak, day2str(last)]
+        if memory is not None:
+            entry.extend(round(x, 4) for x in memory)
+        line = json.dumps(entry).encode() + b'\n'
+        self.f.write(line)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        metrics.count('journal_appends')
+        metrics.count('bytes_written', len(line))
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def size(self):
+        try:
+            return os.path.getsize(self.filename)
+        except OSError:
+            return 0
+
+
+def replay_journal(session, filename):
+    # Apply the journaled grades on top of the snapshot, in the order
+    # they were made. Records hold absolute values, so replaying a
+    # journal that was already compacted is harmless.
+    try:
+        f = open(filename)
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            try:
+                k, name, streak, last, *memory = json.loads(line)
+                k = int(k)
+            except ValueError:
+                # Torn line from an interrupted write.
+                continue
+            row = session.rows().get(k)
+            if row is None:
+                row = session.add(k)
+            session.set(name, row, streak, str2day(last))
+            if memory:
+                if not session.memory:
+                    session.add_memory(initial_memory(session))
+                session.set_memory(name, row, *memory)
+            metrics.count('journal_lines_replayed')
+
+
+def history_name(filename):
+    return filename + '.history'
+
+
+def archive_journal(filename):
+    """
+    Move a record file's journal onto the end of its history, which
+    keeps every grade ever made for fitting the memory model. A crash
+    part way leaves lines in both; the fit skips repeats.
+    """
+    try:
+        with open(journal_name(filename), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    if data:
+        if not data.endswith(b'\n'):
+            data += b'\n'
+        with open(history_name(filename), 'ab') as f:
+            f.write(data)
+            metrics.count('bytes_written', len(data))
+    os.remove(journal_name(filename))
+
+
+def iter_history(filename):
+    """
+    Yield (key, drill name, streak, day) for every grade made with a
+    record file, oldest first: its history, then its live journal.
+    """
+    for name in (history_name(filename), journal_name(filename)):
+        try:
+            f = open(name)
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    k, drill, streak, day = json.loads(line)[:4]
+                except ValueError:
+                    continue
+                yield k, drill, streak, str2day(day)
+
+
+# Difficulty of a card carried over from the streak rule, on the memory
+# model's scale of 1 (easy) to 10.
+DEFAULT_DIFFICULTY = 5.0
+
+
+def initial_memory(session, difficulty=DEFAULT_DIFFICULTY):
+    """
+    Memory columns for a session that has none, carried over from the
+    streaks: a card's stability is the interval the streak rule gave it.
+    Cards on a streak of 0 start again as new, with a stability of 0.
+    """
+    columns = {}
+    for name in DRILL_NAMES:
+        streaks, _ = session.column(name)
+        columns[name] = ([AGE_FACTOR * streak for streak in streaks],
+                         [difficulty if streak else 0.0 for streak in streaks])
+    return columns
+
+
+def load_session(filename):
+    # Load past session. The record file is either the binary columnar
+    # format or the older JSON one, which is still read and written for
+    # import and export.
+    try:
+        f = open(filename, 'rb')
+    except FileNotFoundError:
+        session = Session()
+    else:
+        with f:
+            if f.read(len(RECORD_MAGIC)) == RECORD_MAGIC:
+                session = Session.map(f)
+            else:
+                f.seek(0)
+                try:
+                    session = Session.from_json(json.load(f))
+                except ValueError:
+                    session = Session()
+    replay_journal(session, journal_name(filename))
+    return session
+
+
+def update_session(session, cards):
+    session.update(cards)
+
+
+def save_session(session, filename):
+    session.save(filename)
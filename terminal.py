@@ -0,0 +1,123 @@
+"""
+Raw terminal input and colored output for the interactive drills.
+"""
+import sys
+import termios
+import tty
+
+from termcolor import colored, cprint
+
+
+def getch():
+    fd = sys.stdin.fileno()
+    old = termios.tcgetattr(fd)
+    try:
+        tty.setraw(sys.stdin.fileno())
+        ch = sys.stdin.read(1)
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old)
+    return ch
+
+
+def prompt(str):
+    print(str, end='', flush=True)
+    return getch()
+
+
+def backspace(str):
+    x = '\b' * len(str)
+    sys.stdout.write(x)
+    y = ' ' * len(str)
+    sys.stdout.write(y)
+    sys.stdout.write(x)
+        
+    
+def review_card(card):
+    instr1 = '<Write kanji on paper then press any key>'
+    instr2 = 'correct? <y/n>'
+    instr3 = '<Write "on" reading on paper then press any key>'
+    prompt(f'{colored(card.meaning, attrs=["bold"]):16} {colored(instr1, "yellow")}')
+    backspace(instr1)
+    ok = prompt(f' {colored(card.kanji, "cyan", attrs=["bold"])} {colored(instr2, "yellow")}')
+    backspace(instr2)
+    if ok != 'y':
+        return False
+    
+    prompt(f'{colored(instr3, "yellow")}')
+    backspace(instr3)
+    ok = prompt(f' {colored(card.on, "cyan", attrs=["bold"])} {colored(instr2, "yellow")}')
+    backspace(instr2)
+    if ok != 'y':
+        return False
+    return True
+
+
+class TerminalReviewer(object):
+    """Asks the drill questions on the terminal and shows the results."""
+
+    def nothing_due(self, drill):
+        cprint(f'{colored("Nothing due", "green")}')
+
+    def begin(self, drill, total, available):
+        cprint(f'Reviewing ({total}/{available} cards)', "yellow")
+        cprint(drill.instructions, "yellow")
+
+    def ask(self, drill, card, i, total):
+        return getattr(self, 'ask_' + drill.name)(drill, card, i, total)
+
+    def ask_meaning2kanji(self, drill, card, i, total):
+        instr1 = '<Press any key to check>'
+        instr2 = 'correct? <y/n>'
+        prompt(f'({i+1}/{total}) {colored(card.meaning, attrs=["bold"]):16} {colored(instr1, "yellow")}')
+        backspace(instr1)
+        ok = prompt(f' {colored(card.kanji, "cyan", attrs=["bold"])} ({card.strokes or "?"}) {colored(instr2, "yellow")}')
+        backspace(instr2)
+        return ok
+
+    def ask_kanji2meaning(self, drill, card, i, total):
+        promptstr = f'({i+1}/{total}) {colored(card.kanji, "cyan", attrs=["bold"])}? '
+        r = input(promptstr)
+
+        backup = f'\033[1A'
+        sys.stdout.write(backup)
+        print(f'{promptstr}{r} ', end='')
+        return r
+
+    def ask_phrase2on(self, drill, card, i, total):
+        promptstr = f'({i+1}/{total}) {colored(card.kanji, "cyan", attrs=["bold"])} in {colored(card.phrase, "cyan")}? '
+        r = input(promptstr)
+        backup = f'\033[1A'
+        sys.stdout.write(backup)
+        print(f'{promptstr}\b\b ', end='')
+        return r
+
+    def checked(self, drill, card, answer, ok, streak=None):
+        """
+        Show whether an answer was right. streak is the new streak for a
+        graded review, and None when going over failures again.
+        """
+        if drill.name == 'kanji2meaning' and not ok:
+            print(f'should be {colored(card.meaning, "red", attrs=["underline"])} ', end='')
+            others = drill.other_cards(card, answer)
+            if others:
+                print(f'({answer} is {"".join(other.kanji for other in others[:5])}) ', end='')
+        elif drill.name == 'phrase2on':
+            on = drill.reading(answer)
+            if ok:
+                cprint(f'{on} ', "green", end='')
+            else:
+                print(f'{colored(on, "red")} should be {card.on} ', end='')
+            print(f'in {colored(card.phrase_kana, "light_grey")} ({card.phrase_meaning}) ', end='')
+        if streak is None:
+            print()
+        elif ok:
+            cprint(f"ok {streak}x", "green", attrs=["bold"])
+        else:
+            cprint(f"fail (R-{card.rk2})", "red", attrs=["bold"])
+
+    def passed(self, drill, num_correct, total):
+        percent = round(num_correct * 100 / total)
+        cprint(f'You passed {num_correct}/{total} cards ({percent}%)', "green")
+
+    def begin_failures(self, drill, failed):
+        cprint(f"Reviewing failures ({failed} cards)", "yellow")
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from bench_memory import dict_cards, measure
+from bench_micro import generate_deck
+from cards import load_cards, parse_rows
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ParseRowsTest(unittest.TestCase):
+
+    def test_codes_and_text_kept_apart(self):
+        cards = parse_rows([
+            ['1', '1', '4e8c', 'two', '2', 'ni', '2', '4e8c', 'ni', '4e8c'],
+            ['2', '2', '4e09', '4e8c', '3', '', '3', '', '', ''],
+            ['3', '3', '4e00', '', '1', 'ichi', '1', '4e00', 'ichi', '4e00'],
+        ])
+        self.assertEqual(cards[1].kanji, '\u4e8c')
+        self.assertEqual(cards[1].phrase, '\u4e8c')
+        self.assertEqual(cards[1].phrase_meaning, '4e8c')
+        self.assertEqual(cards[2].meaning, '4e8c')
+        self.assertIsNone(cards[2].phrase)
+        self.assertEqual(cards[2].phrase_meaning, '')
+        self.assertEqual(cards[3].meaning, '')
+        self.assertEqual(cards[3].phrase_meaning, '4e00')
+
+    def test_strings_shared(self):
+        cards = parse_rows([
+            ['1', '1', '4e8c', 'two', '2', 'ni', '2', '4e8c,4e16', 'nisei', 'second-generation'],
+            ['2', '2', '4e8c', 'two', '2', 'ni', '2', '4e8c,4e16', 'nisei', 'second-generation'],
+        ])
+        for name in ('kanji', 'meaning', 'on', 'phrase', 'phrase_kana', 'phrase_meaning'):
+            self.assertIs(getattr(cards[1], name), getattr(cards[2], name), name)
+
+
+class CatalogMemoryTest(unittest.TestCase):
+    """The slotted Cards against the card dicts load_cards used to return."""
+
+    def test_peak_drops(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            deck = os.path.join(workdir, 'kanji.csv')
+            generate_deck(deck, 20000, os.path.join(HERE, 'kanji.csv'))
+            dict_size, dict_peak, _ = measure(lambda: dict_cards(deck))
+            size, peak, _ = measure(lambda: load_cards(deck, use_cache=False))
+            self.assertLess(size, dict_size / 2)
+            self.assertLess(peak, dict_peak)
+            load_cards(deck)
+            cached_size, cached_peak, _ = measure(lambda: load_cards(deck))
+            self.assertLess(cached_size, dict_size / 2)
+            self.assertLess(cached_peak, dict_peak)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+import csv
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from db import DbCards, DbSession, open_db
+from load_db import (DICTIONARY_IDS, decode_jmdict, decode_kanjidic, iter_csv_file, iter_xml_file,
+                     load_database, load_dictionaries)
+from session import DRILL_NAMES
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# The tables as the first schema.sql made them, before phrase.unicode.
+OLD_SCHEMA = """
+CREATE TABLE kanji (
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+unicode TEXT CHECK(length(unicode) = 1) NOT NULL UNIQUE,
+strokes INTEGER
+);
+CREATE TABLE phrase (
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+meaning TEXT NOT NULL,
+hiragana TEXT NOT NULL
+);
+CREATE TABLE phrase_kanji (
+phrase_id INTEGER,
+kanji_id INTEGER,
+position INTEGER,
+PRIMARY KEY (phrase_id, kanji_id)
+);
+CREATE TABLE frame_v1_6 (
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+frame_number INTEGER,
+meaning TEXT,
+kanji_id INTEGER
+);
+CREATE TABLE frame_v2_4 (
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+frame_number INTEGER,
+kana TEXT NOT NULL,
+kanji_id INTEGER,
+phrase_id INTEGER
+);
+"""
+
+
+KANJIDIC = """<?xml version="1.0" encoding="UTF-8"?>
+<kanjidic2>
+<header><file_version>4</file_version></header>
+<character><literal>\u9f8d</literal><misc><stroke_count>16</stroke_count></misc>
+<reading_meaning><rmgroup><reading r_type="ja_on">\u30ea\u30e5\u30a6</reading>
+<meaning>dragon</meaning></rmgroup></reading_meaning></character>
+<character><literal>\u9b5a</literal><misc><stroke_count>11</stroke_count></misc>
+<reading_meaning><rmgroup><reading r_type="ja_on">\u30ae\u30e7</reading>
+<meaning>fish</meaning></rmgroup></reading_meaning></character>
+</kanjidic2>
+"""
+
+JMDICT = """<?xml version="1.0" encoding="UTF-8"?>
+<JMdict>
+<entry><ent_seq>1000010</ent_seq><k_ele><keb>\u9f8d\u738b</keb></k_ele>
+<r_ele><reb>\u308a\u3085\u3046\u304a\u3046</reb></r_ele><sense><gloss>dragon king</gloss></sense></entry>
+<entry><ent_seq>1000020</ent_seq><k_ele><keb>\u91d1\u9b5a</keb></k_ele>
+<r_ele><reb>\u304d\u3093\u304e\u3087</reb></r_ele><sense><gloss>goldfish</gloss></sense></entry>
+</JMdict>
+"""
+
+
+def read_deck(n):
+    with open(os.path.join(HERE, 'kanji.csv')) as f:
+        rows = list(csv.reader(f))
+    return rows[0], rows[1:n + 1]
+
+
+def write_deck(filename, header, rows):
+    with open(filename, 'w', newline='') as f:
+        csv.writer(f).writerows([header] + rows)
+
+
+class DbTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dbname = os.path.join(self.tmp.name, 'kanji.db')
+        self.deck = os.path.join(self.tmp.name, 'kanji.csv')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def load(self, rows, prune=False):
+        write_deck(self.deck, self.header, rows)
+        return load_database(self.dbname, iter_csv_file(self.deck, jobs=1), prune)
+
+    def test_old_schema(self):
+        con = sqlite3.connect(self.dbname)
+        con.executescript(OLD_SCHEMA)
+        con.execute("INSERT INTO kanji (unicode, strokes) VALUES (?, 1)", ('\u4e00',))
+        con.execute("INSERT INTO phrase (id, meaning, hiragana) VALUES (1, 'one', ?)", ('\u3044\u3061',))
+        con.execute("INSERT INTO frame_v2_4 (id, frame_number, kana, kanji_id, phrase_id) "
+                    "VALUES (1, 1, ?, 1, 1)", ('\u30a4\u30c1',))
+        con.commit()
+        con.close()
+        con = open_db(self.dbname)
+        columns = [row[1] for row in con.execute("PRAGMA table_info(phrase)")]
+        self.assertIn('unicode', columns)
+        card = DbCards(con)[1]
+        self.assertEqual((card.kanji, card.phrase, card.phrase_kana), ('\u4e00', None, '\u3044\u3061'))
+        con.close()
+        # Opening it again finds the column already there.
+        open_db(self.dbname).close()
+        self.header, rows = read_deck(20)
+        self.assertTrue(self.load(rows)['phrase'])
+        con = open_db(self.dbname)
+        self.assertEqual(len(list(DbCards(con).values())), 20)
+        con.close()
+
+    def test_load_tracks_cards(self):
+        self.header, rows = read_deck(20)
+        self.assertEqual(self.load(rows)['review_state'], 20 * len(DRILL_NAMES))
+        self.assertEqual(self.load(rows)['review_state'], 0)
+        self.assertEqual(self.load_dictionaries()['review_state'], 2 * len(DRILL_NAMES))
+        self.assertEqual(self.load_dictionaries()['review_state'], 0)
+        con = open_db(self.dbname)
+        self.assertEqual(len(DbSession(con)), 22)
+        con.close()
+
+    def test_grades_committed_on_save(self):
+        self.header, rows = read_deck(5)
+        self.load(rows)
+        con = open_db(self.dbname)
+        session = DbSession(con)
+        session.set(DRILL_NAMES[0], 1, 3, 700000)
+        other = sqlite3.connect(self.dbname)
+        query = "SELECT streak FROM review_state WHERE card_id = 1 AND drill = ?"
+        self.assertEqual(other.execute(query, (DRILL_NAMES[0],)).fetchone(), (0,))
+        session.save()
+        self.assertEqual(other.execute(query, (DRILL_NAMES[0],)).fetchone(), (3,))
+        other.close()
+        con.close()
+
+    def test_prune(self):
+        self.header, rows = read_deck(20)
+        self.load(rows)
+        con = open_db(self.dbname)
+        DbSession(con).update(DbCards(con))
+        con.close()
+        # Drop the first card and add another, keeping the card count.
+        new = list(rows[0])
+        new[0] = '5000'
+        self.load(rows[1:] + [new], prune=True)
+        con = open_db(self.dbname)
+        session = DbSession(con)
+        session.update(DbCards(con))
+        self.assertNotIn(int(rows[0][0]), session)
+        self.assertIn(5000, session)
+        self.assertEqual(len(session), 20)
+        count = con.execute("SELECT count(*) FROM review_state").fetchone()[0]
+        self.assertEqual(count, 20 * len(DRILL_NAMES))
+        con.close()
+
+    def load_dictionaries(self):
+        kanjidic = os.path.join(self.tmp.name, 'kanjidic2.xml')
+        jmdict = os.path.join(self.tmp.name, 'JMdict_e')
+        for filename, text in ((kanjidic, KANJIDIC), (jmdict, JMDICT)):
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return load_dictionaries(self.dbname, iter_xml_file(kanjidic, 'character', decode_kanjidic, 1),
+                                 iter_xml_file(jmdict, 'entry', decode_jmdict, 1))
+
+    def test_dictionary_cards_kept_apart(self):
+        self.assertEqual(self.load_dictionaries()['frame_v2_4'], 2)
+        con = open_db(self.dbname)
+        DbSession(con).update(DbCards(con))
+        frames = con.execute("SELECT id, phrase_id FROM frame_v2_4 ORDER BY id").fetchall()
+        self.assertEqual(frames, [(DICTIONARY_IDS, DICTIONARY_IDS + 1000010),
+                                  (DICTIONARY_IDS + 1, DICTIONARY_IDS + 1000020)])
+        con.close()
+        # A deck reloaded and pruned leaves the dictionary cards alone.
+        self.header, rows = read_deck(20)
+        self.load(rows, prune=True)
+        con = open_db(self.dbname)
+        self.assertEqual(con.execute("SELECT id, phrase_id FROM frame_v2_4 WHERE id >= ? ORDER BY id",
+                                     (DICTIONARY_IDS,)).fetchall(), frames)
+        self.assertEqual(len(DbCards(con)), 22)
+        self.assertIn(DICTIONARY_IDS, DbSession(con))
+        con.close()
+        self.assertFalse(any(self.load_dictionaries().values()))
+
+    def test_pk_too_big(self):
+        self.header, rows = read_deck(2)
+        rows[1][0] = str(DICTIONARY_IDS)
+        with self.assertRaises(ValueError):
+            self.load(rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run(*argv, **kwargs):
+    return subprocess.run([sys.executable, os.path.join(HERE, 'kanji.py')] + list(argv),
+                          capture_output=True, text=True, cwd=HERE, **kwargs)
+
+
+class UniTest(unittest.TestCase):
+
+    def test_argument(self):
+        result = run('uni', '\u6f22\u5b57')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout, '\u6f22 0x6f22\n\u5b57 0x5b57\n')
+
+    def test_argument_with_deck_options(self):
+        result = run('-k', 'kanji.csv', '-r', 'review.json', 'uni', '\u5b57')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout, '\u5b57 0x5b57\n')
+
+    def test_no_argument(self):
+        result = run('uni')
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout, '')
+        self.assertIn('give an argument', result.stderr)
+
+    def test_stdin(self):
+        result = run('uni', '--stdin', '-o', 'tsv', input='\u6f22\n\n\u5b57\n')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout, '\u6f22\t0x6f22\n\u5b57\t0x5b57\n')
+
+
+class DeckOptionsTest(unittest.TestCase):
+
+    def test_record_for_each_kanji(self):
+        result = run('-k', 'a.csv', '-k', 'b.csv', 'review')
+        self.assertEqual(result.returncode, 2)
+        self.assertIn('give one --record for each --kanji', result.stderr)
+
+    def test_one_deck_only(self):
+        result = run('-k', 'a.csv', '-r', 'a.json', '-k', 'b.csv', '-r', 'b.json', 'stats')
+        self.assertEqual(result.returncode, 2)
+        self.assertIn('only review takes several decks', result.stderr)
+
+
+class ForecastTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        shutil.copy(os.path.join(HERE, 'kanji.csv'), self.tmp.name)
+        self.deck = ('-k', os.path.join(self.tmp.name, 'kanji.csv'),
+                     '-r', os.path.join(self.tmp.name, 'review.json'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_card_deleted_from_deck(self):
+        self.assertEqual(run(*self.deck, 'compact').returncode, 0)
+        record = os.path.join(self.tmp.name, 'review.json')
+        with open(record) as f:
+            data = json.load(f)
+        data['99999'] = [[0, '2020-01-01']] * 3
+        with open(record, 'w') as f:
+            json.dump(data, f)
+        result = run(*self.deck, 'stats', '-f', '30')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        with open(os.path.join(HERE, 'kanji.csv')) as f:
+            cards = sum(1 for line in f) - 1
+        self.assertIn('Writing (90% pass): ', result.stdout)
+        self.assertIn(f'peak {cards} on day 0', result.stdout)
+
+    def test_bad_options(self):
+        for option, message in ((('-p', 'zz=0.5'), 'unknown drill zz'),
+                                (('-p', '1.5'), 'pass rate must be from 0 to 1'),
+                                (('-p', 'p2o=x'), 'invalid pass rate'),
+                                (('-f', '-5'), 'need at least one day'),
+                                (('-f', '0'), 'need at least one day')):
+            result = run(*self.deck, 'stats', '-f', '30', *option)
+            self.assertEqual(result.returncode, 2, option)
+            self.assertIn(message, result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
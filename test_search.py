@@ -0,0 +1,66 @@
+import unittest
+
+from cards import Card
+from search import SearchIndex
+
+
+def make_card(pk, strokes, rk1, meaning='water'):
+    return Card(pk, pk, chr(0x4e00 + pk), meaning, strokes, None, rk1, None, '', '')
+
+
+def make_deck(n):
+    return {pk: make_card(pk, 5 + pk % 7, 100 + pk) for pk in range(1, n + 1)}
+
+
+class SearchIndexUpdateTest(unittest.TestCase):
+
+    def assert_same(self, index, cards):
+        fresh = SearchIndex()
+        fresh.update(cards)
+        for query in (['s:1-30'], ['rk1:0-'], ['rk2:0-'], ['water']):
+            self.assertEqual(index.search(query), fresh.search(query), query)
+            self.assertEqual(index.search(query), [pk for pk in cards if pk in set(fresh.search(query))])
+        for low in range(0, 13):
+            expected = [pk for pk, card in cards.items() if card.strokes == low]
+            self.assertEqual(index.search([f's:{low}']), expected)
+
+    def test_lower_several_numbers(self):
+        cards = make_deck(40)
+        index = SearchIndex()
+        index.update(cards)
+        for pk in (3, 9, 17, 25, 33):
+            cards[pk] = make_card(pk, 1 + pk % 3, pk)
+        self.assertEqual(index.update(cards), 5)
+        self.assert_same(index, cards)
+        # And again, so the changed cards are changed a second time.
+        for pk in (9, 10, 11, 33):
+            cards[pk] = make_card(pk, 30, 1000 - pk)
+        self.assertEqual(index.update(cards), 4)
+        self.assert_same(index, cards)
+
+    def test_add_and_remove(self):
+        cards = make_deck(20)
+        index = SearchIndex()
+        index.update(cards)
+        del cards[4], cards[12]
+        cards[50] = make_card(50, 2, 1)
+        cards[7] = make_card(7, 3, 2, 'fire')
+        self.assertEqual(index.update(cards), 4)
+        self.assert_same(index, cards)
+        self.assertEqual(index.search(['fire']), [7])
+
+    def test_deck_order(self):
+        cards = make_deck(10)
+        index = SearchIndex()
+        index.update(cards)
+        cards[2] = make_card(2, 6, 102)
+        index.update(cards)
+        self.assertEqual(index.search(['water']), list(range(1, 11)))
+        # A deck reordered without changing any card.
+        reordered = dict(reversed(list(cards.items())))
+        index.update(reordered)
+        self.assertEqual(index.search(['water']), list(range(10, 0, -1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import asyncio
+import unittest
+
+from server import HttpError, read_request
+
+
+def read(data):
+    async def go():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_request(reader)
+    return asyncio.run(go())
+
+
+class ReadRequestTest(unittest.TestCase):
+
+    def test_body(self):
+        request = read(b'POST /x HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}')
+        self.assertEqual(request, ('POST', '/x', {'content-length': '2'}, b'{}'))
+
+    def test_bad_content_length(self):
+        for length in (b'abc', b'-5', b''):
+            with self.assertRaises(HttpError) as cm:
+                read(b'POST /x HTTP/1.1\r\nContent-Length: ' + length + b'\r\n\r\n{}')
+            self.assertEqual(cm.exception.status, 400)
+            self.assertEqual(str(cm.exception), 'bad content-length')
+
+
+if __name__ == '__main__':
+    unittest.main()
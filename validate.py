@@ -0,0 +1,152 @@
+"""
+Whole-deck validation. Every reading is round-tripped through the
+conversion tables and back, and the tables themselves are checked, so
+that every bad row is reported in one pass instead of one crash at a
+time.
+"""
+
+import ast
+import os
+
+import kana
+from kana import (ROMA2HIRA, ROMA2KATA, NotKanaError, RomaConverter, decode, decode_phrase,
+                  get_converter)
+from load_db import iter_csv_file
+
+TABLES = (('ROMA2KATA', ROMA2KATA), ('ROMA2HIRA', ROMA2HIRA))
+
+
+def check_reading(roma, code_table):
+    """Return a message if roma does not survive a round trip, else None."""
+    conv = get_converter(code_table)
+    try:
+        text = conv.convert(roma)
+        back = conv.to_roma(text)
+    except NotKanaError as e:
+        return str(e)
+    if conv.convert(back) != text:
+        return f'{roma} reads as {text} but {back} does not'
+    return None
+
+
+def validate_rows(lines):
+    """
+    Check a chunk of CSV lines. Returns the pk of each line and a list of
+    (index in chunk, pk, field, message). Runs in the worker pool for big
+    files.
+    """
+    pks = [line[0] if line else None for line in lines]
+    errors = []
+    # Decks repeat the same readings a lot, so check each one once.
+    checked = {}
+
+    def check(roma, code_table):
+        try:
+            return checked[roma, id(code_table)]
+        except KeyError:
+            msg = checked[roma, id(code_table)] = check_reading(roma, code_table)
+            return msg
+
+    for index, line in enumerate(lines):
+        if len(line) != 10:
+            errors.append((index, None, None, f'expected 10 fields, got {len(line)}'))
+            continue
+        pk, rk2, unic, mean, strok, on, rk1, phr, phr_kana, phr_eng = line
+        try:
+            unic = decode(unic)
+        except ValueError:
+            errors.append((index, pk, 'unicode', f'{unic} is not a code point'))
+            unic = None
+        if on:
+            msg = check(on, ROMA2KATA)
+            if msg:
+                errors.append((index, pk, '1st on', msg))
+        if phr_kana:
+            msg = check(phr_kana, ROMA2HIRA)
+            if msg:
+                errors.append((index, pk, 'exe phr kana', msg))
+        if phr:
+            try:
+                text = decode_phrase(phr)
+            except ValueError:
+                errors.append((index, pk, 'exe phr kanji', f'{phr} is not a list of code points'))
+                continue
+            if unic and unic not in text:
+                errors.append((index, pk, 'exe phr kanji', f'{text} does not contain {unic}'))
+            if not phr_kana:
+                errors.append((index, pk, 'exe phr kana', f'{text} has no reading'))
+    return pks, errors
+
+
+def find_table_entries(filename, names):
+    """
+    Yield (table name, line number, key, value) for each entry of
+    the named dict literals in a module. Read from the source because a
+    dict built from a literal silently keeps only the last duplicate.
+    """
+    with open(filename, encoding='utf-8') as f:
+        source = f.read()
+    for node in ast.parse(source).body:
+        if not (isinstance(node, ast.Assign) and isinstance(node.value, ast.Dict)):
+            continue
+        targets = [t.id for t in node.targets if isinstance(t, ast.Name)]
+        if not targets or targets[0] not in names:
+            continue
+        for key, value in zip(node.value.keys, node.value.values):
+            if isinstance(key, ast.Constant):
+                yield targets[0], key.lineno, key.value, ast.literal_eval(value)
+
+
+def validate_tables():
+    """Return (location, message) for every problem in the code tables."""
+    filename = os.path.abspath(kana.__file__)
+    location = os.path.basename(filename)
+    problems = []
+    seen = {}
+    for name, lineno, key, value in find_table_entries(filename, dict(TABLES)):
+        if (name, key) not in seen:
+            seen[name, key] = (lineno, value)
+            continue
+        first, first_value = seen[name, key]
+        kind = 'duplicate' if value == first_value else 'conflicting'
+        problems.append((f'{location}:{lineno}',
+                         f'{name}: {kind} key {key!r}, first defined on line {first}'))
+    for name, table in TABLES:
+        spellings = {}
+        for roma, code in table.items():
+            if isinstance(code, tuple):
+                missing = [part for part in code if part not in table]
+                if missing:
+                    problems.append((location, f'{name}: {roma!r} is made of undefined {missing}'))
+                    continue
+            text = "".join(decode(c) for c in RomaConverter.expand(table, roma))
+            spellings.setdefault(text, []).append(roma)
+        for text, romas in spellings.items():
+            if len(romas) > 1:
+                problems.append((location, f'{name}: {text} is spelled {" and ".join(romas)}'))
+    return problems
+
+
+def validate_deck(filename, jobs=None):
+    """
+    Yield (location, message) for every problem in the code tables and
+    in every row of a kanji CSV file.
+    """
+    yield from validate_tables()
+    # Rows are numbered as lines of the file, after the header.
+    row = 2
+    first_rows = {}
+    for pks, errors in iter_csv_file(filename, jobs, validate_rows):
+        for index, pk, field, msg in errors:
+            where = f'{filename}:{row + index}'
+            if pk is not None:
+                where += f' (pk {pk})'
+            if field:
+                msg = f'{field}: {msg}'
+            yield where, msg
+        # Duplicate pks can be in different chunks, so they are found here.
+        for index, pk in enumerate(pks):
+            first = first_rows.setdefault(pk, row + index)
+            if pk is not None and first != row + index:
+                yield f'{filename}:{row + index} (pk {pk})', f'pk is also used on row {first}'
+        row += len(pks)
@@ -0,0 +1,323 @@
+"""
+Watch mode: keep a loaded deck in step with its CSV and record file
+while they are edited by hand or by other processes. Changes are found
+by diffing, and only the rows that changed are decoded and re-indexed.
+"""
+import csv
+import json
+import os
+import time
+
+import metrics
+from cards import Card, parse_rows
+from session import initial_memory, journal_name, load_session, str2day
+
+
+# Seconds between checks for changes when there is nothing else to do.
+WATCH_INTERVAL = 1.0
+
+
+def file_state(filename):
+    """Return what identifies a version of a file, or None if it is missing."""
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def common_prefix(a, b):
+    """
+    Return the length of the common prefix of two bytes objects. Spans
+    are compared with startswith on memoryviews, which is a memcmp
+    without copying, in steps that halve from 64K down to one byte.
+    """
+    mb = memoryview(b)
+    n = min(len(a), len(b))
+    common = 0
+    step = 1 << 16
+    while step:
+        while common + step <= n and a.startswith(mb[common:common + step], common):
+            common += step
+        step >>= 1
+    return common
+
+
+def common_suffix(a, b, limit):
+    """Return the length of the common suffix of a and b, up to limit."""
+    mb = memoryview(b)
+    common = 0
+    step = 1 << 16
+    while step:
+        while common + step <= limit and a.startswith(
+                mb[len(b) - common - step:len(b) - common], len(a) - common - step):
+            common += step
+        step >>= 1
+    return common
+
+
+def changed_lines(old, new):
+    """
+    Return the lines of old and new that are not in both, leaving out
+    the header. Only the span between the first and last bytes that
+    differ is split into lines, so a small edit costs a small diff
+    however big the file is.
+    """
+    prefix = common_prefix(old, new)
+    suffix = common_suffix(old, new, min(len(old), len(new)) - prefix)
+    # Widen the span to whole lines.
+    start = new.rfind(b'\n', 0, prefix) + 1
+    end = new.find(b'\n', len(new) - suffix)
+    if end < 0:
+        end = len(new)
+    old_lines = old[start:len(old) - (len(new) - end)].splitlines()
+    new_lines = new[start:end].splitlines()
+    if start == 0:
+        old_lines, new_lines = old_lines[1:], new_lines[1:]
+    old_lines, new_lines = set(old_lines), set(new_lines)
+    return old_lines - new_lines - {b''}, new_lines - old_lines - {b''}
+
+
+# Session columns are compared this many bytes at a time.
+COLUMN_BLOCK = 4096
+
+
+def changed_rows(a, b):
+    """
+    Yield the rows where two columns of the same type differ, for the
+    rows both have. The columns may be arrays or memory-mapped views of
+    a record file; they are compared a block at a time as bytes, and
+    only blocks that differ are looked at row by row.
+    """
+    raw = memoryview(a).tobytes()
+    mb = memoryview(b).cast('B')
+    size = memoryview(a).itemsize
+    n = min(len(raw), len(mb))
+    for offset in range(0, n, COLUMN_BLOCK):
+        end = min(offset + COLUMN_BLOCK, n)
+        if not raw.startswith(mb[offset:end], offset):
+            for row in range(offset // size, end // size):
+                if a[row] != b[row]:
+                    yield row
+
+
+class DeckWatcher(object):
+    """
+    Keeps cards, a Session and the due indexes of drills up to date with
+    the files they were loaded from. Call poll() now and then; it costs a
+    few stat calls when nothing has changed.
+
+    The CSV is diffed against the last copy read: only the lines between
+    the first and last bytes that differ are looked at, and of those only
+    the lines that appeared or vanished are parsed. A line that vanished
+    and one that appeared with the same pk make an edited card. Cards are updated in place, so a card
+    already on screen shows the edit next time it is used.
+
+    Grades other processes make arrive in the journal, whose new lines
+    are read from where the last poll stopped. When the record file
+    itself is replaced (a compaction or an import) the new one is compared
+    with the session column by column, a block of bytes at a time, and
+    only the rows that differ are applied.
+    """
+
+    def __init__(self, kanji, record, cards, session, drills=()):
+        self.kanji = kanji
+        self.record = record
+        self.journal = journal_name(record)
+        self.cards = cards
+        self.session = session
+        self.drills = list(drills)
+        self.kanji_state = file_state(kanji)
+        self.raw = self.read_csv()
+        self.record_state = file_state(record)
+        self.journal_state = file_state(self.journal)
+        self.journal_offset = self.journal_state[1] if self.journal_state else 0
+
+    def indexed(self):
+        # A drill not indexed yet will index the session as it is by then.
+        return [drill for drill in self.drills if drill.due_index is not None]
+
+    def read_csv(self):
+        with open(self.kanji, 'rb') as f:
+            return f.read()
+
+    def poll(self):
+        """Pick up any changes, and return whether there were any."""
+        changed = False
+        state = file_state(self.kanji)
+        if state is not None and state != self.kanji_state:
+            self.kanji_state = state
+            changed |= self.reload_cards()
+        state = file_state(self.record)
+        if state != self.record_state:
+            self.record_state = state
+            changed |= self.reload_session()
+        state = file_state(self.journal)
+        if state != self.journal_state:
+            self.journal_state = state
+            changed |= self.read_journal()
+        return changed
+
+    def reload_cards(self):
+        raw = self.read_csv()
+        gone, added = changed_lines(self.raw, raw)
+        self.raw = raw
+        if not added and not gone:
+            return False
+        rows = list(csv.reader(line.decode() for line in added))
+        new = parse_rows([row for row in rows if len(row) == 10 and row[0].isdigit()])
+        gone = {int(row[0]) for row in csv.reader(line.decode() for line in gone)
+                if row and row[0].isdigit()}
+        metrics.count('watch_rows_decoded', len(new))
+        for pk in gone - new.keys():
+            self.remove_card(pk)
+        for pk, card in new.items():
+            self.set_card(pk, card)
+        return True
+
+    def set_card(self, pk, card):
+        old = self.cards.get(pk)
+        row = self.session.rows().get(pk)
+        if row is None:
+            row = self.session.add(pk)
+        for drill in self.indexed():
+            was = old is not None and drill.wants(old)
+            now = drill.wants(card)
+            if was != now:
+                day = drill.scheduler.due(self.session, drill.name, row)
+                if now:
+                    drill.due_index.add(row, day)
+                else:
+                    drill.due_index.remove(row, day)
+        if old is None:
+            self.cards[pk] = card
+        else:
+            for field in Card.__slots__:
+                setattr(old, field, getattr(card, field))
+
+    def remove_card(self, pk):
+        # The session keeps the card's history, as it does when a card is
+        # dropped between runs, in case it comes back.
+        old = self.cards.pop(pk, None)
+        row = self.session.rows().get(pk)
+        if old is None or row is None:
+            return
+        for drill in self.indexed():
+            if drill.wants(old):
+                drill.due_index.remove(row, drill.scheduler.due(self.session, drill.name, row))
+
+    def set_grade(self, row, name, streak, last, memory=None):
+        session = self.session
+        if session.get(name, row) == (streak, last) and (
+                memory is None or session.get_memory(name, row) == tuple(memory)):
+            return
+        drills = [drill for drill in self.indexed() if drill.name == name]
+        old = [drill.scheduler.due(session, name, row) for drill in drills]
+        session.set(name, row, streak, last)
+        if memory is not None:
+            if not session.memory:
+                session.add_memory(initial_memory(session))
+            session.set_memory(name, row, *memory)
+        for drill, day in zip(drills, old):
+            drill.due_index.move(row, day, drill.scheduler.due(session, name, row))
+
+    def row(self, k):
+        row = self.session.rows().get(k)
+        if row is None:
+            row = self.session.add(k)
+            card = self.cards.get(k)
+            if card is not None:
+                for drill in self.indexed():
+                    if drill.wants(card):
+                        drill.due_index.add(row, drill.scheduler.due(self.session, drill.name, row))
+        return row
+
+    def reload_session(self):
+        # The journal as it is now is replayed by load_session. Lines
+        # added after this are read again on the next poll, which is
+        # harmless since they hold absolute values.
+        journal = file_state(self.journal)
+        new = load_session(self.record)
+        self.journal_state = journal
+        self.journal_offset = journal[1] if journal else 0
+        session = self.session
+        names = list(new.columns)
+        common = min(len(new), len(session))
+        if memoryview(new.pks[:common]).tobytes() == memoryview(session.pks[:common]).tobytes():
+            # The usual case: the same cards in the same order, perhaps
+            # with more on the end of either.
+            rows = set(range(common, len(new)))
+            for name in names:
+                for old_col, new_col in zip(session.column(name), new.column(name)):
+                    rows.update(changed_rows(old_col, new_col))
+            if new.memory and not session.memory:
+                # The file has memory columns for the first time.
+                rows = range(len(new))
+            for name in new.memory if session.memory else ():
+                for old_col, new_col in zip(session.memory[name], new.memory[name]):
+                    rows.update(changed_rows(old_col, new_col))
+            rows = sorted(rows)
+        else:
+            rows = range(len(new))
+        if not rows:
+            return False
+        for new_row in rows:
+            row = self.row(new.key(new_row))
+            for name in names:
+                self.set_grade(row, name, *new.get(name, new_row), new.get_memory(name, new_row))
+        metrics.count('watch_session_rows', len(rows))
+        return True
+
+    def read_journal(self):
+        if self.journal_state is None or self.journal_state[1] < self.journal_offset:
+            # Removed or rewritten, which happens when the record file is
+            # saved; reload_session has seen to that.
+            self.journal_offset = self.journal_state[1] if self.journal_state else 0
+            return False
+        with open(self.journal, 'rb') as f:
+            f.seek(self.journal_offset)
+            data = f.read()
+        # Leave a line still being written for next time.
+        end = data.rfind(b'\n') + 1
+        self.journal_offset += end
+        changed = False
+        for line in data[:end].splitlines():
+            try:
+                k, name, streak, last, *memory = json.loads(line)
+                k = int(k)
+            except ValueError:
+                continue
+            self.set_grade(self.row(k), name, streak, str2day(last), memory or None)
+            metrics.count('watch_journal_lines')
+            changed = True
+        return changed
+
+
+class WatchingReviewer(object):
+    """
+    Hands everything to another reviewer, but checks the watched decks
+    for changes before each question.
+    """
+
+    def __init__(self, reviewer, watchers):
+        self.reviewer = reviewer
+        self.watchers = watchers
+
+    def __getattr__(self, name):
+        return getattr(self.reviewer, name)
+
+    def ask(self, drill, card, i, total):
+        for watcher in self.watchers:
+            watcher.poll()
+        return self.reviewer.ask(drill, card, i, total)
+
+
+def watch(watchers, changed, interval=WATCH_INTERVAL):
+    """Poll the watchers until interrupted, calling changed() after each change."""
+    try:
+        while True:
+            time.sleep(interval)
+            if any([watcher.poll() for watcher in watchers]):
+                changed()
+    except KeyboardInterrupt:
+        pass